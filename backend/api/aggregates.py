@@ -0,0 +1,194 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+import pandas as pd
+
+from api import dataset
+
+logger = logging.getLogger(__name__)
+
+# Products listed per chemical in the top-N table
+TOP_N = int(os.getenv("STATS_TOP_N", "10"))
+
+# % of tolerable daily intake thresholds that exceedance counts are reported for
+TDI_THRESHOLDS = (1, 10, 50, 100)
+TDI_VARIANTS = ("14_kg_epa", "70_kg_epa", "14_kg_efsa", "70_kg_efsa")
+
+CONCENTRATION_SUFFIX = "_ng_g"
+
+
+def chemicals(df: pd.DataFrame) -> List[str]:
+    """Chemical names, from the measured-concentration columns (e.g. DEHP_ng_g)."""
+    return [
+        column[: -len(CONCENTRATION_SUFFIX)]
+        for column in df.columns
+        if column.endswith(CONCENTRATION_SUFFIX) and "percentile" not in column
+    ]
+
+
+def to_numeric(series: pd.Series) -> pd.Series:
+    """Measurements are strings; non-detects such as '<10' or '<LOQ' become NaN."""
+    return pd.to_numeric(series, errors="coerce")
+
+
+def file_version(path=dataset.SAMPLES_PATH) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def chemical_summary(df: pd.DataFrame) -> Dict[str, Dict]:
+    summary = {}
+    for chemical in chemicals(df):
+        values = to_numeric(df[f"{chemical}{CONCENTRATION_SUFFIX}"])
+        detected = values.dropna()
+        summary[chemical] = {
+            "samples": int(df[f"{chemical}{CONCENTRATION_SUFFIX}"].notna().sum()),
+            "detected": int(detected.size),
+            "min_ng_g": float(detected.min()) if detected.size else None,
+            "median_ng_g": float(detected.median()) if detected.size else None,
+            "max_ng_g": float(detected.max()) if detected.size else None,
+        }
+    return summary
+
+
+def top_products(df: pd.DataFrame, top_n: int = TOP_N) -> Dict[str, List[Dict]]:
+    """Highest mean detected concentration per product, for each chemical."""
+    table = {}
+    for chemical in chemicals(df):
+        values = to_numeric(df[f"{chemical}{CONCENTRATION_SUFFIX}"])
+        per_product = (
+            pd.DataFrame(
+                {
+                    "product": df["product"],
+                    "product_id": df["product_id"],
+                    "value": values,
+                }
+            )
+            .dropna(subset=["value"])
+            .groupby(["product", "product_id"], sort=False)["value"]
+            .agg(["mean", "max", "count"])
+            .sort_values("mean", ascending=False)
+            .head(top_n)
+        )
+        table[chemical] = [
+            {
+                "product": product,
+                "product_id": int(product_id),
+                "mean_ng_g": round(float(row["mean"]), 3),
+                "max_ng_g": float(row["max"]),
+                "detected_samples": int(row["count"]),
+            }
+            for (product, product_id), row in per_product.iterrows()
+        ]
+    return table
+
+
+def tag_counts(df: pd.DataFrame) -> Dict[str, Dict]:
+    tags = df[["product", "tags"]].dropna().copy()
+    tags["tag"] = tags["tags"].str.split(",")
+    tags = tags.explode("tag")
+    tags["tag"] = tags["tag"].str.strip()
+    grouped = tags.groupby("tag").agg(
+        samples=("product", "size"), products=("product", "nunique")
+    )
+    grouped = grouped.sort_values("samples", ascending=False)
+    return {
+        tag: {"samples": int(row["samples"]), "products": int(row["products"])}
+        for tag, row in grouped.iterrows()
+    }
+
+
+def tdi_exceedances(df: pd.DataFrame) -> Dict[str, Dict]:
+    """Samples at or above each % TDI threshold, per chemical and TDI variant."""
+    table = {}
+    for chemical in chemicals(df):
+        variants = {}
+        for variant in TDI_VARIANTS:
+            column = f"{chemical}_percent_tdi_{variant}"
+            if column not in df.columns:
+                continue
+            values = to_numeric(df[column])
+            if values.notna().sum() == 0:
+                continue
+            variants[variant] = {
+                str(threshold): int((values >= threshold).sum())
+                for threshold in TDI_THRESHOLDS
+            }
+        if variants:
+            table[chemical] = variants
+    return table
+
+
+def compute_stats(df: pd.DataFrame, version: str) -> Dict:
+    start = time.perf_counter()
+    stats = {
+        "version": version,
+        "samples": int(len(df)),
+        "products": int(df["product"].nunique()),
+        "chemicals": chemical_summary(df),
+        "top_products": top_products(df),
+        "tags": tag_counts(df),
+        "tdi_exceedances": tdi_exceedances(df),
+    }
+    logger.info(
+        "Computed dataset stats %s in %.1f ms",
+        version,
+        (time.perf_counter() - start) * 1000,
+    )
+    return stats
+
+
+@functools.lru_cache(maxsize=None)
+def load_stats() -> Dict:
+    """Aggregates for the loaded dataset, computed once per process."""
+    return compute_stats(dataset.load_samples(), file_version())
+
+
+@functools.lru_cache(maxsize=None)
+def stats_json() -> bytes:
+    """The /api/stats payload, serialized once."""
+    return json.dumps(load_stats(), separators=(",", ":")).encode("utf-8")
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:g}"
+
+
+@functools.lru_cache(maxsize=None)
+def stats_context(top_n: int = 3) -> str:
+    """Compact text version of the aggregates for the system prompt."""
+    stats = load_stats()
+    lines = [
+        f"Precomputed dataset statistics (dataset version {stats['version']}, "
+        f"{stats['samples']} samples of {stats['products']} products). "
+        "Concentrations are in ng/g over detected samples only; values below "
+        "the limit of quantification are counted as not detected.",
+        "chemical: detected/samples, min/median/max ng/g; top products by mean "
+        "ng/g; samples at >=1/10/100% of EPA TDI (70 kg)",
+    ]
+    for chemical, summary in stats["chemicals"].items():
+        top = "; ".join(
+            f"{entry['product']} ({entry['mean_ng_g']:g})"
+            for entry in stats["top_products"][chemical][:top_n]
+        )
+        exceedances = stats["tdi_exceedances"].get(chemical, {}).get("70_kg_epa")
+        tdi = (
+            "/".join(str(exceedances[str(t)]) for t in (1, 10, 100))
+            if exceedances
+            else "no RfD"
+        )
+        lines.append(
+            f"{chemical}: {summary['detected']}/{summary['samples']}, "
+            f"{_fmt(summary['min_ng_g'])}/{_fmt(summary['median_ng_g'])}/"
+            f"{_fmt(summary['max_ng_g'])}; top: {top or '-'}; TDI: {tdi}"
+        )
+    tags = ", ".join(
+        f"{tag} ({entry['samples']})" for tag, entry in list(stats["tags"].items())[:25]
+    )
+    lines.append(f"Most common tags (samples): {tags}")
+    return "\n".join(lines)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+# Questions accepted per batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Answers generated at once per batch, by default and at most
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+# Retrievals run at once; high enough that query embeddings fill whole batches
+BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("BATCH_RETRIEVAL_CONCURRENCY", "32"))
+
+BATCH_ITEMS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_batch_items_total",
+        "Batch questions by outcome (ok, error).",
+        labelnames=("status",),
+    )
+)
+
+
+@dataclass
+class BatchItem:
+    id: str
+    question: str
+
+
+# Prepares an item for generation (routing, retrieval); the result is handed
+# to Generate, in the same task
+Retrieve = Callable[[BatchItem], Awaitable[Any]]
+# Answers one prepared item; returns at least "status"
+Generate = Callable[[BatchItem, Any], Awaitable[Dict]]
+
+
+def parse_items(entries: List[Dict]) -> List[BatchItem]:
+    """Items from {"question", "id"?} entries; ids default to the position.
+
+    Raises ValueError for an empty, oversized or ambiguous batch.
+    """
+    if not entries:
+        raise ValueError("no questions given")
+    if len(entries) > BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {BATCH_MAX_ITEMS} questions per batch")
+    items = []
+    seen = set()
+    for position, entry in enumerate(entries):
+        question = (entry.get("question") or "").strip()
+        if not question:
+            raise ValueError(f"item {position} has no question")
+        item_id = str(entry.get("id") if entry.get("id") is not None else position)
+        if item_id in seen:
+            raise ValueError(f"duplicate item id {item_id!r}")
+        seen.add(item_id)
+        items.append(BatchItem(item_id, question))
+    return items
+
+
+async def run_batch(
+    items: List[BatchItem],
+    retrieve: Retrieve,
+    generate: Generate,
+    concurrency: int = BATCH_CONCURRENCY,
+    retrieval_concurrency: int = BATCH_RETRIEVAL_CONCURRENCY,
+) -> AsyncIterator[Dict]:
+    """One result per item, in the order they finish.
+
+    Retrieval for every item starts at once (up to `retrieval_concurrency`
+    in flight), so embeddings and index queries overlap; generation runs
+    under the tighter `concurrency` cap as contexts become ready. A failing
+    item yields status "error" and doesn't stop the rest. Closing the
+    iterator cancels whatever is still running.
+    """
+    retrieval_slots = asyncio.Semaphore(retrieval_concurrency)
+    generation_slots = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def run_item(item: BatchItem):
+        start = time.perf_counter()
+        try:
+            async with retrieval_slots:
+                prepared = await retrieve(item)
+            async with generation_slots:
+                result = await generate(item, prepared)
+        except Exception as e:
+            logger.warning("Batch item %s failed: %s", item.id, e)
+            result = {"status": "error", "error": str(e)}
+        BATCH_ITEMS.inc(status=result.get("status", "error"))
+        await results.put(
+            {
+                "id": item.id,
+                "question": item.question,
+                **result,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+        )
+
+    tasks = [asyncio.create_task(run_item(item)) for item in items]
+    try:
+        for _ in items:
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
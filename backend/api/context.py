@@ -0,0 +1,211 @@
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from api.usage import estimate_tokens
+
+# Candidates fetched from each index before scoring and budgeting
+GENERAL_CANDIDATES = int(os.getenv("CONTEXT_GENERAL_CANDIDATES", "8"))
+TSV_CANDIDATES = int(os.getenv("CONTEXT_TSV_CANDIDATES", "12"))
+
+# Approximate token budget for the whole retrieved-context section of the prompt
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3500"))
+
+# Matches below MIN_SCORE, or more than SCORE_MARGIN below the best match from the
+# same index, are dropped
+MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.2"))
+SCORE_MARGIN = float(os.getenv("CONTEXT_SCORE_MARGIN", "0.25"))
+
+# Standard reciprocal-rank-fusion damping constant
+RRF_K = 60
+
+# Longest overlap searched for when chunks carry no start_index
+MAX_TEXT_OVERLAP = 400
+
+
+@dataclass
+class Passage:
+    id: str
+    text: str
+    score: float
+    kind: str  # "general" or "tsv"
+    source: Optional[str] = None
+    chunk_index: Optional[int] = None
+    start_index: Optional[int] = None
+
+
+def passages_from_matches(matches, kind: str) -> List[Passage]:
+    """Normalize Pinecone matches (objects or dicts) into passages."""
+    passages = []
+    for match in matches:
+        metadata = match["metadata"] or {}
+        chunk_index = metadata.get("chunk_index")
+        start_index = metadata.get("start_index")
+        passages.append(
+            Passage(
+                id=match["id"],
+                text=metadata.get("text", ""),
+                score=float(match["score"] or 0.0),
+                kind=kind,
+                source=metadata.get("source"),
+                chunk_index=int(chunk_index) if chunk_index is not None else None,
+                start_index=int(start_index) if start_index is not None else None,
+            )
+        )
+    return passages
+
+
+def _text_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of `first` that is a prefix of `second`."""
+    for size in range(min(len(first), len(second), MAX_TEXT_OVERLAP), 0, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def _overlap(earlier: Passage, later: Passage) -> int:
+    """Characters shared between two consecutive chunks of the same source."""
+    if earlier.start_index is not None and later.start_index is not None:
+        shared = earlier.start_index + len(earlier.text) - later.start_index
+        if 0 < shared < len(later.text) and earlier.text.endswith(later.text[:shared]):
+            return shared
+    return _text_overlap(earlier.text, later.text)
+
+
+def _trim_against_neighbours(passage: Passage, chosen: Dict[tuple, Passage]) -> str:
+    """Remove text already covered by selected neighbouring chunks."""
+    text = passage.text
+    if passage.kind != "general" or passage.chunk_index is None:
+        return text
+
+    previous = chosen.get((passage.source, passage.chunk_index - 1))
+    following = chosen.get((passage.source, passage.chunk_index + 1))
+    head = _overlap(previous, passage) if previous else 0
+    tail = _overlap(passage, following) if following else 0
+    if head + tail >= len(text):
+        return ""
+    return text[head : len(text) - tail]
+
+
+def drop_tail(
+    passages: List[Passage], min_score: float = None, score_margin: float = None
+) -> List[Passage]:
+    """Drop vector matches that score too low in absolute terms or vs. the best one."""
+    min_score = MIN_SCORE if min_score is None else min_score
+    score_margin = SCORE_MARGIN if score_margin is None else score_margin
+
+    best: Dict[str, float] = {}
+    for passage in passages:
+        best[passage.kind] = max(best.get(passage.kind, passage.score), passage.score)
+    return [
+        p for p in passages if p.score >= max(min_score, best[p.kind] - score_margin)
+    ]
+
+
+def fill_budget(ranked: List[Passage], token_budget: int = None) -> List[Passage]:
+    """Take passages in the given order until the token budget is filled.
+
+    Duplicate texts are skipped and the overlap between adjacent chunks of
+    the same source is only kept once.
+    """
+    token_budget = TOKEN_BUDGET if token_budget is None else token_budget
+
+    chosen: Dict[tuple, Passage] = {}
+    selected: List[Passage] = []
+    seen_text = set()
+    used = 0
+    for passage in ranked:
+        if passage.text in seen_text:
+            continue
+        text = _trim_against_neighbours(passage, chosen)
+        if not text.strip():
+            continue
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            # A smaller, lower-ranked passage may still fit
+            continue
+        used += cost
+        seen_text.add(passage.text)
+        trimmed = Passage(**{**passage.__dict__, "text": text})
+        selected.append(trimmed)
+        if passage.chunk_index is not None:
+            chosen[(passage.source, passage.chunk_index)] = trimmed
+    return selected
+
+
+def select_passages(
+    passages: List[Passage],
+    token_budget: int = None,
+    min_score: float = None,
+    score_margin: float = None,
+) -> List[Passage]:
+    """Drop the low-score tail, then fill the token budget by score."""
+    kept = drop_tail(passages, min_score=min_score, score_margin=score_margin)
+    ranked = sorted(kept, key=lambda p: p.score, reverse=True)
+    return fill_budget(ranked, token_budget=token_budget)
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[List[Passage]], k: int = RRF_K
+) -> List[Passage]:
+    """Merge ranked lists; each list contributes 1 / (k + rank) per passage."""
+    fused: Dict[str, float] = defaultdict(float)
+    first_seen: Dict[str, Passage] = {}
+    for ranking in rankings:
+        for rank, passage in enumerate(ranking, start=1):
+            fused[passage.id] += 1.0 / (k + rank)
+            first_seen.setdefault(passage.id, passage)
+    return [
+        Passage(**{**first_seen[id].__dict__, "score": fused[id]})
+        for id in sorted(fused, key=fused.get, reverse=True)
+    ]
+
+
+def fuse(
+    vector_passages: List[Passage], lexical_passages: List[Passage]
+) -> List[Passage]:
+    """Fuse vector and lexical rankings per corpus, then interleave by fused score."""
+    fused = []
+    for kind in ("general", "tsv"):
+        vector_ranked = sorted(
+            (p for p in vector_passages if p.kind == kind),
+            key=lambda p: p.score,
+            reverse=True,
+        )
+        lexical_ranked = [p for p in lexical_passages if p.kind == kind]
+        fused.extend(reciprocal_rank_fusion([vector_ranked, lexical_ranked]))
+    return sorted(fused, key=lambda p: p.score, reverse=True)
+
+
+def format_context(selected: List[Passage]) -> str:
+    """Render passages in the prompt layout used by get_relevant_context."""
+    general = sorted(
+        (p for p in selected if p.kind == "general"),
+        key=lambda p: (p.source or "", p.chunk_index or 0),
+    )
+    tsv = [p for p in selected if p.kind == "tsv"]
+
+    general_context = "\n\n".join(
+        f"Content from general knowledge ({p.id}):\n{p.text}" for p in general
+    )
+    tsv_context = "\n\n".join(
+        f"TSV Entry {i + 1}:\n{p.text}" for i, p in enumerate(tsv)
+    )
+    return f"General Knowledge:\n{general_context}\n\nTSV Data:\n{tsv_context}"
+
+
+def assemble_context(
+    general_matches,
+    tsv_matches,
+    token_budget: int = None,
+    lexical_passages: Optional[List[Passage]] = None,
+) -> str:
+    """Build the retrieved-context section from vector (and lexical) results."""
+    passages = passages_from_matches(general_matches, "general")
+    passages += passages_from_matches(tsv_matches, "tsv")
+    if not lexical_passages:
+        return format_context(select_passages(passages, token_budget=token_budget))
+
+    ranked = fuse(drop_tail(passages), lexical_passages)
+    return format_context(fill_budget(ranked, token_budget=token_budget))
@@ -0,0 +1,72 @@
+import functools
+import logging
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SAMPLES_PATH = BACKEND_DIR / "data" / "raw" / "samples.tsv"
+
+# Columns that describe a sample (as opposed to measurements); used for row text
+IMPORTANT_COLUMNS = [
+    "id",
+    "product_id",
+    "product",
+    "tags",
+    "triplicate_1_sample_id",
+    "triplicate_2_sample_id",
+    "lot_no",
+    "manufacturing_date",
+    "expiration_date",
+    "collected_on",
+    "collected_at",
+    "collection_notes",
+    "blinded_name",
+    "blinded_photo",
+    "shipped_on",
+    "shipped_in",
+    "shipment_type",
+    "arrived_at_lab_on",
+    "analysis_method_phthalates",
+    "analysis_method_bisphenols",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def load_samples(path: str = str(SAMPLES_PATH)) -> pd.DataFrame:
+    """Load samples.tsv once per process."""
+    df = pd.read_csv(path, sep="\t", low_memory=False)
+    logger.info("Loaded %d samples from %s", len(df), path)
+    return df
+
+
+def format_row_text(row) -> str:
+    """Format a row's descriptive fields as 'col: value | col: value'."""
+    text_parts = []
+    for col in IMPORTANT_COLUMNS:
+        value = row[col]
+        if pd.notna(value) and value != "":
+            value = str(value).strip()
+            if value:
+                text_parts.append(f"{col}: {value}")
+    return " | ".join(text_parts)
+
+
+def format_rows(df: pd.DataFrame) -> List[str]:
+    """format_row_text for every row, without the cost of iterrows()."""
+    columns = [col for col in IMPORTANT_COLUMNS if col in df.columns]
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    texts = []
+    for record in values.itertuples(index=False, name=None):
+        parts = []
+        for col, value in zip(columns, record):
+            if value is None:
+                continue
+            value = str(value).strip()
+            if value:
+                parts.append(f"{col}: {value}")
+        texts.append(" | ".join(parts))
+    return texts
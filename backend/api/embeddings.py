@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from api import metrics, ratelimit
+
+logger = logging.getLogger(__name__)
+
+# How long the first text of a batch waits for company, and the most texts
+# sent in one call (Voyage accepts up to 128)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "32"))
+
+BATCH_SIZE = metrics.REGISTRY.register(
+    metrics.Histogram(
+        "plasticlist_embedding_batch_size",
+        "Texts per outbound embedding call.",
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+    )
+)
+COALESCED = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_embedding_coalesced_total",
+        "Embedding requests answered by an identical text already queued or in flight.",
+    )
+)
+
+# Embeds a batch of texts at a rate-limit priority; returns their vectors in
+# order and the total tokens billed
+EmbedBatch = Callable[[List[str], int], Awaitable[Tuple[List[List[float]], int]]]
+
+
+class EmbeddingBatcher:
+    """Collects concurrent embedding requests into batched calls.
+
+    A text waits up to `window` seconds for others, or until `max_items`
+    are queued, then one call embeds them all. A text that is already
+    queued or in flight shares that request's result. Each text's share of
+    the billed tokens goes to one of its waiters, so usage can be recorded
+    per query without counting a coalesced text twice. A batch is admitted
+    at the most urgent priority among its texts.
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatch,
+        window: float = EMBED_BATCH_WINDOW_MS / 1000,
+        max_items: int = EMBED_BATCH_MAX_ITEMS,
+    ):
+        self.embed_batch = embed_batch
+        self.window = window
+        self.max_items = max_items
+        self._queued: Dict[str, asyncio.Future] = {}
+        self._priority = ratelimit.BATCH
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    async def embed(
+        self, text: str, priority: int = ratelimit.INTERACTIVE
+    ) -> Tuple[List[float], int]:
+        """The text's vector and its share of the batch's tokens."""
+        if text not in self._in_flight:
+            self._priority = min(self._priority, priority)
+        future = self._queued.get(text) or self._in_flight.get(text)
+        if future is not None:
+            COALESCED.inc()
+        else:
+            future = asyncio.get_running_loop().create_future()
+            # A batch can fail after every waiter has gone; don't warn about it
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._queued[text] = future
+            if len(self._queued) >= self.max_items:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.window, self._flush
+                )
+        # Shielded, so one waiter leaving doesn't cancel the others' result
+        vector, share = await asyncio.shield(future)
+        # The text was billed once: the first waiter back records its tokens,
+        # any others sharing the result record none
+        tokens, share[0] = share[0], 0
+        return vector, tokens
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._queued:
+            return
+        batch, self._queued = self._queued, {}
+        priority, self._priority = self._priority, ratelimit.BATCH
+        self._in_flight.update(batch)
+        task = asyncio.ensure_future(self._send(batch, priority))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: Dict[str, asyncio.Future], priority: int):
+        texts = list(batch)
+        BATCH_SIZE.observe(len(texts))
+        try:
+            vectors, tokens = await self.embed_batch(texts, priority)
+            if len(vectors) != len(texts):
+                raise ValueError(
+                    f"expected {len(texts)} embeddings, got {len(vectors)}"
+                )
+            # Split the billed tokens in proportion to each text's size,
+            # rounding cumulatively so the shares add up to the bill
+            estimates = [ratelimit.estimate_tokens(text) for text in texts]
+            total = max(sum(estimates), 1)
+            billed = seen = 0
+            for text, vector, estimate in zip(texts, vectors, estimates):
+                seen += estimate
+                share = [round(tokens * seen / total) - billed]
+                billed += share[0]
+                if not batch[text].done():
+                    batch[text].set_result((vector, share))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for text, future in batch.items():
+                if self._in_flight.get(text) is future:
+                    del self._in_flight[text]
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Finished follow-ups kept in memory, so repeat requests skip the database
+FOLLOWUP_CACHE_SIZE = int(os.getenv("FOLLOWUP_CACHE_SIZE", "512"))
+
+FOLLOWUP_PROMPT = """Based on this Q&A:
+Q: {question}
+A: {answer}
+
+Generate exactly 3 follow-up questions that would be good to ask next. Format them exactly like this:
+FOLLOWUP1: [first question]
+FOLLOWUP2: [second question]
+FOLLOWUP3: [third question]
+
+Make sure each question starts with FOLLOWUPn: on its own line. Questions should be concise and directly related to the previous answer."""
+
+
+def followup_prompt(question: str, answer: str) -> str:
+    return FOLLOWUP_PROMPT.format(question=question, answer=answer)
+
+
+class FollowupJob:
+    """Text of one follow-up generation, readable while it is still being written."""
+
+    def __init__(self, query_id: str):
+        self.query_id = query_id
+        self.text = ""
+        self.error: Optional[BaseException] = None
+        self.done = asyncio.Event()
+        self._subscribers: List[asyncio.Queue] = []
+
+    def publish(self, delta: str):
+        self.text += delta
+        for queue in self._subscribers:
+            queue.put_nowait(delta)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.done.set()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+
+    async def wait(self) -> str:
+        await self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Text so far, then each new delta until the job finishes."""
+        if self.text:
+            yield self.text
+        if self.done.is_set():
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is None:
+                    break
+                yield delta
+        finally:
+            self._subscribers.remove(queue)
+
+
+Generator = Callable[[FollowupJob], Awaitable[None]]
+
+
+class FollowupRegistry:
+    """Follow-up jobs by query id: in flight, or finished and cached."""
+
+    def __init__(self, cache_size: int = FOLLOWUP_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.jobs: "OrderedDict[str, FollowupJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def get(self, query_id: str) -> Optional[FollowupJob]:
+        job = self.jobs.get(query_id)
+        if job is not None:
+            self.jobs.move_to_end(query_id)
+        return job
+
+    def start(self, query_id: str, generate: Generator) -> FollowupJob:
+        """Run `generate` in the background, unless a job for the query exists."""
+        job = self.get(query_id)
+        if job is not None:
+            return job
+        job = FollowupJob(query_id)
+        self.jobs[query_id] = job
+        self._tasks[query_id] = asyncio.create_task(self._run(job, generate))
+        return job
+
+    async def _run(self, job: FollowupJob, generate: Generator):
+        error = None
+        try:
+            await generate(job)
+        except asyncio.CancelledError:
+            # Readers get an error rather than the cancellation of another task
+            error = RuntimeError("Follow-up generation was cancelled")
+            raise
+        except Exception as e:
+            logger.error("Follow-up generation failed for %s: %s", job.query_id, e)
+            error = e
+        finally:
+            if error is not None:
+                # A failed job is not cached, so the next request retries it
+                self.jobs.pop(job.query_id, None)
+            job.finish(error)
+            self._tasks.pop(job.query_id, None)
+            self._evict()
+
+    def _evict(self):
+        finished = [
+            query_id for query_id, job in self.jobs.items() if job.done.is_set()
+        ]
+        for query_id in finished[: max(0, len(self.jobs) - self.cache_size)]:
+            del self.jobs[query_id]
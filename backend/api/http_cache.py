@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Completed answers never change; let browsers and CDNs keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Changing resources may be stored but must be revalidated (cheap with a 304)
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# JSON bodies smaller than this go out uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+GZIP_LEVEL = 6
+
+
+def etag(body: bytes) -> str:
+    """Weak validator over the body; weak so it survives compression."""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """A stored ISO timestamp as an aware UTC datetime; naive values are UTC."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def last_modified(timestamps: Iterable[Optional[str]]) -> Optional[datetime]:
+    parsed = [value for value in map(parse_timestamp, timestamps) if value]
+    return max(parsed) if parsed else None
+
+
+def is_not_modified(
+    headers: Headers, tag: str, modified: Optional[datetime] = None
+) -> bool:
+    """Whether the request's validators still match (If-None-Match wins)."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        opaque = tag.removeprefix("W/")
+        return any(
+            candidate.strip().removeprefix("W/") == opaque
+            for candidate in if_none_match.split(",")
+        )
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates have one-second resolution
+        return modified.replace(microsecond=0) <= since
+    return False
+
+
+def cached_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    cache_control: str,
+    modified: Optional[datetime] = None,
+) -> Response:
+    """`body` with validators, or an empty 304 when the client's copy is current."""
+    tag = etag(body)
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    if is_not_modified(request.headers, tag, modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+class GZipJSONMiddleware:
+    """Gzip JSON responses sent in one body, for clients that accept it.
+
+    Streams (SSE answers and follow-ups) and anything else pass through
+    untouched, so compression never holds back a streamed event.
+    """
+
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get(
+            "accept-encoding", ""
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if content_type.startswith("application/json") and (
+                    "content-encoding" not in headers
+                ):
+                    # Hold the headers until the body shows whether to compress
+                    start = message
+                    return
+            elif message["type"] == "http.response.body" and start is not None:
+                held, start = start, None
+                body = message.get("body", b"")
+                if not message.get("more_body") and len(body) >= self.minimum_size:
+                    body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+                    headers = MutableHeaders(raw=held["headers"])
+                    headers["Content-Encoding"] = "gzip"
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
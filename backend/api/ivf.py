@@ -0,0 +1,392 @@
+import json
+import logging
+import math
+import os
+import time
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from api.vector_index import normalize, sidecar_path
+
+logger = logging.getLogger(__name__)
+
+# Share of the lists probed per query. Recall at a fixed share holds as the
+# index grows (0.3 keeps overlap@10 with exact search >= 0.96 from 1k to 100k
+# vectors in bench/retrieval_eval.py), but so does the share of vectors
+# scanned: cost stays linear in the corpus, about 0.3x a flat scan
+IVF_PROBE_FRACTION = float(os.getenv("IVF_PROBE_FRACTION", "0.3"))
+# k-means training: passes over the sample, and sample points per list
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_POINTS_PER_LIST = 40
+# Inserts are kept apart until they exceed this fraction of the index
+IVF_COMPACT_FRACTION = 0.1
+# Rows assigned to lists per step, bounding the score matrix
+ASSIGN_CHUNK_ROWS = 4096
+
+# Files written next to a vector store; the json is written last and marks
+# a complete set
+IVF_FILES = (
+    "ivf_centroids.npy",
+    "ivf_offsets.npy",
+    "ivf_vectors.npy",
+    "ivf_ids.npy",
+    "ivf_metadata.jsonl",
+    "ivf_metadata_offsets.npy",
+    "ivf_delta.npy",
+    "ivf.json",
+)
+
+
+def default_nlist(count: int) -> int:
+    """2·√n lists: scanning the centroids costs little next to the lists probed."""
+    return max(1, min(count, int(2 * math.sqrt(count))))
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The nearest centroid (by cosine) of each normalized vector."""
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = vectors[start : start + ASSIGN_CHUNK_ROWS]
+        lists[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return lists
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = IVF_TRAIN_ITERATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """Spherical k-means over a sample of the normalized vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * IVF_TRAIN_POINTS_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        lists = assign(sample, centroids)
+        order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = normalize(np.add.reduceat(sample[order], starts, axis=0))
+        # An empty list restarts from a random point rather than staying dead
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+def _save(path, suffix: str, array: np.ndarray):
+    """Write through a temporary file, so a reader's memory map keeps the old data."""
+    target = sidecar_path(path, suffix)
+    temporary = target.with_name(target.name + ".tmp")
+    with open(temporary, "wb") as f:
+        np.save(f, array)
+    os.replace(temporary, target)
+
+
+def _save_records(path, records: Sequence[Dict]):
+    """Write records one JSON line each, with the byte offset of every line."""
+    lines = [json.dumps(record).encode() + b"\n" for record in records]
+    target = sidecar_path(path, "ivf_metadata.jsonl")
+    temporary = target.with_name(target.name + ".tmp")
+    with open(temporary, "wb") as f:
+        f.writelines(lines)
+    os.replace(temporary, target)
+    offsets = np.cumsum([0] + [len(line) for line in lines], dtype=np.int64)
+    _save(path, "ivf_metadata_offsets.npy", offsets)
+
+
+class MappedRecords(SequenceABC):
+    """Records written by _save_records, parsed from a memory map when indexed."""
+
+    def __init__(self, path):
+        self.offsets = np.load(
+            sidecar_path(path, "ivf_metadata_offsets.npy"), mmap_mode="r"
+        )
+        lines = sidecar_path(path, "ivf_metadata.jsonl")
+        # An empty file can't be mapped
+        self.data = (
+            np.memmap(lines, dtype=np.uint8, mode="r")
+            if os.path.getsize(lines)
+            else np.empty(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Dict:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return json.loads(self.data[self.offsets[i] : self.offsets[i + 1]].tobytes())
+
+
+class IVFIndex:
+    """Inverted-file index: vectors grouped by nearest k-means centroid.
+
+    A query scores the centroids, then only the vectors in the closest
+    lists: `nprobe` of them if set, else IVF_PROBE_FRACTION of all lists.
+    Probing a fixed share scans about that share of the corpus, so a query
+    costs a constant fraction of a flat scan rather than staying flat as the
+    corpus grows. Lists are stored contiguously in one file; once saved, the
+    list vectors, their ids and their metadata are memory-mapped, and
+    metadata is parsed only for the matches returned. Inserts are assigned
+    to the trained centroids and kept in a small in-memory delta until
+    `compact` (run by `save` past IVF_COMPACT_FRACTION) merges them into the
+    lists; retraining needs a rebuild. Same query interface as ExactIndex.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        vectors: np.ndarray,
+        ids: Sequence[str],
+        metadata: Sequence[Dict],
+        delta: Optional[np.ndarray] = None,
+        delta_ids: Optional[List[str]] = None,
+        delta_metadata: Optional[List[Dict]] = None,
+        nprobe: Optional[int] = None,
+        path=None,
+    ):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self.metadata = metadata
+        self.delta = (
+            np.empty((0, centroids.shape[1]), dtype=np.float32)
+            if delta is None
+            else delta
+        )
+        self.delta_ids = delta_ids or []
+        self.delta_metadata = delta_metadata or []
+        self.delta_lists = assign(self.delta, centroids)
+        self.nprobe = nprobe
+        self.path = path
+        # Every indexed id, built on the first insert rather than at load
+        self._known = None
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        vectors: np.ndarray,
+        metadata: List[Dict],
+        nlist: Optional[int] = None,
+        seed: int = 0,
+        nprobe: Optional[int] = None,
+    ) -> "IVFIndex":
+        """Train centroids over the vectors and group them into lists, in memory."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        centroids = train_centroids(
+            vectors, nlist or default_nlist(len(ids)), seed=seed
+        )
+        index = cls(
+            centroids,
+            np.zeros(len(centroids) + 1, dtype=np.int64),
+            vectors[:0],
+            [],
+            [],
+            delta=vectors,
+            delta_ids=list(ids),
+            delta_metadata=list(metadata),
+            nprobe=nprobe,
+        )
+        index.compact()
+        return index
+
+    @classmethod
+    def open(cls, path, nprobe: Optional[int] = None) -> "IVFIndex":
+        """Index persisted next to the vector file at `path`.
+
+        Centroids, offsets and the delta are read into memory; the lists'
+        vectors, ids and metadata are memory-mapped.
+        """
+        with open(sidecar_path(path, "ivf.json"), "r") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(sidecar_path(path, "ivf_centroids.npy")),
+            np.load(sidecar_path(path, "ivf_offsets.npy")),
+            np.load(sidecar_path(path, "ivf_vectors.npy"), mmap_mode="r"),
+            np.load(sidecar_path(path, "ivf_ids.npy"), mmap_mode="r"),
+            MappedRecords(path),
+            delta=np.load(sidecar_path(path, "ivf_delta.npy")),
+            delta_ids=meta["delta_ids"],
+            delta_metadata=meta["delta_metadata"],
+            nprobe=nprobe,
+            path=path,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.delta_ids)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def probes(self) -> int:
+        """Lists probed per query."""
+        if self.nprobe:
+            return min(self.nprobe, self.nlist)
+        return max(1, min(self.nlist, math.ceil(IVF_PROBE_FRACTION * self.nlist)))
+
+    @property
+    def nbytes(self) -> int:
+        """Arrays held in-process, leaving out memory-mapped lists and the delta's records."""
+        held = self.centroids.nbytes + self.offsets.nbytes + self.delta.nbytes
+        for array in (self.vectors, self.ids):
+            if isinstance(array, np.ndarray) and not isinstance(array, np.memmap):
+                held += array.nbytes
+        return held
+
+    def insert(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        """Add vectors under the trained centroids, without retraining."""
+        if self._known is None:
+            self._known = set(self.ids) | set(self.delta_ids)
+        duplicates = self._known.intersection(ids)
+        if duplicates or len(set(ids)) != len(ids):
+            raise ValueError(f"ids already indexed: {sorted(duplicates)[:5]}")
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        self.delta = np.concatenate([self.delta, vectors])
+        self.delta_lists = np.concatenate(
+            [self.delta_lists, assign(vectors, self.centroids)]
+        )
+        self.delta_ids.extend(ids)
+        self.delta_metadata.extend(metadata)
+        self._known.update(ids)
+
+    def compact(self):
+        """Merge inserted vectors into the lists, keeping the centroids."""
+        if not self.delta_ids:
+            return
+        base_lists = np.repeat(
+            np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets)
+        )
+        lists = np.concatenate([base_lists, self.delta_lists])
+        order = np.argsort(lists, kind="stable")
+        vectors = np.concatenate([np.asarray(self.vectors), self.delta])[order]
+        ids = [str(item_id) for item_id in self.ids] + self.delta_ids
+        metadata = list(self.metadata) + self.delta_metadata
+        self.vectors = vectors
+        self.ids = [ids[i] for i in order]
+        self.metadata = [metadata[i] for i in order]
+        self.offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(lists, minlength=self.nlist)))
+        ).astype(np.int64)
+        self.delta = self.delta[:0]
+        self.delta_lists = self.delta_lists[:0]
+        self.delta_ids = []
+        self.delta_metadata = []
+
+    def save(self, path=None):
+        """Persist next to the vector file at `path` (default: where it was opened).
+
+        Only a small delta is rewritten on its own; a large one is merged
+        into the lists first.
+        """
+        path = path or self.path
+        if len(self.delta_ids) > IVF_COMPACT_FRACTION * max(len(self.ids), 1):
+            self.compact()
+        if path != self.path or not isinstance(self.vectors, np.memmap):
+            _save(path, "ivf_centroids.npy", self.centroids)
+            _save(path, "ivf_offsets.npy", self.offsets)
+            _save(path, "ivf_vectors.npy", np.asarray(self.vectors))
+            _save(path, "ivf_ids.npy", np.array(self.ids, dtype=str))
+            _save_records(path, self.metadata)
+        _save(path, "ivf_delta.npy", self.delta)
+        meta = {"delta_ids": self.delta_ids, "delta_metadata": self.delta_metadata}
+        temporary = sidecar_path(path, "ivf.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(meta, f)
+        os.replace(temporary, sidecar_path(path, "ivf.json"))
+        self.path = path
+        self.vectors = np.load(sidecar_path(path, "ivf_vectors.npy"), mmap_mode="r")
+        self.ids = np.load(sidecar_path(path, "ivf_ids.npy"), mmap_mode="r")
+        self.metadata = MappedRecords(path)
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        nprobe: Optional[int] = None,
+        **kwargs,
+    ) -> Dict:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        nprobe = min(nprobe, self.nlist) if nprobe else self.probes
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+        positions = []
+        scores = []
+        for list_id in probed:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if end > start:
+                positions.append(np.arange(start, end))
+                scores.append(self.vectors[start:end] @ query)
+        if self.delta_ids:
+            # Inserted rows are numbered after the lists
+            rows = np.flatnonzero(np.isin(self.delta_lists, probed))
+            positions.append(len(self.ids) + rows)
+            scores.append(self.delta[rows] @ query)
+        if not positions:
+            return {"matches": []}
+        positions = np.concatenate(positions)
+        scores = np.concatenate(scores)
+
+        top_k = min(top_k, len(scores))
+        if not top_k:
+            return {"matches": []}
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        matches = []
+        for i in top:
+            position = positions[i]
+            if position < len(self.ids):
+                item_id = str(self.ids[position])
+                # Parsed from the memory map only when asked for
+                item_metadata = self.metadata[position] if include_metadata else None
+            else:
+                item_id = self.delta_ids[position - len(self.ids)]
+                item_metadata = (
+                    self.delta_metadata[position - len(self.ids)]
+                    if include_metadata
+                    else None
+                )
+            matches.append(
+                {"id": item_id, "score": float(scores[i]), "metadata": item_metadata}
+            )
+        return {"matches": matches}
+
+
+def ivf_current(path) -> bool:
+    """Whether a complete IVF index exists and is at least as new as the vector file."""
+    if not all(sidecar_path(path, suffix).exists() for suffix in IVF_FILES):
+        return False
+    return os.path.getmtime(sidecar_path(path, "ivf.json")) >= os.path.getmtime(path)
+
+
+def load_ivf(path, nprobe: Optional[int] = None) -> Optional[IVFIndex]:
+    """The IVF index next to `path`, or None when none has been built."""
+    if not all(sidecar_path(path, suffix).exists() for suffix in IVF_FILES):
+        return None
+    if not ivf_current(path):
+        logger.warning(
+            "IVF index for %s is older than its vectors; new ones are missing "
+            "until utils/build_ivf_index.py --update runs",
+            path,
+        )
+    start = time.perf_counter()
+    index = IVFIndex.open(path, nprobe=nprobe)
+    logger.info(
+        "Opened IVF index over %d vectors (%d lists, %d probed) in %.1f ms",
+        len(index),
+        index.nlist,
+        index.probes,
+        (time.perf_counter() - start) * 1000,
+    )
+    return index
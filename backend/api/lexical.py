@@ -0,0 +1,136 @@
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from api import dataset
+from api.context import Passage
+
+logger = logging.getLogger(__name__)
+
+GENERAL_CHUNKS_PATH = dataset.BACKEND_DIR / "utils" / "embeddings.txt"
+
+# Lexical hits taken from each corpus before fusion
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", "5"))
+
+# Words, plus dotted/hyphenated codes such as lot numbers kept as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./:][a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have how i in is it its of on "
+    "or that the their this to was were what which who with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens; compound codes are indexed whole and by their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./:]", token) if part)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, passages: List[Passage], k1: float = 1.5, b: float = 0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[tuple]] = defaultdict(list)
+        self.doc_lengths = []
+
+        for doc_id, passage in enumerate(passages):
+            counts = Counter(tokenize(passage.text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((doc_id, frequency))
+
+        total = len(passages)
+        self.avg_length = sum(self.doc_lengths) / total if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: str, top_k: int = LEXICAL_TOP_K) -> List[Passage]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, frequency in self.postings[term]:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length
+                scores[doc_id] += (
+                    idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [
+            Passage(**{**self.passages[doc_id].__dict__, "score": score})
+            for doc_id, score in ranked[:top_k]
+        ]
+
+
+class LexicalIndex:
+    """BM25 indexes over the general-knowledge chunks and the TSV rows."""
+
+    def __init__(self, general: BM25Index, tsv: BM25Index):
+        self.general = general
+        self.tsv = tsv
+
+    def search(self, query: str, top_k: int = LEXICAL_TOP_K) -> List[Passage]:
+        return self.general.search(query, top_k) + self.tsv.search(query, top_k)
+
+
+def general_passages(path=GENERAL_CHUNKS_PATH) -> List[Passage]:
+    """The SimpleRAG chunks, read back from the stored embedding file."""
+    if not os.path.exists(path):
+        logger.warning("No general chunks at %s; lexical search skips them", path)
+        return []
+    with open(path, "r") as f:
+        vectors = json.load(f)
+    return [
+        Passage(
+            id=vector["id"],
+            text=vector["metadata"]["text"],
+            score=0.0,
+            kind="general",
+            source=vector["metadata"].get("source"),
+            chunk_index=vector["metadata"].get("chunk_index"),
+            start_index=vector["metadata"].get("start_index"),
+        )
+        for vector in vectors
+    ]
+
+
+def tsv_passages() -> List[Passage]:
+    """One passage per sample row, with the same ids and text as the TSV vectors."""
+    df = dataset.load_samples()
+    return [
+        Passage(id=f"row_{row_id}", text=text, score=0.0, kind="tsv")
+        for row_id, text in zip(df["id"], dataset.format_rows(df))
+    ]
+
+
+def build_default_index() -> LexicalIndex:
+    start = time.perf_counter()
+    index = LexicalIndex(BM25Index(general_passages()), BM25Index(tsv_passages()))
+    logger.info(
+        "Built lexical index (%d chunks, %d rows) in %.1f ms",
+        len(index.general),
+        len(index.tsv),
+        (time.perf_counter() - start) * 1000,
+    )
+    return index
@@ -0,0 +1,107 @@
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Log level for the whole process, e.g. LOG_LEVEL=DEBUG for local debugging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Maximum characters of any single payload (chunks, results, histories) in a log line
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "500"))
+
+# Only 1 in N per-chunk stream events is logged
+LOG_CHUNK_SAMPLE_EVERY = int(os.getenv("LOG_CHUNK_SAMPLE_EVERY", "50"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Third-party loggers that are very chatty at DEBUG and never useful on the hot path
+NOISY_LOGGERS = ["hpack", "httpcore", "httpx", "urllib3", "asyncio", "multipart"]
+
+_listener = None
+
+
+class Truncated:
+    """Wrap a payload so it is only stringified (and clipped) if the record is emitted."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = None):
+        self.value = value
+        self.limit = LOG_MAX_PAYLOAD if limit is None else limit
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[: self.limit]}... [{len(text) - self.limit} more chars]"
+
+    __repr__ = __str__
+
+
+def truncate(value, limit: int = None) -> Truncated:
+    """Lazily truncate a payload for logging, e.g. logger.debug("x: %s", truncate(x))."""
+    return Truncated(value, limit)
+
+
+class SamplingFilter(logging.Filter):
+    """Let through only one in every `every` records (the first one always passes)."""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return next(self._counter) % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler merges args into the message on the calling thread; the
+    queue here is in-process, so records can be passed through untouched.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging() -> None:
+    """Route all logging through a background thread, gated by LOG_LEVEL."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = getattr(logging, LOG_LEVEL, logging.INFO)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+
+
+def get_sampled_logger(name: str, every: int = None) -> logging.Logger:
+    """Logger for per-chunk events that only emits one in every `every` records."""
+    sampled = logging.getLogger(name)
+    if not any(isinstance(f, SamplingFilter) for f in sampled.filters):
+        sampled.addFilter(
+            SamplingFilter(LOG_CHUNK_SAMPLE_EVERY if every is None else every)
+        )
+    return sampled
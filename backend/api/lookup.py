@@ -0,0 +1,221 @@
+import bisect
+import difflib
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Set
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# A question matching at most this many rows is answered from the records directly
+DIRECT_HIT_MAX_ROWS = int(os.getenv("LOOKUP_DIRECT_HIT_MAX_ROWS", "12"))
+
+# Longest phrase (in words) tried against product names
+MAX_PHRASE_WORDS = 10
+
+# Similarity needed for a misspelled product name to count as a match
+FUZZY_CUTOFF = 0.88
+# Questions longer than this (in words) skip the fuzzy pass, whose cost grows
+# with every phrase tried; questions naming a product are short
+FUZZY_MAX_WORDS = 12
+
+PRODUCT_ID_PATTERN = re.compile(r"\bproduct(?:[ _]?id)?\s*#?\s*(\d+)\b", re.I)
+
+# Descriptive fields shown for each matched row, before its measurements
+RECORD_FIELDS = ["product", "product_id", "tags", "lot_no", "serving_size_g"]
+CONCENTRATION_SUFFIX = "_ng_g"
+TDI_SUFFIX = "_percent_tdi_70_kg_epa"
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop apostrophes, and reduce everything else to single spaces."""
+    text = str(text).lower().replace("'", "").replace("’", "").replace("_", " ")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def lot_tokens(lot_no: str) -> List[str]:
+    """Pieces of a lot number specific enough to be looked up on their own."""
+    return [
+        token
+        for token in re.split(r"[\s,/]+", str(lot_no).lower())
+        if len(token) >= 4 and any(ch.isdigit() for ch in token)
+    ]
+
+
+class EntityLookup:
+    """Maps product names, ids, tags, blinded names and lot numbers to row positions."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.names: Dict[str, Set[int]] = defaultdict(set)
+        self.blinded_names: Dict[str, Set[int]] = defaultdict(set)
+        self.tags: Dict[str, Set[int]] = defaultdict(set)
+        self.lots: Dict[str, Set[int]] = defaultdict(set)
+        self.product_ids: Dict[str, Set[int]] = defaultdict(set)
+
+        for position, value in enumerate(df["product"]):
+            if pd.notna(value) and normalize(value):
+                self.names[normalize(value)].add(position)
+        for position, value in enumerate(df["blinded_name"]):
+            if pd.notna(value) and normalize(value):
+                self.blinded_names[normalize(value)].add(position)
+        for position, value in enumerate(df["tags"]):
+            if pd.notna(value):
+                for tag in str(value).split(","):
+                    if normalize(tag):
+                        self.tags[normalize(tag)].add(position)
+        for position, value in enumerate(df["lot_no"]):
+            if pd.notna(value):
+                for token in lot_tokens(value):
+                    self.lots[token].add(position)
+        for position, value in enumerate(df["product_id"]):
+            if pd.notna(value):
+                self.product_ids[str(value)].add(position)
+
+        self.sorted_names = sorted(self.names)
+
+    def _prefix_matches(self, phrase: str) -> Set[int]:
+        """Rows whose name starts with the phrase, e.g. a brand plus product line."""
+        positions = set()
+        start = bisect.bisect_left(self.sorted_names, phrase)
+        for name in self.sorted_names[start:]:
+            if not name.startswith(phrase):
+                break
+            if name == phrase or name[len(phrase)] == " ":
+                positions |= self.names[name]
+        return positions
+
+    def _phrase_matches(self, words: List[str], lookup) -> Set[int]:
+        """Longest-first, non-overlapping phrases for which `lookup` finds rows."""
+        positions: Set[int] = set()
+        used = [False] * len(words)
+        for size in range(min(MAX_PHRASE_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                if any(used[start : start + size]):
+                    continue
+                found = lookup(" ".join(words[start : start + size]), size)
+                if found:
+                    positions |= found
+                    used[start : start + size] = [True] * size
+        return positions
+
+    def _product_lookup(self, phrase: str, size: int) -> Set[int]:
+        found = self.names.get(phrase)
+        if found:
+            return set(found)
+        return self._prefix_matches(phrase) if size >= 2 else set()
+
+    def _blinded_lookup(self, phrase: str, size: int) -> Set[int]:
+        return set(self.blinded_names.get(phrase, ()))
+
+    def _tag_lookup(self, phrase: str, size: int) -> Set[int]:
+        return set(self.tags.get(phrase, ()))
+
+    def _fuzzy_matches(self, words: List[str]) -> Set[int]:
+        positions: Set[int] = set()
+        if len(words) > FUZZY_MAX_WORDS:
+            return positions
+        for size in range(min(5, len(words)), 1, -1):
+            for start in range(len(words) - size + 1):
+                phrase = " ".join(words[start : start + size])
+                for name in difflib.get_close_matches(
+                    phrase, self.sorted_names, n=1, cutoff=FUZZY_CUTOFF
+                ):
+                    positions |= self.names[name]
+            if positions:
+                break
+        return positions
+
+    def match(self, question: str, broad: bool = True) -> List[int]:
+        """Row positions for the entities named in the question, in dataset order.
+
+        Ids and lot numbers always count. Beyond those, the most specific tier
+        that matches wins: product names (exact, prefix, then fuzzy), then
+        tags, then blinded names. Tags and blinded names are generic words
+        ("tea", "water", "chicken"), so with `broad=False` only ids, lots
+        and product names match.
+        """
+        positions: Set[int] = set()
+        for product_id in PRODUCT_ID_PATTERN.findall(question):
+            positions |= self.product_ids.get(product_id, set())
+        for token in re.split(r"[\s,?!]+", question.lower()):
+            positions |= self.lots.get(token.strip(".:;()\"'"), set())
+
+        words = normalize(question).split()
+        named = self._phrase_matches(words, self._product_lookup)
+        if not named:
+            named = self._fuzzy_matches(words)
+        if broad and not named:
+            named = self._phrase_matches(words, self._tag_lookup)
+        if broad and not named:
+            named = self._phrase_matches(words, self._blinded_lookup)
+        return sorted(positions | named)
+
+
+def _is_detected(value) -> bool:
+    """Measurements are strings; '<10', '<LOQ' or 'NO RfD' mean nothing to report."""
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def format_record(row: pd.Series) -> str:
+    """One compact line per sample.
+
+    Descriptive fields come first, then detected concentrations (ng/g), the
+    chemicals below the limit of quantification, and non-zero % of the EPA
+    tolerable daily intake for a 70 kg adult.
+    """
+    parts = [
+        f"{field}: {row[field]}"
+        for field in RECORD_FIELDS
+        if field in row and pd.notna(row[field])
+    ]
+    detected, below_loq, tdi = [], [], []
+    for column, value in row.items():
+        if pd.isna(value) or "percentile" in column:
+            continue
+        if column.endswith(CONCENTRATION_SUFFIX):
+            chemical = column[: -len(CONCENTRATION_SUFFIX)]
+            if _is_detected(value):
+                detected.append(f"{chemical}={value}")
+            elif str(value).startswith("<"):
+                below_loq.append(chemical)
+        elif column.endswith(TDI_SUFFIX) and _is_detected(value):
+            tdi.append(f"{column[: -len(TDI_SUFFIX)]}={value}%")
+    if detected:
+        parts.append("ng/g: " + ", ".join(detected))
+    if below_loq:
+        parts.append("below LOQ: " + ", ".join(below_loq))
+    if tdi:
+        parts.append("% EPA TDI (70 kg): " + ", ".join(tdi))
+    return " | ".join(parts)
+
+
+def format_matches(df: pd.DataFrame, positions: List[int]) -> str:
+    records = "\n".join(
+        f"- {format_record(df.iloc[position])}" for position in positions
+    )
+    return (
+        "Matched samples (complete rows for the products named in the question):\n"
+        f"{records}"
+    )
+
+
+def build_lookup(df: pd.DataFrame) -> EntityLookup:
+    start = time.perf_counter()
+    lookup = EntityLookup(df)
+    logger.info(
+        "Built entity lookup (%d names, %d tags, %d lot tokens) in %.1f ms",
+        len(lookup.names),
+        len(lookup.tags),
+        len(lookup.lots),
+        (time.perf_counter() - start) * 1000,
+    )
+    return lookup
@@ -1,41 +1,54 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from dotenv import load_dotenv
 import os
 import time
 import requests
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from pydantic import BaseModel
 import pinecone
 from pinecone import Pinecone
 from typing import List, AsyncGenerator
-from supabase import create_client
 from datetime import datetime
 from fastapi import Request
 import uuid
 import logging
 import json
 import asyncio
-from typing import Optional
+import threading
+import functools
+from typing import Optional, Tuple
 import aiohttp
 import traceback
+from dataclasses import dataclass
 
-# Set up logging
-# logging.basicConfig(level=logging.INFO)
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
+# Loaded before any api module: their settings are read from the environment
+# at import time
 load_dotenv()
 
+from api.logging_config import setup_logging, get_sampled_logger, truncate
+from api import metrics, prompts, usage
+from api import context as context_assembly
+from api import aggregates, dataset, followups, lexical, lookup, router, runner
+from api import ratelimit, resilience, sandbox, sql_engine, storage, streaming
+from api import batch, embeddings, http_cache, vector_index
+
+# Set up logging (level from LOG_LEVEL, emitted from a background thread)
+setup_logging()
+logger = logging.getLogger(__name__)
+# Per-chunk stream events are sampled so they don't dominate the hot path
+chunk_logger = get_sampled_logger(f"{__name__}.chunks")
+
 # Check required environment variables
 required_env_vars = [
-    "SUPABASE_URL",
-    "SUPABASE_KEY",
     "ANTHROPIC_API_KEY",
     "PINECONE_API_KEY",
     "VOYAGE_API_KEY",
 ]
+# A local SQLite query store needs no Supabase credentials
+if os.getenv("QUERY_STORE", "supabase") == "supabase":
+    required_env_vars += ["SUPABASE_URL", "SUPABASE_KEY"]
 
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 if missing_vars:
@@ -55,335 +68,479 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],  # Needed for EventSource
 )
+# Compresses JSON responses only; event streams are never buffered
+app.add_middleware(http_cache.GZipJSONMiddleware)
+
+
+# Seconds between event-loop lag samples; 0 turns the monitor off
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    if EVENT_LOOP_LAG_INTERVAL > 0:
+        app.state.loop_monitor = asyncio.create_task(
+            metrics.monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL)
+        )
+
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template so query ids don't explode the label space
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.HTTP_DURATION.observe(
+        time.perf_counter() - start, method=request.method, route=route
+    )
+    metrics.HTTP_REQUESTS.inc(
+        method=request.method, route=route, status=response.status_code
+    )
+    return response
+
 
 # Initialize clients
 try:
-    anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    anthropic_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
     voyage_api_key = os.getenv("VOYAGE_API_KEY")
-    voyage_url = "https://api.voyageai.com/v1/embeddings"
+    voyage_url = os.getenv("VOYAGE_API_URL", "https://api.voyageai.com/v1/embeddings")
 
+    # Index hosts are resolved by name unless given (e.g. local stand-ins in bench/)
     pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index_general = pc.Index("plasticlist2")
-    index_tsv = pc.Index("plasticlist3")
+    index_general = pc.Index(
+        "plasticlist2", host=os.getenv("PINECONE_GENERAL_HOST", "")
+    )
+    index_tsv = pc.Index("plasticlist3", host=os.getenv("PINECONE_TSV_HOST", ""))
 
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
-    supabase = create_client(supabase_url, supabase_key)
+    query_store = storage.open_store()
 except Exception as e:
-    logger.error(f"Error initializing clients: {str(e)}")
+    logger.error("Error initializing clients: %s", e)
     raise
 
+# Local BM25 index for exact-token matches (product names, lot numbers, codes)
+try:
+    lexical_index = lexical.build_default_index()
+except Exception as e:
+    logger.warning("Lexical index unavailable, using vector search only: %s", e)
+    lexical_index = None
+
+# Stored general-chunk vectors, searched locally when Pinecone is unavailable
+try:
+    local_general_index = vector_index.load_index()
+except Exception as e:
+    logger.warning("Local vector index unavailable: %s", e)
+    local_general_index = None
+
+# Hedged, circuit-broken Pinecone calls. There are no local TSV vectors; when
+# that index is down, the lexical index's row passages carry the TSV context.
+general_retriever = resilience.ResilientIndex(
+    "pinecone_general",
+    # The client gives up with the call, rather than holding its thread
+    functools.partial(
+        index_general.query, timeout=resilience.RETRIEVAL_TIMEOUT_SECONDS
+    ),
+    fallback=local_general_index.query if local_general_index else None,
+)
+tsv_retriever = resilience.ResilientIndex(
+    "pinecone_tsv",
+    functools.partial(index_tsv.query, timeout=resilience.RETRIEVAL_TIMEOUT_SECONDS),
+    fallback=(lambda **kwargs: {"matches": []}) if lexical_index is not None else None,
+)
+
+# Exact product/entity index; questions naming a product skip vector retrieval
+try:
+    entity_lookup = lookup.build_lookup(dataset.load_samples())
+except Exception as e:
+    logger.warning("Entity lookup unavailable: %s", e)
+    entity_lookup = None
+
+# Aggregate tables, computed once and shared by /api/stats and the system prompt
+try:
+    aggregates.load_stats()
+except Exception as e:
+    logger.warning("Dataset stats unavailable: %s", e)
+
+# Template-like questions (top N, % TDI thresholds, tag averages) skip the model
+try:
+    query_router = router.build_router(dataset.load_samples())
+except Exception as e:
+    logger.warning("Query router unavailable, every question goes to the model: %s", e)
+    query_router = None
+
+# Stats change only when samples.tsv does; browsers may reuse them for an hour
+STATS_CACHE_CONTROL = "public, max-age=3600"
+
+# Read-only SQLite copy of the TSV behind the run_sql_query tool
+try:
+    sql_backend = sql_engine.build_engine(dataset.load_samples())
+except Exception as e:
+    logger.warning("SQL tool backend unavailable: %s", e)
+    sql_backend = None
+
+
+# ANTHROPIC_BASE_URL is also read by the SDK client used for follow-ups
+ANTHROPIC_MESSAGES_URL = (
+    os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+    + "/v1/messages"
+)
+ANTHROPIC_MODEL = "claude-3-5-sonnet-20241022"
+FOLLOWUP_MODEL = "claude-3-haiku-20240307"
+
+# Follow-up suggestions, generated in the background once an answer completes
+followup_jobs = followups.FollowupRegistry()
+
+# Per-provider request/token buckets; callers past the wait limit are shed
+anthropic_limiter = ratelimit.limiter("anthropic")
+voyage_limiter = ratelimit.limiter("voyage")
+
+# Answer generations in flight, shared by every stream of the same query
+query_runner = runner.QueryRunner()
+
+# Failed tool runs handed back to the model for a corrected call
+TOOL_MAX_RETRIES = int(os.getenv("TOOL_MAX_RETRIES", "2"))
+
+# Turns returned per page by GET /api/query/{id}, and the most a caller may ask for
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "20"))
+CONVERSATION_MAX_PAGE_SIZE = int(os.getenv("CONVERSATION_MAX_PAGE_SIZE", "100"))
+
+# Fields the prompt's conversation history is built from
+HISTORY_COLUMNS = ("id", "question", "response", "created_at")
+
 
 class Query(BaseModel):
     question: str
     conversation_id: str
 
 
-async def get_embedding(text: str) -> List[float]:
-    """Get embeddings from Voyage AI."""
-    if len(text) > 8192:
-        text = text[:8192]
-
+async def embed_batch(
+    texts: List[str], priority: int = ratelimit.INTERACTIVE
+) -> Tuple[List[List[float]], int]:
+    """Embed several texts in one Voyage AI call; returns vectors and tokens billed."""
     headers = {
         "Authorization": f"Bearer {voyage_api_key}",
         "Content-Type": "application/json",
     }
-    data = {"model": "voyage-3-large", "input": text}
+    data = {"model": "voyage-3-large", "input": texts}
 
-    try:
-        # time.sleep(0.005)
-        response = requests.post(voyage_url, headers=headers, json=data)
+    await voyage_limiter.acquire(
+        sum(ratelimit.estimate_tokens(text) for text in texts), priority=priority
+    )
+    # In a thread, so the loop keeps serving while the call is out
+    response = await asyncio.to_thread(
+        requests.post, voyage_url, headers=headers, json=data
+    )
+
+    if response.status_code == 429:
+        raise voyage_limiter.throttled(response.headers.get("retry-after"))
+    if response.status_code != 200:
+        logger.error(
+            "Voyage API error: %s - %s",
+            response.status_code,
+            truncate(response.text),
+        )
+        response.raise_for_status()
 
-        if response.status_code != 200:
-            logger.error(f"Voyage API error: {response.status_code} - {response.text}")
-            response.raise_for_status()
+    response_data = response.json()
+    items = response_data.get("data") or []
+    if len(items) != len(texts) or not all("embedding" in item for item in items):
+        raise Exception("Could not find embeddings in response")
+    items = sorted(items, key=lambda item: item.get("index", 0))
+    tokens = response_data.get("usage", {}).get("total_tokens", 0)
+    return [item["embedding"] for item in items], tokens
 
-        response_data = response.json()
 
-        if (
-            "data" in response_data
-            and len(response_data["data"]) > 0
-            and "embedding" in response_data["data"][0]
-        ):
-            return response_data["data"][0]["embedding"]
-        else:
-            raise Exception("Could not find embeddings in response")
+# Query embeddings from concurrent requests go out together
+embedding_batcher = embeddings.EmbeddingBatcher(embed_batch)
+
+
+async def get_embedding(
+    text: str, priority: int = ratelimit.INTERACTIVE
+) -> List[float]:
+    """Get embeddings from Voyage AI."""
+    if len(text) > 8192:
+        text = text[:8192]
+
+    try:
+        # Includes the short wait for other texts to share the call
+        with metrics.span("embedding"):
+            embedding, tokens = await embedding_batcher.embed(text, priority)
+        usage.record("embedding", "voyage-3-large", {"input_tokens": tokens})
+        return embedding
 
     except Exception as e:
-        logger.error(f"Error in get_embedding: {str(e)}")
+        logger.error("Error in get_embedding: %s", e)
         raise
 
 
-async def get_relevant_context(query: str) -> str:
+async def get_relevant_context(
+    query: str, priority: int = ratelimit.INTERACTIVE
+) -> str:
     """Get relevant context from both Pinecone indices"""
     try:
-        # Get query embedding once and reuse
-        query_embedding = await get_embedding(query)
-
-        # Get context from general knowledge index (plasticlist2)
-        general_results = index_general.query(
-            vector=query_embedding,
-            top_k=3,
-            include_metadata=True,
-            score_threshold=0.0,
-            namespace="default",
-        )
+        direct_hit = await get_direct_hit_context(query)
+        if direct_hit is not None:
+            return direct_hit
 
-        # Get context from TSV data index (plasticlist3)
-        tsv_results = index_tsv.query(
-            vector=query_embedding,
-            top_k=4,  # Get 30 vectors as requested
-            include_metadata=True,
-            score_threshold=0.0,
-            namespace="default",
+        # Get query embedding once and reuse
+        query_embedding = await get_embedding(query, priority)
+
+        async def query_index(retriever, stage: str, top_k: int):
+            with metrics.span(stage):
+                return await retriever.query(
+                    f"{top_k}:{query}",
+                    vector=query_embedding,
+                    top_k=top_k,
+                    include_metadata=True,
+                    namespace="default",
+                )
+
+        # Both indexes at once, each hedged and with its own fallback. Fetch a
+        # wider candidate set; the assembler trims it to the token budget
+        general_results, tsv_results = await asyncio.gather(
+            query_index(
+                general_retriever,
+                "pinecone_query_general",
+                context_assembly.GENERAL_CANDIDATES,
+            ),
+            query_index(
+                tsv_retriever, "pinecone_query_tsv", context_assembly.TSV_CANDIDATES
+            ),
         )
 
-        # Process general knowledge results
         general_matches = (
             general_results.get("matches", [])
             if isinstance(general_results, dict)
             else general_results.matches
         )
-        general_context = "\n\n".join(
-            [
-                f"Content from general knowledge ({match['id']}):\n{match['metadata']['text']}"
-                for match in general_matches
-            ]
-        )
-
-        # Process TSV data results
         tsv_matches = (
             tsv_results.get("matches", [])
             if isinstance(tsv_results, dict)
             else tsv_results.matches
         )
-        tsv_context = "\n\n".join(
-            [
-                f"TSV Entry {i + 1}:\n{match['metadata']['text']}"
-                for i, match in enumerate(tsv_matches)
-            ]
-        )
 
-        # Combine contexts with clear separation
-        combined_context = (
-            f"""General Knowledge:\n{general_context}\n\nTSV Data:\n{tsv_context}"""
-        )
+        lexical_passages = None
+        if lexical_index is not None:
+            with metrics.span("lexical_search"):
+                lexical_passages = lexical_index.search(query)
 
-        return combined_context
+        return context_assembly.assemble_context(
+            general_matches, tsv_matches, lexical_passages=lexical_passages
+        )
 
     except Exception as e:
-        logger.error(f"Error in get_relevant_context: {str(e)}")
+        logger.error("Error in get_relevant_context: %s", e)
         raise
 
 
+async def get_direct_hit_context(query: str) -> Optional[str]:
+    """Context for questions naming specific products, built without any network hop.
+
+    Only product names, ids and lot numbers count: a question matching just a
+    tag or blinded name ("tea", "bottled water") is a general one and goes
+    through retrieval. Returns None when the question doesn't name a small
+    enough set of samples.
+    """
+    if entity_lookup is None:
+        return None
+
+    with metrics.span("entity_lookup"):
+        # Fuzzy name matching is CPU work; keep it off the event loop
+        positions = await asyncio.to_thread(entity_lookup.match, query, False)
+    if not positions or len(positions) > lookup.DIRECT_HIT_MAX_ROWS:
+        return None
+
+    logger.debug("Direct hit on %d rows for: %s", len(positions), truncate(query))
+    lexical_passages = lexical_index.general.search(query) if lexical_index else []
+    records = lookup.format_matches(entity_lookup.df, positions)
+    general_context = context_assembly.assemble_context(
+        [], [], lexical_passages=lexical_passages
+    )
+    return f"{records}\n\n{general_context}"
+
+
 async def get_conversation_text(query_id: str) -> str:
     """Fetch conversation history for the given query ID."""
-    # Get current query
-    result = supabase.table("queries").select("*").eq("id", query_id).execute()
-    logger.debug(f"Current query result: {result.data}")
-
-    if not result.data:
-        return ""
-
-    current_query = result.data[0]
-    conversation_id = current_query["conversation_id"]
-    if not conversation_id:
-        return ""
-
-    # Fetch all conversation queries
-    conversation_res = (
-        supabase.table("queries")
-        .select("*")
-        .eq("conversation_id", conversation_id)
-        .execute()
-    )
+    with metrics.span("history_fetch"):
+        # Get current query
+        current_query = await asyncio.to_thread(query_store.get, query_id)
+        logger.debug("Current query result: %s", truncate(current_query))
 
-    logger.debug(f"Full conversation: {conversation_res.data}")
+        if not current_query:
+            return ""
 
-    # Build conversation history chronologically
-    conversation_data = sorted(conversation_res.data, key=lambda x: x["created_at"])
-    conversation_blocks = []
+        conversation_id = current_query["conversation_id"]
+        if not conversation_id:
+            return ""
 
-    for row in conversation_data:
-        # Skip current query
-        if row["id"] == query_id:
-            continue
+        # Fetch the conversation's Q&A fields, without usage and follow-ups
+        conversation = await asyncio.to_thread(
+            query_store.conversation, conversation_id, columns=HISTORY_COLUMNS
+        )
 
-        # Include all previous Q&A pairs
-        response = row.get("response", "")
-        if response:  # Include if there's any response
-            conversation_blocks.append(f"Q: {row['question']}\nA: {response}")
+    logger.debug(
+        "Full conversation: %d rows, %s", len(conversation), truncate(conversation)
+    )
 
-    history = "\n\n".join(conversation_blocks)
-    logger.debug(f"Final history: {history}")
+    history = prompts.conversation_history(conversation, query_id)
+    logger.debug("Final history (%d chars): %s", len(history), truncate(history))
     return history
 
 
-import pandas as pd
-import ast
-from io import StringIO
-import sys
-import contextlib
-import builtins
+async def execute_python_query(query: str) -> str:
+    """Execute a Python query on the TSV data"""
+    # In a worker process, which gets its own copy of the loaded TSV data and
+    # is killed when the query times out or every client leaves
+    return await sandbox.run_python_isolated(query, dataset.load_samples())
 
 
-def is_safe_code(code: str) -> bool:
-    """Basic security check for Python code"""
-    forbidden = ["eval", "exec", "open", "os", "sys", "subprocess"]
+async def execute_sql_query(query: str) -> str:
+    """Execute a read-only SQL statement on the TSV data"""
+    if sql_backend is None:
+        return "Error executing query:\nSQL backend unavailable"
+    cancelled = threading.Event()
     try:
-        tree = ast.parse(code)
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Name) and node.id in forbidden:
-                return False
-            # Just check for any dangerous imports
-            if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                module = node.names[0].name.split(".")[0]
-                if module in forbidden:
-                    return False
-    except:
-        return False
-    return True
-
-
-@contextlib.contextmanager
-def capture_output():
-    """Capture stdout and stderr"""
-    new_out, new_err = StringIO(), StringIO()
-    old_out, old_err = sys.stdout, sys.stderr
-    try:
-        sys.stdout, sys.stderr = new_out, new_err
-        yield sys.stdout, sys.stderr
-    finally:
-        sys.stdout, sys.stderr = old_out, old_err
+        # Off the event loop; the statement timeout bounds how long this takes
+        return await asyncio.to_thread(sql_backend.query, query, cancelled)
+    except asyncio.CancelledError:
+        # Stop the statement itself, not just the wait for it
+        cancelled.set()
+        raise
+    except sql_engine.SQLError as e:
+        return f"Error executing query:\n{e}"
 
 
-async def execute_python_query(query: str) -> str:
-    """Execute a Python query on the TSV data"""
-    if not is_safe_code(query):
-        return "Error: Query contains forbidden operations"
-
-    try:
-        # Load your TSV data
-        df = pd.read_csv("data/raw/samples.tsv", sep="\t")
-
-        # Create a copy of builtins with only safe functions
-        safe_builtins = {
-            name: getattr(builtins, name)
-            for name in [
-                "print",
-                "len",
-                "range",
-                "str",
-                "int",
-                "float",
-                "bool",
-                "list",
-                "dict",
-                "sum",
-                "min",
-                "max",
-                "round",
-                "sorted",
-                "enumerate",
-                "zip",
-                "abs",
-                "__import__",  # Add __import__
-            ]
-        }
+async def execute_tool(tool_name: str, query: str) -> str:
+    if tool_name == prompts.SQL_QUERY_TOOL["name"]:
+        return await execute_sql_query(query)
+    return await execute_python_query(query)
 
-        # Add the globals we want available to the query
-        globals_dict = {
-            "__builtins__": safe_builtins,
-            "pd": pd,
-            "df": df,
-        }
 
-        # Capture output
-        with capture_output() as (out, err):
-            # Execute the query in a clean local namespace
-            local_dict = {}
-            exec(query, globals_dict, local_dict)
-
-            # Collect output
-            output = out.getvalue()
-            error_output = err.getvalue()
-
-            # Check for result variable
-            result_str = ""
-            if "result" in local_dict:
-                # Handle DataFrames specially
-                if isinstance(local_dict["result"], pd.DataFrame):
-                    result_str = local_dict["result"].to_string()
-                else:
-                    result_str = str(local_dict["result"])
-
-        # Combine all outputs
-        final_output = ""
-        if output:
-            final_output += f"Output:\n{output}\n"
-        if result_str:
-            final_output += f"Result variable:\n{result_str}\n"
-        if error_output:
-            final_output += f"Errors:\n{error_output}\n"
-
-        return (
-            final_output.strip()[:30000]
-            if final_output.strip()
-            else "No output generated"
+async def send_tool_result(
+    session, headers: dict, messages: List[dict], priority: int = ratelimit.INTERACTIVE
+) -> dict:
+    """Non-streaming call that hands tool output back to the model."""
+    await anthropic_limiter.acquire(
+        ratelimit.estimate_tokens(json.dumps(messages)), priority=priority
+    )
+    with metrics.span("tool_continuation"):
+        tool_response_raw = await session.post(
+            ANTHROPIC_MESSAGES_URL,
+            headers=headers,
+            json=prompts.build_request(ANTHROPIC_MODEL, messages),
         )
+        if tool_response_raw.status == 429:
+            raise anthropic_limiter.throttled(
+                tool_response_raw.headers.get("retry-after")
+            )
+        tool_response = await tool_response_raw.json()
+    logger.debug("Received tool response: %s", truncate(tool_response))
+    usage.record("tool_continuation", ANTHROPIC_MODEL, tool_response.get("usage"))
+    return tool_response
+
 
+def route_question(question: str) -> Optional[str]:
+    """Markdown answer from the deterministic router, or None for the model path."""
+    if query_router is None:
+        return None
+    try:
+        with metrics.span("router"):
+            answer = query_router.answer(question)
+            return answer.to_markdown() if answer is not None else None
     except Exception as e:
-        error_trace = traceback.format_exc()
-        return f"Error executing query:\n{error_trace}"
+        logger.warning("Router failed, falling back to the model: %s", e)
+        return None
 
 
-async def process_query_stream(query_id: str, question: str):
-    full_response = ""
-    chunks_received = 0
+@dataclass
+class PreparedQuery:
+    """A query's routing and retrieval, done ahead of its answer."""
 
-    try:
-        logger.debug(f"Starting stream for: {query_id}")
-
-        # [Previous code for PYTHON_QUERY_TOOL, context gathering, and prompt remains the same]
-        PYTHON_QUERY_TOOL = {
-            "name": "run_python_query",
-            "description": """Executes a Python query on the PlasticList TSV data...""",  # Your existing description
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "A complete Python code snippet that uses pandas to analyze the TSV data. The data will be available as a pandas DataFrame named 'df'.",
-                    }
-                },
-                "required": ["query"],
-            },
-        }
+    timer: metrics.RequestTimer
+    ledger: usage.UsageLedger
+    routed: Optional[str]
+    context: Optional[str]
 
-        # Previous context gathering remains the same
-        full_history = await get_conversation_text(query_id)
-        context = await get_relevant_context(question)
-        prompt = f"""
-        You are PlasticList Search, a demo search interface for the PlasticList project, a research initiative that tested over 100 everyday foods from the Bay Area for the presence of plastic chemicals. The study, conducted by a team of independent researchers, quantified the levels of endocrine-disrupting chemicals (EDCs) and other plastic-related substances in common food items. The accompanying TSV dataset contains extensive data on chemical levels, testing conditions, and safety thresholds.
 
-        In each query, the user will ask a quesiton, you will responsd with the best response in one go.
+async def prepare_query(
+    query_id: str, question: str, endpoint: str, priority: int = ratelimit.INTERACTIVE
+) -> PreparedQuery:
+    """Route and retrieve ahead of generation, under the query's own timer and ledger.
 
-        Conversation so far (if any):
-{full_history}
+    Must run in the task that later answers the query, so its spans and
+    embedding tokens are counted with the answer.
+    """
+    timer = metrics.start_request(query_id)
+    ledger = usage.start_ledger(query_id, endpoint)
+    try:
+        routed = route_question(question)
+        context = (
+            None
+            if routed is not None
+            else await get_relevant_context(question, priority)
+        )
+    except Exception:
+        metrics.log_summary(timer, "error")
+        usage.ROLLUP.add(ledger, latency_ms=timer.summary()["request_total"])
+        raise
+    return PreparedQuery(timer, ledger, routed, context)
 
-Now the user is asking:
-{question}
 
-Additional context about PlasticList and the TSV:
-{context}
+async def process_query_stream(
+    query_id: str,
+    question: str,
+    prepared: Optional[PreparedQuery] = None,
+    batch: bool = False,
+):
+    """Answer a stored query as SSE events, saving the result to its row.
 
-You have access to a Python query tool that can analyze samples.tsv data of plasticlist directly. It contains more than 600 rows and 100 columns. Use this tool when you need to perform calculations, filtering, or statistical analysis that isn't readily available in the context as the context only provides a preview of the entries in the TSV and not all of them. Note that there are over 100 different fields in the TSV so do not print all of them unless told to do so. For queries that look to filter the TSV data, check in your python program that if the final table has less than 20 entries, print the dataframe using .to_markdown() and then follow the original user query exactly. If the user is asking for the entries, display all entries again for the user (try to do in a nice table) since they cannot see the Python output. If the user asks you to do data analysis in a general form, add lots of extra debug and print statements and analyze lots of things in the Python snippets just in case it is helpful to the context. Do not use the tool if it is not necessary and the context suffices! There is no need to explain that the context suffices; just end the conversation if no tool is needed.
+    `prepared` skips routing and retrieval when they were already done.
+    Batch answers wait behind interactive ones for rate-limit capacity and
+    get no follow-ups.
+    """
+    full_response = ""
+    chunks_received = 0
+    if prepared is not None:
+        timer, ledger = prepared.timer, prepared.ledger
+    else:
+        timer = metrics.start_request(query_id)
+        ledger = usage.start_ledger(query_id, "/api/query/{query_id}/stream")
+    priority = ratelimit.BATCH if batch else ratelimit.INTERACTIVE
+    status = "completed"
 
-Make sure you output the final python program. Note that you cannot call the tool multiple times with the user asking another question. If the query was bad, you must ask the user if you can try again. Again, always output the python snipper you ran as a tool.
+    try:
+        logger.debug("Starting stream for: %s", query_id)
+
+        routed = prepared.routed if prepared else route_question(question)
+        if routed is not None:
+            full_response = routed
+            chunks_received = 1
+            yield f"data: {json.dumps({'content': routed})}\n\n"
+            await update_query_in_db(
+                query_id, full_response, "completed", token_usage=ledger.to_dict()
+            )
+            if not batch:
+                start_followups(
+                    {
+                        "id": query_id,
+                        "question": question,
+                        "response": full_response,
+                        "usage": ledger.to_dict(),
+                    }
+                )
+            yield f"data: {json.dumps({'end': True, 'total_chunks': chunks_received})}\n\n"
+            return
 
-Note that we can render markdown so include the python program in a python codeblock. 
+        full_history = await get_conversation_text(query_id)
+        if prepared is not None:
+            context = prepared.context
+        else:
+            context = await get_relevant_context(question, priority)
+        ledger.set_section("history", full_history)
+        ledger.set_section("context", context)
+        ledger.set_section("question", question)
 
-Also, if you use the tool, you must include the Python snippet in your final response as well.  Try to be more concise in your analysis please, list only interesting facts. Also, use more markdown and bold in your answers to highlight important facts. Note that there is a string limit in your python output program so be wary of outputting too much information. """
+        # Static instructions go in the cached system section; only this message varies
+        first_message = prompts.user_message(full_history, context, question)
 
         headers = {
             "Content-Type": "application/json",
@@ -391,31 +548,52 @@ Also, if you use the tool, you must include the Python snippet in your final res
             "anthropic-version": "2023-06-01",
         }
 
-        data = {
-            "model": "claude-3-5-sonnet-20241022",
-            "max_tokens": 8024,
-            "tools": [PYTHON_QUERY_TOOL],
-            "tool_choice": {"type": "auto"},
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": True,
-        }
+        data = prompts.build_request(ANTHROPIC_MODEL, [first_message], stream=True)
 
+        # Only the messages count towards the token bucket; the system prompt is cached
+        await anthropic_limiter.acquire(
+            ratelimit.estimate_tokens(json.dumps(data["messages"])), priority=priority
+        )
         async with aiohttp.ClientSession() as session:
+            anthropic_start = time.perf_counter()
+            first_token_seen = False
             async with session.post(
-                "https://api.anthropic.com/v1/messages", headers=headers, json=data
+                ANTHROPIC_MESSAGES_URL, headers=headers, json=data
             ) as response:
+                if response.status == 429:
+                    raise anthropic_limiter.throttled(
+                        response.headers.get("retry-after")
+                    )
                 async for chunk in response.content:
                     chunk_str = chunk.decode("utf-8")
-                    logger.debug(f"Raw chunk received: {chunk_str}")
+                    chunk_logger.debug("Raw chunk received: %s", truncate(chunk_str))
 
                     if chunk_str.startswith("data: "):
                         try:
-                            json_str = chunk_str[6:]  # Remove "data: " prefix
-                            if json_str.strip() == "[DONE]":
+                            data = streaming.parse_data_line(chunk_str)
+                            if data is None:
                                 continue
 
-                            data = json.loads(json_str)
-                            logger.debug(f"Processed JSON data: {data}")
+                            chunk_logger.debug(
+                                "Processed JSON data: %s", truncate(data)
+                            )
+
+                            # Record billed tokens; message_delta output counts are cumulative
+                            if data.get("type") == "message_start":
+                                start_usage = dict(
+                                    data.get("message", {}).get("usage") or {}
+                                )
+                                start_usage.pop("output_tokens", None)
+                                usage.record("generation", ANTHROPIC_MODEL, start_usage)
+                            elif data.get("type") == "message_delta":
+                                output_tokens = (data.get("usage") or {}).get(
+                                    "output_tokens"
+                                )
+                                usage.record(
+                                    "generation",
+                                    ANTHROPIC_MODEL,
+                                    {"output_tokens": output_tokens},
+                                )
 
                             # Handle message delta with tool_use stop reason
                             if (
@@ -434,8 +612,16 @@ Also, if you use the tool, you must include the Python snippet in your final res
                                     data.get("content_block", {}).get("type")
                                     == "tool_use"
                                 ):
-                                    logger.debug(f"Tool use block started: {data}")
-                                    current_tool_input = ""  # Reset tool input buffer
+                                    logger.debug(
+                                        "Tool use block started: %s", truncate(data)
+                                    )
+                                    tool_input_buffer = streaming.ToolInputBuffer()
+                                    tool_use_id = data["content_block"].get(
+                                        "id", "default_tool_id"
+                                    )
+                                    tool_name = data["content_block"].get(
+                                        "name", prompts.PYTHON_QUERY_TOOL["name"]
+                                    )
                                 continue
 
                             # Handle content block delta
@@ -446,149 +632,177 @@ Also, if you use the tool, you must include the Python snippet in your final res
                                 if delta.get("type") == "text_delta":
                                     text = delta.get("text", "")
                                     if text:
+                                        if not first_token_seen:
+                                            first_token_seen = True
+                                            metrics.record(
+                                                "anthropic_ttft",
+                                                time.perf_counter() - anthropic_start,
+                                            )
                                         full_response += text
                                         chunks_received += 1
                                         sse_data = (
                                             f"data: {json.dumps({'content': text})}\n\n"
                                         )
-                                        logger.debug(
-                                            f"Yielding text SSE data: {sse_data}"
+                                        chunk_logger.debug(
+                                            "Yielding text SSE data: %s",
+                                            truncate(sse_data),
                                         )
                                         yield sse_data
 
                                 # Handle input_json_delta (building tool input)
                                 elif delta.get("type") == "input_json_delta":
                                     partial_json = delta.get("partial_json", "")
-                                    logger.debug(
-                                        f"Received partial JSON: {partial_json}"
+                                    chunk_logger.debug(
+                                        "Received partial JSON: %s",
+                                        truncate(partial_json),
                                     )
-                                    current_tool_input += partial_json
-                                    logger.debug(
-                                        f"Current tool input build: {current_tool_input}"
-                                    )
-
                                     # Try to parse complete JSON when we have a complete query
                                     try:
-                                        tool_input = json.loads(current_tool_input)
-                                        if "query" in tool_input:
+                                        tool_input = tool_input_buffer.add(partial_json)
+                                        if (
+                                            tool_input is not None
+                                            and "query" in tool_input
+                                        ):
                                             logger.debug(
-                                                f"Complete tool input received: {tool_input}"
+                                                "Complete tool input received: %s",
+                                                truncate(tool_input),
                                             )
                                             query = tool_input["query"]
 
-                                            # Execute Python query
                                             logger.debug(
-                                                f"Executing Python query: {query}"
-                                            )
-                                            query_result = await execute_python_query(
-                                                query
+                                                "Executing %s: %s",
+                                                tool_name,
+                                                truncate(query),
                                             )
+                                            with metrics.span("tool_execution"):
+                                                query_result = await execute_tool(
+                                                    tool_name, query
+                                                )
                                             logger.debug(
-                                                f"Query execution result: {query_result}"
+                                                "Query execution result: %s",
+                                                truncate(query_result),
                                             )
 
-                                            if query_result.startswith(
-                                                "Error executing query:"
-                                            ):
-                                                # Mark the query as failed in the database
-                                                await update_query_in_db(
-                                                    query_id, query_result, "failed"
+                                            # Failed runs go back to the model with the error, up
+                                            # to TOOL_MAX_RETRIES times, before the query fails
+                                            retries = 0
+                                            messages = None
+                                            while True:
+                                                failed = query_result.startswith(
+                                                    "Error executing query:"
                                                 )
-
-                                                # Send the error message back to the client
-                                                sse_data = f"data: {json.dumps({'error': query_result})}\n\n"
-                                                logger.debug(
-                                                    f"Yielding error SSE data: {sse_data}"
+                                                if (
+                                                    failed
+                                                    and retries >= TOOL_MAX_RETRIES
+                                                ):
+                                                    # Mark the query as failed in the database
+                                                    await update_query_in_db(
+                                                        query_id,
+                                                        query_result,
+                                                        "failed",
+                                                        token_usage=ledger.to_dict(),
+                                                    )
+                                                    status = "failed"
+
+                                                    # Send the error message back to the client
+                                                    sse_data = f"data: {json.dumps({'error': query_result})}\n\n"
+                                                    logger.debug(
+                                                        "Yielding error SSE data: %s",
+                                                        truncate(sse_data),
+                                                    )
+                                                    yield sse_data
+                                                    return  # Exit the function after handling the error
+                                                if failed:
+                                                    retries += 1
+                                                    logger.info(
+                                                        "%s failed for %s, retry %d/%d",
+                                                        tool_name,
+                                                        query_id,
+                                                        retries,
+                                                        TOOL_MAX_RETRIES,
+                                                    )
+
+                                                # Send tool result back, reusing the cached prefix
+                                                ledger.set_section(
+                                                    "tool_output", query_result
                                                 )
-                                                yield sse_data
-                                                return  # Exit the function after handling the error
-
-                                            # Send tool result back
-                                            # In your process_query_stream function, modify the tool result handling section:
-
-                                            tool_result_data = {
-                                                "model": "claude-3-5-sonnet-20241022",
-                                                "max_tokens": 8024,
-                                                "tools": [
-                                                    {
-                                                        "name": "run_python_query",
-                                                        "description": "Executes a Python query on the PlasticList TSV data",
-                                                        "input_schema": {
-                                                            "type": "object",
-                                                            "properties": {
-                                                                "query": {
-                                                                    "type": "string",
-                                                                    "description": "A complete Python code snippet that uses pandas to analyze the TSV data. The data will be available as a pandas DataFrame named 'df'.",
-                                                                }
-                                                            },
-                                                            "required": ["query"],
+                                                if messages is None:
+                                                    messages = (
+                                                        prompts.continuation_messages(
+                                                            first_message,
+                                                            full_response,
+                                                            tool_use_id,
+                                                            tool_name,
+                                                            tool_input,
+                                                            query_result,
+                                                            is_error=failed,
+                                                        )
+                                                    )
+                                                else:
+                                                    messages += [
+                                                        {
+                                                            "role": "assistant",
+                                                            "content": tool_response[
+                                                                "content"
+                                                            ],
                                                         },
-                                                    }
-                                                ],
-                                                "messages": [
-                                                    {"role": "user", "content": prompt},
-                                                    {
-                                                        "role": "assistant",
-                                                        "content": [
-                                                            {
-                                                                "type": "tool_use",
-                                                                "id": data.get(
-                                                                    "id",
-                                                                    "default_tool_id",
-                                                                ),
-                                                                "name": "run_python_query",
-                                                                "input": tool_input,
-                                                            }
-                                                        ],
-                                                    },
-                                                    {
-                                                        "role": "user",
-                                                        "content": [
-                                                            {
-                                                                "type": "tool_result",
-                                                                "tool_use_id": data.get(
-                                                                    "id",
-                                                                    "default_tool_id",
-                                                                ),
-                                                                "content": query_result,
-                                                            }
-                                                        ],
-                                                    },
-                                                ],
-                                            }
-
-                                            logger.debug(
-                                                "Sending tool result back to Claude"
-                                            )
-                                            tool_response_raw = await session.post(
-                                                "https://api.anthropic.com/v1/messages",
-                                                headers=headers,
-                                                json=tool_result_data,
-                                            )
+                                                        prompts.tool_result_message(
+                                                            tool_use_id,
+                                                            query_result,
+                                                            is_error=failed,
+                                                        ),
+                                                    ]
 
-                                            tool_response = (
-                                                await tool_response_raw.json()
-                                            )
-                                            logger.debug(
-                                                f"Received tool response: {tool_response}"
-                                            )
-
-                                            if "content" in tool_response:
-                                                text = tool_response["content"][0][
-                                                    "text"
-                                                ]
-                                                full_response += text
-                                                sse_data = f"data: {json.dumps({'content': text})}\n\n"
                                                 logger.debug(
-                                                    f"Yielding tool result SSE data: {sse_data}"
+                                                    "Sending tool result back to Claude"
+                                                )
+                                                tool_response = await send_tool_result(
+                                                    session, headers, messages, priority
+                                                )
+
+                                                for block in tool_response.get(
+                                                    "content", []
+                                                ):
+                                                    text = block.get("text")
+                                                    if (
+                                                        block.get("type") != "text"
+                                                        or not text
+                                                    ):
+                                                        continue
+                                                    full_response += text
+                                                    sse_data = f"data: {json.dumps({'content': text})}\n\n"
+                                                    logger.debug(
+                                                        "Yielding tool result SSE data: %s",
+                                                        truncate(sse_data),
+                                                    )
+                                                    yield sse_data
+
+                                                # Only a failed run earns another tool call
+                                                retry_call = next(
+                                                    (
+                                                        block
+                                                        for block in tool_response.get(
+                                                            "content", []
+                                                        )
+                                                        if block.get("type")
+                                                        == "tool_use"
+                                                    ),
+                                                    None,
                                                 )
-                                                yield sse_data
+                                                if not (failed and retry_call):
+                                                    break
+                                                tool_use_id = retry_call["id"]
+                                                tool_name = retry_call["name"]
+                                                with metrics.span("tool_execution"):
+                                                    query_result = await execute_tool(
+                                                        tool_name,
+                                                        retry_call["input"].get(
+                                                            "query", ""
+                                                        ),
+                                                    )
 
                                     except json.JSONDecodeError:
                                         # Not a complete JSON yet, continue building
-                                        logger.debug(
-                                            "Incomplete JSON, continuing to build"
-                                        )
                                         continue
 
                             # Handle message stop
@@ -597,26 +811,63 @@ Also, if you use the tool, you must include the Python snippet in your final res
                                 break
 
                         except json.JSONDecodeError as e:
-                            logger.error(f"JSON decode error: {e}")
+                            logger.error("JSON decode error: %s", e)
                             continue
+                        except ratelimit.RateLimitExceeded:
+                            # Shed calls fail the query with a clear error
+                            raise
                         except Exception as e:
-                            logger.error(f"Error processing chunk: {e}")
+                            logger.error("Error processing chunk: %s", e)
                             continue
 
+            metrics.record("anthropic_total", time.perf_counter() - anthropic_start)
             await asyncio.sleep(0.001)
 
-        logger.debug(f"Stream finished. Full response length: {len(full_response)}")
-        await update_query_in_db(query_id, full_response, "completed")
+        logger.debug("Stream finished. Full response length: %d", len(full_response))
+        await update_query_in_db(
+            query_id, full_response, "completed", token_usage=ledger.to_dict()
+        )
+        # Start follow-ups before the end event so they are ready when asked for
+        if not batch:
+            start_followups(
+                {
+                    "id": query_id,
+                    "question": question,
+                    "response": full_response,
+                    "usage": ledger.to_dict(),
+                }
+            )
         yield f"data: {json.dumps({'end': True, 'total_chunks': chunks_received})}\n\n"
 
+    except asyncio.CancelledError:
+        # Every client left: drop the upstream stream and any running tool,
+        # keeping what was generated so far
+        logger.info("Query %s cancelled after %d chunks", query_id, chunks_received)
+        status = "cancelled"
+        await update_query_in_db(
+            query_id, full_response, "cancelled", token_usage=ledger.to_dict()
+        )
+        raise
+
     except Exception as e:
-        logger.error(f"Error in stream: {str(e)}")
-        await update_query_in_db(query_id, full_response, "failed", str(e))
+        logger.error("Error in stream: %s", e)
+        status = "failed"
+        await update_query_in_db(
+            query_id, full_response, "failed", str(e), token_usage=ledger.to_dict()
+        )
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
+    finally:
+        metrics.log_summary(timer, status)
+        usage.ROLLUP.add(ledger, latency_ms=timer.summary()["request_total"])
+
 
 async def update_query_in_db(
-    query_id: str, response: str, status: str, error: str = None
+    query_id: str,
+    response: str,
+    status: str,
+    error: str = None,
+    token_usage: dict = None,
 ):
     try:
         data = {
@@ -626,9 +877,20 @@ async def update_query_in_db(
         }
         if error:
             data["error"] = error
-        supabase.table("queries").update(data).eq("id", query_id).execute()
+        if token_usage:
+            data["usage"] = token_usage
+        with metrics.span("db_write"):
+            try:
+                await asyncio.to_thread(query_store.update, query_id, data)
+            except Exception as e:
+                if "usage" not in data:
+                    raise
+                # Don't lose the status update on a schema without the usage column
+                logger.warning("Usage not persisted for %s: %s", query_id, e)
+                del data["usage"]
+                await asyncio.to_thread(query_store.update, query_id, data)
     except Exception as e:
-        logger.error(f"Database update failed: {str(e)}")
+        logger.error("Database update failed: %s", e)
 
 
 class InitialQuery(BaseModel):
@@ -642,7 +904,7 @@ class FollowUpQuery(BaseModel):
 
 @app.post("/api/query/initial")
 async def create_initial_query(query: InitialQuery):
-    logger.debug(f"Received initial query: {query.model_dump_json()}")
+    logger.debug("Received initial query: %s", truncate(query.question))
     query_id = str(uuid.uuid4())
     conversation_id = str(uuid.uuid4())  # Generate new conversation_id
 
@@ -655,16 +917,20 @@ async def create_initial_query(query: InitialQuery):
     }
 
     try:
-        supabase.table("queries").insert(query_data).execute()
+        await asyncio.to_thread(query_store.insert, query_data)
         return {"id": query_id, "conversation_id": conversation_id}
     except Exception as e:
-        logger.error(f"Error creating initial query: {str(e)}")
+        logger.error("Error creating initial query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/query/followup")
 async def create_followup_query(query: FollowUpQuery):
-    logger.debug(f"Received followup query: {query.model_dump_json()}")
+    logger.debug(
+        "Received followup query for %s: %s",
+        query.conversation_id,
+        truncate(query.question),
+    )
     query_id = str(uuid.uuid4())
 
     query_data = {
@@ -676,28 +942,107 @@ async def create_followup_query(query: FollowUpQuery):
     }
 
     try:
-        supabase.table("queries").insert(query_data).execute()
+        await asyncio.to_thread(query_store.insert, query_data)
         return {"id": query_id, "conversation_id": query.conversation_id}
     except Exception as e:
-        logger.error(f"Error creating followup query: {str(e)}")
+        logger.error("Error creating followup query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class BatchQuestion(BaseModel):
+    question: str
+    id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchQuestion]
+    concurrency: Optional[int] = None
+
+
+async def prepare_batch_item(item: batch.BatchItem) -> Tuple[str, PreparedQuery]:
+    """A new query id for a batch question, routed and with its context retrieved."""
+    query_id = str(uuid.uuid4())
+    return query_id, await prepare_query(
+        query_id, item.question, "/api/batch", ratelimit.BATCH
+    )
+
+
+async def answer_batch_item(
+    item: batch.BatchItem, prepared: Tuple[str, PreparedQuery]
+) -> dict:
+    """Store and answer one batch question, like an initial query plus its stream."""
+    query_id, prepared_query = prepared
+    await asyncio.to_thread(
+        query_store.insert,
+        {
+            "id": query_id,
+            "question": item.question,
+            "created_at": datetime.utcnow().isoformat(),
+            "status": "processing",
+            "conversation_id": str(uuid.uuid4()),
+        },
+    )
+    answer = ""
+    error = None
+    async for event in process_query_stream(
+        query_id, item.question, prepared=prepared_query, batch=True
+    ):
+        data = streaming.parse_data_line(event)
+        if data is None:
+            continue
+        if "content" in data:
+            answer += data["content"]
+        elif "error" in data:
+            error = data["error"]
+    if error is not None:
+        return {"status": "error", "query_id": query_id, "error": error}
+    return {"status": "ok", "query_id": query_id, "answer": answer}
+
+
+@app.post("/api/batch")
+async def answer_batch(request: BatchRequest):
+    """Answer many questions, streaming one JSON line per question as it finishes.
+
+    Each line carries the item's id, status ("ok" or "error"), query_id and
+    the answer or error. To resume an interrupted run, send again only the
+    items without an "ok" line. `concurrency` caps answers generated at once.
+    """
+    try:
+        items = batch.parse_items([item.model_dump() for item in request.items])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    concurrency = request.concurrency or batch.BATCH_CONCURRENCY
+    if not 1 <= concurrency <= batch.BATCH_MAX_CONCURRENCY:
+        raise HTTPException(
+            status_code=400,
+            detail=f"concurrency must be between 1 and {batch.BATCH_MAX_CONCURRENCY}",
+        )
+    logger.info("Batch of %d questions, concurrency %d", len(items), concurrency)
+
+    async def lines():
+        async for result in batch.run_batch(
+            items, prepare_batch_item, answer_batch_item, concurrency
+        ):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(content=lines(), media_type="application/x-ndjson")
+
+
 @app.get("/api/query/{query_id}/stream")
-async def stream_query(query_id: str):
+async def stream_query(query_id: str, request: Request):
     """Stream the response for a given query ID"""
-    logger.debug("Streaming right now")
+    logger.debug("Streaming query %s", query_id)
     try:
-        # Get query details from Supabase
-        result = supabase.table("queries").select("*").eq("id", query_id).execute()
-        if not result.data:
+        # Get query details from the store
+        query_data = await asyncio.to_thread(query_store.get, query_id)
+        if not query_data:
             raise HTTPException(status_code=404, detail="Query not found")
 
-        query_data = result.data[0]
-
         # Add debug log for completed responses
         if query_data["status"] == "completed":
-            logger.debug(f"Sending completed response: {query_data['response']}")
+            logger.debug(
+                "Sending completed response: %s", truncate(query_data["response"])
+            )
 
         # Set up SSE headers
         headers = {
@@ -707,101 +1052,257 @@ async def stream_query(query_id: str):
         }
 
         if query_data["status"] == "completed":
-            # If already completed, return full response immediately
-            return StreamingResponse(
-                content=iter(
-                    [f"data: {json.dumps({'content': query_data['response']})}\n\n"]
-                ),
-                media_type="text/event-stream",
-                headers=headers,
+            # If already completed, return full response immediately. It can't
+            # change any more, so browsers and CDNs may keep it for good.
+            body = f"data: {json.dumps({'content': query_data['response']})}\n\n"
+            return http_cache.cached_response(
+                request,
+                body.encode(),
+                "text/event-stream",
+                http_cache.IMMUTABLE_CACHE_CONTROL,
+                http_cache.last_modified([query_data.get("completed_at")]),
             )
 
-        # Start streaming response
+        # Generation runs in the background and outlives this request. Starlette
+        # cancels the subscription as soon as the client disconnects; with no
+        # subscribers left the run is cancelled after STREAM_CANCEL_GRACE_SECONDS,
+        # unless the client reconnects and picks the same run back up.
+        run = query_runner.start(
+            query_id, lambda: process_query_stream(query_id, query_data["question"])
+        )
         return StreamingResponse(
-            content=process_query_stream(query_id, query_data["question"]),
+            content=query_runner.subscribe(run),
             media_type="text/event-stream",
             headers=headers,
         )
     except Exception as e:
-        logger.error(f"Streaming error: {str(e)}")
+        logger.error("Streaming error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/query/{query_id}")
-async def get_query(query_id: str):
+async def get_query(
+    query_id: str,
+    request: Request,
+    limit: int = CONVERSATION_PAGE_SIZE,
+    before: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """A query and a page of its conversation, oldest turn first.
+
+    The page holds the `limit` most recent turns created before the `before`
+    cursor; `next_cursor` fetches the turns preceding it, and is null on the
+    first turn. `fields` (comma-separated) limits the columns returned for
+    conversation turns, e.g. to leave out full responses. Responses carry
+    an ETag, so an unchanged page costs a 304 on the next poll.
+    """
+    if not 1 <= limit <= CONVERSATION_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {CONVERSATION_MAX_PAGE_SIZE}",
+        )
+    columns = None
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = sorted(set(requested) - set(storage.COLUMNS))
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+        # The cursor and the frontend's keys need these
+        columns = list(dict.fromkeys(["id", "created_at", *requested]))
+
     try:
         # 1. Get the specific query
-        result = supabase.table("queries").select("*").eq("id", query_id).execute()
-        if not result.data:
+        query_data = await asyncio.to_thread(query_store.get, query_id)
+        if not query_data:
             raise HTTPException(status_code=404, detail="Query not found")
-        query_data = result.data[0]
-        logger.debug(f"query_data: {query_data}")
+        logger.debug("query_data: %s", truncate(query_data))
 
         # 2. Safely retrieve conversation_id
         conversation_id = query_data.get("conversation_id")
 
-        # 3. Fetch entire conversation if we do have conversation_id
-        conversation_res = (
-            supabase.table("queries")
-            .select("*")
-            .eq("conversation_id", conversation_id)
-            # .order("created_at", ascending=True) # TODO!!
-            .execute()
+        # 3. One page of the conversation; one extra row tells whether there's more
+        conversation = await asyncio.to_thread(
+            query_store.conversation,
+            conversation_id,
+            limit=limit + 1,
+            before=storage.decode_cursor(before) if before else None,
+            columns=columns,
         )
+        next_cursor = None
+        if len(conversation) > limit:
+            conversation = conversation[1:]
+            next_cursor = storage.encode_cursor(conversation[0])
 
         logger.debug(
-            f"current_query {query_data} conversation: {conversation_res.data}"
+            "current_query %s conversation: %d rows", query_id, len(conversation)
+        )
+        payload = {
+            "current_query": query_data,
+            "conversation": conversation,
+            "next_cursor": next_cursor,
+        }
+        # New turns and follow-ups can still be added, so clients revalidate
+        return http_cache.cached_response(
+            request,
+            json.dumps(payload).encode(),
+            "application/json",
+            http_cache.REVALIDATE_CACHE_CONTROL,
+            http_cache.last_modified(
+                row.get(column)
+                for row in [query_data, *conversation]
+                for column in ("created_at", "completed_at")
+            ),
         )
-        return {"current_query": query_data, "conversation": conversation_res.data}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/query/generate-followups")
-async def generate_followups(query: Query):
-    """Generate followup questions for a given query using Claude."""
-    logger.debug(f"Generating followups for query: {query.model_dump_json()}")
-    try:
-        # Get only the most recent conversation for context
-        result = (
-            supabase.table("queries")
-            .select("*")
-            .eq("id", query.conversation_id)
-            .execute()
+def start_followups(query_row: dict) -> followups.FollowupJob:
+    """Generate follow-ups for a completed query in the background."""
+
+    async def generate(job: followups.FollowupJob):
+        answer = query_row.get("response") or ""
+        prompt = followups.followup_prompt(query_row["question"], answer)
+        # Suggestions can wait; answers to questions go first
+        await anthropic_limiter.acquire(
+            ratelimit.estimate_tokens(prompt), priority=ratelimit.BATCH
+        )
+        async with anthropic_client.messages.stream(
+            model=FOLLOWUP_MODEL,
+            max_tokens=1024,
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            async for text in stream.text_stream:
+                job.publish(text)
+            message = await stream.get_final_message()
+
+        logger.debug("Follow-ups for %s: %s", job.query_id, truncate(job.text))
+        await store_followups(
+            job.query_id, job.text, followup_usage(query_row, answer, message.usage)
         )
-        if not result.data:
-            raise HTTPException(status_code=404, detail="Query not found")
 
-        current_query = result.data[0]
-        current_response = current_query.get("response", "")
+    return followup_jobs.start(query_row["id"], generate)
 
-        # Use a simpler prompt with just the current Q&A
-        prompt = f"""Based on this Q&A:
-Q: {current_query["question"]}
-A: {current_response}
 
-Generate exactly 3 follow-up questions that would be good to ask next. Format them exactly like this:
-FOLLOWUP1: [first question]
-FOLLOWUP2: [second question]
-FOLLOWUP3: [third question]
+async def get_followup_job(query_id: str) -> followups.FollowupJob:
+    """The running or cached job, or one started for a completed query without follow-ups.
 
-Make sure each question starts with FOLLOWUPn: on its own line. Questions should be concise and directly related to the previous answer."""
+    A job for already stored follow-ups is returned finished. A query still
+    being answered gets 409: its run starts the follow-ups once the answer
+    is complete, and starting them here would build them from no answer.
+    """
+    job = followup_jobs.get(query_id)
+    if job is not None:
+        return job
+
+    query_row = await asyncio.to_thread(query_store.get, query_id)
+    if not query_row:
+        raise HTTPException(status_code=404, detail="Query not found")
+    if query_row.get("followups"):
+        job = followups.FollowupJob(query_id)
+        job.publish(query_row["followups"])
+        job.finish()
+        return job
+    if query_row.get("status") != "completed":
+        raise HTTPException(status_code=409, detail="Query has not completed yet")
+    return start_followups(query_row)
 
-        # Use a faster model for quicker responses
-        response = anthropic_client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}],
-        )
 
-        logger.debug(f"Claude response: {response.content[0].text}")
-        return {"followups": response.content[0].text}
+@app.post("/api/query/generate-followups")
+async def generate_followups(query: Query):
+    """Follow-up questions for a query: stored, in progress, or generated now."""
+    logger.debug("Generating followups for query: %s", query.conversation_id)
+    try:
+        job = await get_followup_job(query.conversation_id)
+        return {"followups": await job.wait()}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error generating followups: {str(e)}")
+        logger.error("Error generating followups: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/query/{query_id}/followups/stream")
+async def stream_followups(query_id: str):
+    """Stream follow-up text as it is generated, in the same SSE format as answers."""
+    job = await get_followup_job(query_id)
+
+    async def events():
+        chunks = 0
+        async for delta in job.stream():
+            chunks += 1
+            yield f"data: {json.dumps({'content': delta})}\n\n"
+        if job.error is not None:
+            yield f"data: {json.dumps({'error': str(job.error)})}\n\n"
+            return
+        yield f"data: {json.dumps({'end': True, 'total_chunks': chunks})}\n\n"
+
+    return StreamingResponse(
+        content=events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
+def followup_usage(query_row: dict, answer: str, response_usage) -> dict:
+    """Add follow-up generation tokens to the rollups; returns the query's usage."""
+    ledger = usage.UsageLedger(query_row["id"], "/api/query/generate-followups")
+    ledger.set_section("answer", answer)
+    ledger.add("followups", FOLLOWUP_MODEL, response_usage.model_dump())
+    usage.ROLLUP.add(ledger)
+
+    return usage.with_stage(
+        query_row.get("usage"), "followups", ledger.stages["followups"]
+    )
+
+
+async def store_followups(query_id: str, text: str, token_usage: dict):
+    """Save follow-ups and their usage on the query row in one write."""
+    with metrics.span("db_write"):
+        try:
+            await asyncio.to_thread(
+                query_store.update, query_id, {"followups": text, "usage": token_usage}
+            )
+            return
+        except Exception as e:
+            # Don't lose the usage update on a schema without the followups column
+            logger.warning("Follow-ups not persisted for %s: %s", query_id, e)
+        try:
+            await asyncio.to_thread(
+                query_store.update, query_id, {"usage": token_usage}
+            )
+        except Exception as e:
+            logger.warning("Follow-up usage not persisted: %s", e)
+
+
+@app.get("/api/usage")
+async def get_usage():
+    """Token and cost rollups per endpoint, stage and prompt section."""
+    return usage.ROLLUP.snapshot()
+
+
+@app.get("/api/stats")
+async def get_stats(request: Request):
+    """Precomputed dataset aggregates; body and ETag change only with samples.tsv."""
+    return http_cache.cached_response(
+        request,
+        aggregates.stats_json(),
+        "application/json",
+        STATS_CACHE_CONTROL,
+    )
+
+
 @app.get("/api/health")
 async def health_check():
     logger.debug("healthy")
     return {"status": "healthy"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Expose stage histograms and counters in Prometheus text format."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to long tool-using generations
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra="") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key in sorted(self._counts):
+                counts = self._counts[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {self._sums[key]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(
+    Histogram(
+        "plasticlist_stage_duration_seconds",
+        "Duration of named request lifecycle stages.",
+        labelnames=("stage",),
+    )
+)
+STAGE_ERRORS = REGISTRY.register(
+    Counter(
+        "plasticlist_stage_errors_total",
+        "Stages that raised an exception.",
+        labelnames=("stage",),
+    )
+)
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "plasticlist_http_requests_total",
+        "HTTP requests by route and status code.",
+        labelnames=("method", "route", "status"),
+    )
+)
+HTTP_DURATION = REGISTRY.register(
+    Histogram(
+        "plasticlist_http_request_duration_seconds",
+        "Time until the response starts, by route.",
+        labelnames=("method", "route"),
+    )
+)
+EVENT_LOOP_LAG = REGISTRY.register(
+    Histogram(
+        "plasticlist_event_loop_lag_seconds",
+        "How late the event loop woke a periodic sleep; high values mean blocking calls.",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    )
+)
+QUERIES = REGISTRY.register(
+    Counter(
+        "plasticlist_queries_total",
+        "Streamed query generations by final status.",
+        labelnames=("status",),
+    )
+)
+
+
+class RequestTimer:
+    """Collects the named spans of a single query so they can be logged together."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def record(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+
+    def summary(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        totals["request_total"] = time.perf_counter() - self.started
+        return {stage: round(seconds * 1000, 1) for stage, seconds in totals.items()}
+
+
+_current_timer: contextvars.ContextVar[Optional[RequestTimer]] = contextvars.ContextVar(
+    "current_timer", default=None
+)
+
+
+def start_request(request_id: str) -> RequestTimer:
+    """Start a timer that spans recorded in this context will be attached to."""
+    timer = RequestTimer(request_id)
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current_timer.get()
+
+
+def record(stage: str, seconds: float):
+    """Record an already measured stage duration (e.g. time-to-first-token)."""
+    STAGE_DURATION.observe(seconds, stage=stage)
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record(stage, seconds)
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Time a block of code as a named stage, in sync or async code alike."""
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        # A disconnected client, not a failing stage
+        raise
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def log_summary(timer: RequestTimer, status: str):
+    QUERIES.inc(status=status)
+    logger.info(
+        "Query %s finished (%s) timings_ms=%s",
+        timer.request_id,
+        status,
+        timer.summary(),
+    )
+
+
+async def monitor_event_loop_lag(interval: float):
+    """Observe, every `interval` seconds, how much later than asked a sleep returns."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
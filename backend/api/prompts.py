@@ -0,0 +1,178 @@
+import functools
+import logging
+from typing import Dict, List
+
+from api import aggregates, schema
+
+logger = logging.getLogger(__name__)
+
+# Ephemeral cache breakpoint; everything up to and including the marked block is cached
+CACHE_CONTROL = {"type": "ephemeral"}
+
+SYSTEM_PROMPT = """You are PlasticList Search, a demo search interface for the PlasticList project, a research initiative that tested over 100 everyday foods from the Bay Area for the presence of plastic chemicals. The study, conducted by a team of independent researchers, quantified the levels of endocrine-disrupting chemicals (EDCs) and other plastic-related substances in common food items. The accompanying TSV dataset contains extensive data on chemical levels, testing conditions, and safety thresholds.
+
+In each query, the user will ask a question, you will respond with the best response in one go. The user message contains the conversation so far (if any), additional context about PlasticList and the TSV, and the question being asked.
+
+You have access to a Python query tool that can analyze samples.tsv data of plasticlist directly. It contains more than 600 rows and 100 columns. Use this tool when you need to perform calculations, filtering, or statistical analysis that isn't readily available in the context as the context only provides a preview of the entries in the TSV and not all of them. Note that there are over 100 different fields in the TSV so do not print all of them unless told to do so. For queries that look to filter the TSV data, check in your python program that if the final table has less than 20 entries, print the dataframe using .to_markdown() and then follow the original user query exactly. If the user is asking for the entries, display all entries again for the user (try to do in a nice table) since they cannot see the Python output. If the user asks you to do data analysis in a general form, add lots of extra debug and print statements and analyze lots of things in the Python snippets just in case it is helpful to the context. Do not use the tool if it is not necessary and the context suffices! There is no need to explain that the context suffices; just end the conversation if no tool is needed.
+
+You also have a SQL query tool over the same data. Prefer it for filters, counts, rankings and group-by aggregations: it is faster and its results are cached. Use the Python tool for analysis SQL can't express.
+
+If the context starts with "Matched samples", those lines are the complete rows for the products named in the question, with every detected concentration, the chemicals below the limit of quantification and the % of the EPA tolerable daily intake. Answer questions about those products from them directly without the tool, unless the question also needs other products or calculations across the dataset.
+
+Make sure you output the final python program or SQL statement. Note that you cannot call the tool multiple times with the user asking another question. If the query was bad, you must ask the user if you can try again. Again, always output the python snippet or SQL statement you ran as a tool.
+
+Note that we can render markdown so include the python program in a python codeblock, or the SQL statement in a sql codeblock.
+
+Also, if you use the tool, you must include the Python snippet in your final response as well. Try to be more concise in your analysis please, list only interesting facts. Also, use more markdown and bold in your answers to highlight important facts. Note that there is a string limit in your python output program so be wary of outputting too much information.
+
+The second system block holds precomputed dataset statistics: per-chemical detection counts and min/median/max concentrations, the top products per chemical, TDI exceedance counts and the most common tags. Answer questions about those directly from the statistics without the tool."""
+
+PYTHON_QUERY_TOOL = {
+    "name": "run_python_query",
+    "description": "Executes a Python query on the PlasticList TSV data",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "A complete Python code snippet that uses pandas to analyze the TSV data. The data will be available as a pandas DataFrame named 'df'.",
+            }
+        },
+        "required": ["query"],
+    },
+}
+
+SQL_QUERY_TOOL = {
+    "name": "run_sql_query",
+    "description": "Runs one read-only SQLite SELECT statement on the PlasticList samples. Table `samples` has one row per sample with the same columns as the TSV; measurement columns (*_ng_g, *_percentile_ng_g, *_ng_serving, *_percent_tdi_*) are REAL and NULL when not detected (below the limit of quantification) or without a reference dose. Table `sample_tags` has one (sample_id, tag) row per tag and joins to samples.id. Results are limited to a few hundred rows and statements time out after a couple of seconds.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "A single SQLite SELECT (or WITH ... SELECT) statement.",
+            }
+        },
+        "required": ["query"],
+    },
+}
+
+TOOLS = [PYTHON_QUERY_TOOL, SQL_QUERY_TOOL]
+
+
+@functools.lru_cache(maxsize=None)
+def tools() -> List[Dict]:
+    """Tool definitions with the column catalog appended to the Python tool.
+
+    The catalog is given once; the SQL tool refers to it. Built once, so the
+    tools prefix stays byte-identical across calls and is read from cache.
+    """
+    try:
+        catalog = schema.catalog()
+    except Exception as e:
+        logger.warning("Column catalog left out of the tool description: %s", e)
+        return TOOLS
+    python_tool = {
+        **PYTHON_QUERY_TOOL,
+        "description": f"{PYTHON_QUERY_TOOL['description']}\n\n{catalog}",
+    }
+    sql_tool = {
+        **SQL_QUERY_TOOL,
+        "description": f"{SQL_QUERY_TOOL['description']} Column names are listed "
+        f"in the {PYTHON_QUERY_TOOL['name']} description.",
+    }
+    return [python_tool, sql_tool]
+
+
+def system_blocks() -> List[Dict]:
+    """Static system section, identical on every call so tools + system are cached.
+
+    The dataset statistics change only with samples.tsv, so they sit inside the
+    cached prefix; the breakpoint goes on the last block.
+    """
+    blocks = [{"type": "text", "text": SYSTEM_PROMPT}]
+    try:
+        blocks.append({"type": "text", "text": aggregates.stats_context()})
+    except Exception as e:
+        logger.warning("Dataset stats left out of the system prompt: %s", e)
+    blocks[-1]["cache_control"] = CACHE_CONTROL
+    return blocks
+
+
+def conversation_history(rows: List[Dict], query_id: str) -> str:
+    """Earlier answered Q&A pairs of a conversation, oldest first."""
+    blocks = []
+    for row in sorted(rows, key=lambda x: x["created_at"]):
+        # Skip current query
+        if row["id"] == query_id:
+            continue
+
+        # Include all previous Q&A pairs
+        response = row.get("response", "")
+        if response:  # Include if there's any response
+            blocks.append(f"Q: {row['question']}\nA: {response}")
+    return "\n\n".join(blocks)
+
+
+def user_message(history: str, context: str, question: str) -> Dict:
+    """Dynamic part of the prompt: history, retrieved context, then the question.
+
+    The block carries its own cache breakpoint so the tool-result continuation,
+    which resends it verbatim, reads it from cache instead of reprocessing it.
+    """
+    text = (
+        f"Conversation so far (if any):\n{history}\n\n"
+        f"Additional context about PlasticList and the TSV:\n{context}\n\n"
+        f"Now the user is asking:\n{question}"
+    )
+    return {
+        "role": "user",
+        "content": [{"type": "text", "text": text, "cache_control": CACHE_CONTROL}],
+    }
+
+
+def tool_result_message(
+    tool_use_id: str, tool_result: str, is_error: bool = False
+) -> Dict:
+    block = {"type": "tool_result", "tool_use_id": tool_use_id, "content": tool_result}
+    if is_error:
+        block["is_error"] = True
+    return {"role": "user", "content": [block]}
+
+
+def continuation_messages(
+    first_message: Dict,
+    assistant_text: str,
+    tool_use_id: str,
+    tool_name: str,
+    tool_input: Dict,
+    tool_result: str,
+    is_error: bool = False,
+) -> List[Dict]:
+    """Messages for the call that hands a tool result back to the model."""
+    assistant_content = []
+    if assistant_text.strip():
+        assistant_content.append({"type": "text", "text": assistant_text})
+    assistant_content.append(
+        {"type": "tool_use", "id": tool_use_id, "name": tool_name, "input": tool_input}
+    )
+    return [
+        first_message,
+        {"role": "assistant", "content": assistant_content},
+        tool_result_message(tool_use_id, tool_result, is_error),
+    ]
+
+
+def build_request(model: str, messages: List[Dict], stream: bool = False) -> Dict:
+    """Request body sharing the same tools and system prefix across calls."""
+    data = {
+        "model": model,
+        "max_tokens": 8024,
+        "system": system_blocks(),
+        "tools": tools(),
+        "tool_choice": {"type": "auto"},
+        "messages": messages,
+    }
+    if stream:
+        data["stream"] = True
+    return data
@@ -0,0 +1,234 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from api import metrics
+from api.usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Admission priorities; lower is served first
+INTERACTIVE = 0
+BATCH = 1
+
+# Default requests and tokens per minute, overridden by {PROVIDER}_RPM / _TPM;
+# 0 turns that bucket off
+PROVIDER_LIMITS = {
+    "anthropic": (1000, 400000),
+    "voyage": (2000, 3000000),
+}
+
+# Callers allowed to wait per provider, and for how long, before being shed
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "64"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+# Batch work has no user watching a spinner, so it may wait much longer
+RATE_LIMIT_BATCH_MAX_WAIT_SECONDS = float(
+    os.getenv("RATE_LIMIT_BATCH_MAX_WAIT_SECONDS", "120")
+)
+
+# Pause after a 429 that doesn't say how long to back off
+DEFAULT_RETRY_AFTER_SECONDS = 5.0
+
+ADMISSIONS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_rate_limit_admissions_total",
+        "Upstream calls by provider and outcome (admitted, queue_full, timeout, throttled).",
+        labelnames=("provider", "outcome"),
+    )
+)
+ADMISSION_WAIT = metrics.REGISTRY.register(
+    metrics.Histogram(
+        "plasticlist_rate_limit_wait_seconds",
+        "Time admitted upstream calls waited for rate-limit capacity.",
+        labelnames=("provider",),
+        buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    )
+)
+
+
+class RateLimitExceeded(Exception):
+    """The call was shed instead of waiting for capacity."""
+
+
+class TokenBucket:
+    """`per_minute` units a minute, bursting up to one minute's worth."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available; oversized requests wait for a full bucket."""
+        self._refill(self.clock())
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    ready: asyncio.Event = field(compare=False)
+
+
+class ProviderLimiter:
+    """Request and token buckets for one provider, with a bounded priority queue.
+
+    Async callers wait in priority order (interactive before batch, then
+    first come, first served). A caller is shed with RateLimitExceeded when
+    the queue is full, or as soon as it's clear capacity won't free up
+    within `max_wait` (`batch_max_wait` for batch work). Blocking callers (the ingestion scripts) share the
+    buckets but not the queue.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_queue: int = RATE_LIMIT_MAX_QUEUE,
+        max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        batch_max_wait: float = RATE_LIMIT_BATCH_MAX_WAIT_SECONDS,
+    ):
+        self.name = name
+        self.requests = (
+            TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        )
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.batch_max_wait = batch_max_wait
+        self.clock = clock
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def pause(self, seconds: float):
+        """Admit nothing for `seconds`, e.g. after the provider answered 429."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+        logger.warning(
+            "%s rate limited; pausing admissions for %.1fs", self.name, seconds
+        )
+
+    def throttled(self, retry_after: Optional[str] = None) -> RateLimitExceeded:
+        """Handle a 429: pause for its Retry-After and return the error to raise."""
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            seconds = DEFAULT_RETRY_AFTER_SECONDS
+        self.pause(seconds)
+        ADMISSIONS.inc(provider=self.name, outcome="throttled")
+        return RateLimitExceeded(
+            f"{self.name} rate limit reached; please try again shortly"
+        )
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """Take capacity for one call now and return 0, or return seconds to wait."""
+        with self._lock:
+            wait = max(0.0, self.paused_until - self.clock())
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1))
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None and tokens:
+                self.tokens.take(tokens)
+            return 0.0
+
+    def _shed(self, outcome: str, detail: str):
+        ADMISSIONS.inc(provider=self.name, outcome=outcome)
+        raise RateLimitExceeded(
+            f"{self.name} is at capacity ({detail}); please try again shortly"
+        )
+
+    async def acquire(self, tokens: int = 0, priority: int = INTERACTIVE):
+        """Wait, in priority order, until a call with `tokens` may be made."""
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue_full", f"{len(self._waiters)} calls waiting")
+        max_wait = self.batch_max_wait if priority >= BATCH else self.max_wait
+        start = self.clock()
+        deadline = start + max_wait
+        waiter = _Waiter(priority, next(self._sequence), asyncio.Event())
+        heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                if self._waiters[0] is waiter:
+                    wait = self.try_acquire(tokens)
+                    if wait == 0:
+                        break
+                    if self.clock() + wait > deadline:
+                        self._shed("timeout", f"next slot in {wait:.1f}s")
+                else:
+                    wait = deadline - self.clock()
+                    if wait <= 0:
+                        self._shed("timeout", f"waited {max_wait:g}s")
+                try:
+                    await asyncio.wait_for(waiter.ready.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.ready.clear()
+        finally:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if self._waiters:
+                self._waiters[0].ready.set()
+        ADMISSIONS.inc(provider=self.name, outcome="admitted")
+        ADMISSION_WAIT.observe(self.clock() - start, provider=self.name)
+
+    def acquire_sync(self, tokens: int = 0, max_wait: Optional[float] = None):
+        """Blocking acquire for scripts: sleep until capacity frees up."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = self.clock()
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                break
+            if self.clock() + wait > start + max_wait:
+                self._shed("timeout", f"next slot in {wait:.1f}s")
+            time.sleep(wait)
+        ADMISSIONS.inc(provider=self.name, outcome="admitted")
+        ADMISSION_WAIT.observe(self.clock() - start, provider=self.name)
+
+
+@functools.lru_cache(maxsize=None)
+def limiter(provider: str) -> ProviderLimiter:
+    """The process-wide limiter for a provider in PROVIDER_LIMITS.
+
+    Limits are read on first use, after callers have loaded their .env.
+    """
+    requests_per_minute, tokens_per_minute = PROVIDER_LIMITS[provider]
+    prefix = provider.upper()
+    return ProviderLimiter(
+        provider,
+        float(os.getenv(f"{prefix}_RPM", requests_per_minute)),
+        float(os.getenv(f"{prefix}_TPM", tokens_per_minute)),
+    )
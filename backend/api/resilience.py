@@ -0,0 +1,299 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+# A duplicate request goes out once the first has taken longer than this
+# percentile of recent latencies; 0 turns hedging off
+HEDGE_PERCENTILE = float(os.getenv("RETRIEVAL_HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("RETRIEVAL_HEDGE_MIN_DELAY_MS", "20")) / 1000
+# Hedge delay until enough latencies have been seen
+HEDGE_INITIAL_DELAY_SECONDS = 0.25
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Longest a retrieval call may take, hedge included, before falling back
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "3"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+# Threads per index for its calls. A hung backend can tie up at most these;
+# fallbacks and other blocking work keep the default executor to themselves
+RETRIEVAL_MAX_THREADS = int(os.getenv("RETRIEVAL_MAX_THREADS", "8"))
+
+# The breaker opens when, over the last BREAKER_WINDOW calls (at least
+# BREAKER_MIN_CALLS), the share of failed or slow calls reaches the rate
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "1.0"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+RETRIEVAL_CALLS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_retrieval_calls_total",
+        "Retrieval calls by backend and how they were answered "
+        "(primary, hedge, cache, fallback, error).",
+        labelnames=("backend", "outcome"),
+    )
+)
+BREAKER_TRANSITIONS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_circuit_breaker_transitions_total",
+        "Circuit breaker state changes by backend and new state.",
+        labelnames=("backend", "state"),
+    )
+)
+
+
+class CircuitOpenError(Exception):
+    """The backend's breaker is open and no fallback is available."""
+
+
+class LatencyWindow:
+    """Recent successful latencies, for picking the hedge delay."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Nearest-rank percentile, q in [0, 100]; None for no samples."""
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+
+class CircuitBreaker:
+    """Closed -> open on too many failed or slow calls -> half-open trial after a cooldown."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        slow_seconds: float = BREAKER_SLOW_SECONDS,
+        slow_rate: float = BREAKER_SLOW_RATE,
+        cooldown: float = BREAKER_COOLDOWN_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._trial_running = False
+        # (failed, slow) per call
+        self.outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning("Circuit for %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        BREAKER_TRANSITIONS.inc(backend=self.name, state=state)
+        if state == self.OPEN:
+            self.opened_at = self.clock()
+        elif state == self.CLOSED:
+            self.outcomes.clear()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now."""
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.cooldown:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # One trial call at a time decides whether to close again
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+        return self.state == self.CLOSED
+
+    def release(self):
+        """The allowed call ended without an outcome (e.g. it was cancelled)."""
+        self._trial_running = False
+
+    def record(self, ok: bool, seconds: float):
+        slow = seconds > self.slow_seconds
+        if self.state == self.HALF_OPEN:
+            self._trial_running = False
+            self._transition(self.CLOSED if ok and not slow else self.OPEN)
+            return
+        self.outcomes.append((not ok, slow))
+        calls = len(self.outcomes)
+        if self.state != self.CLOSED or calls < self.min_calls:
+            return
+        failed = sum(failed for failed, _ in self.outcomes) / calls
+        slow_share = sum(slow for _, slow in self.outcomes) / calls
+        if failed >= self.failure_rate or slow_share >= self.slow_rate:
+            self._transition(self.OPEN)
+
+
+class ResilientIndex:
+    """Hedged, time-bounded calls to one index, with a breaker and fallbacks.
+
+    A call that hasn't answered within the hedge percentile of recent
+    latencies gets a duplicate, and the first answer wins. When the call
+    fails, times out or the breaker is open, the last result for the same
+    key is served from cache, then `fallback` is tried, before giving up.
+    Calls run on the index's own bounded thread pool, so attempts left
+    hanging by an outage can't starve the fallback of threads.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        query: Callable[..., Any],
+        fallback: Optional[Callable[..., Any]] = None,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        min_hedge_delay: float = HEDGE_MIN_DELAY_SECONDS,
+        timeout: float = RETRIEVAL_TIMEOUT_SECONDS,
+        cache_size: int = RETRIEVAL_CACHE_SIZE,
+        breaker: Optional[CircuitBreaker] = None,
+        max_threads: int = RETRIEVAL_MAX_THREADS,
+    ):
+        self.name = name
+        self._query = query
+        self.fallback = fallback
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, Any]" = OrderedDict()
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latencies = LatencyWindow()
+        self.executor = ThreadPoolExecutor(max_threads, thread_name_prefix=name)
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        if len(self.latencies.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY_SECONDS
+        return max(
+            self.min_hedge_delay, self.latencies.percentile(self.hedge_percentile)
+        )
+
+    def _timed_query(self, kwargs: dict):
+        start = time.perf_counter()
+        result = self._query(**kwargs)
+        self.latencies.add(time.perf_counter() - start)
+        return result
+
+    def _attempt(self, kwargs: dict) -> asyncio.Future:
+        call = functools.partial(
+            contextvars.copy_context().run, self._timed_query, kwargs
+        )
+        task = asyncio.get_running_loop().run_in_executor(self.executor, call)
+        # A losing attempt may fail after the call returned; don't warn about it
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _hedged(self, kwargs: dict):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.timeout
+        delay = self.hedge_delay()
+        hedge_at = start + delay if delay is not None else None
+        attempts = [self._attempt(kwargs)]
+        try:
+            return await self._first_answer(attempts, kwargs, deadline, hedge_at)
+        finally:
+            # Attempts still queued for a thread never start
+            for task in attempts:
+                task.cancel()
+
+    async def _first_answer(
+        self,
+        attempts: List[asyncio.Future],
+        kwargs: dict,
+        deadline: float,
+        hedge_at: Optional[float],
+    ):
+        """Wait for the first successful attempt, adding the hedge when it's due."""
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [task for task in attempts if not task.done()]
+            wake = deadline
+            if hedge_at is not None and len(attempts) == 1:
+                wake = min(wake, hedge_at)
+            if pending and wake > loop.time():
+                await asyncio.wait(
+                    pending,
+                    timeout=wake - loop.time(),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            for number, task in enumerate(attempts):
+                if task.done() and task.exception() is None:
+                    RETRIEVAL_CALLS.inc(
+                        backend=self.name, outcome="hedge" if number else "primary"
+                    )
+                    return task.result()
+            if loop.time() >= deadline:
+                raise asyncio.TimeoutError(
+                    f"{self.name} timed out after {self.timeout:g}s"
+                )
+            if all(task.done() for task in attempts):
+                if hedge_at is None or len(attempts) > 1:
+                    raise attempts[-1].exception()
+                # The first attempt failed fast: send the hedge now
+                hedge_at = loop.time()
+            if hedge_at is not None and len(attempts) == 1 and loop.time() >= hedge_at:
+                attempts.append(self._attempt(kwargs))
+
+    async def query(self, key: str, **kwargs):
+        """Query the index; `key` identifies the request for the result cache."""
+        error: Exception = CircuitOpenError(f"circuit for {self.name} is open")
+        if self.breaker.allow():
+            start = time.perf_counter()
+            try:
+                result = await self._hedged(kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                self.breaker.record(False, time.perf_counter() - start)
+                logger.warning("%s failed (%s), falling back", self.name, e)
+                error = e
+            else:
+                self.breaker.record(True, time.perf_counter() - start)
+                self.cache[key] = result
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                return result
+
+        if key in self.cache:
+            RETRIEVAL_CALLS.inc(backend=self.name, outcome="cache")
+            return self.cache[key]
+        if self.fallback is not None:
+            RETRIEVAL_CALLS.inc(backend=self.name, outcome="fallback")
+            # A local scan is CPU work, like the primary calls kept off the loop
+            return await asyncio.to_thread(self.fallback, **kwargs)
+        RETRIEVAL_CALLS.inc(backend=self.name, outcome="error")
+        raise error
@@ -0,0 +1,346 @@
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from api import aggregates, metrics
+from api.lookup import normalize
+
+logger = logging.getLogger(__name__)
+
+ROUTED = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_routed_queries_total",
+        "Questions answered by the deterministic router, by intent.",
+        labelnames=("intent",),
+    )
+)
+
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 50
+
+# Longest table the router renders; longer results are cut with a note
+MAX_TABLE_ROWS = 50
+
+# Questions longer than this are left to the model, which handles nuance better
+MAX_QUESTION_CHARS = 160
+
+# Words that signal the question wants more than a table, or excludes
+# something ("not in plastic", "other than milk") that a tag filter can't
+FALLTHROUGH_WORDS = re.compile(
+    r"\b(why|how come|explain|compare|versus|vs|difference|trend|correlat\w*|"
+    r"plot|chart|graph|safe|should|not|excluding|except|without|other than|"
+    r"besides)\b"
+)
+# Counts and shares ("how many foods exceed ...") want a number, not a table
+COUNT_PATTERN = re.compile(
+    r"\b(how many|what share|what proportion|what fraction|what percent\w*|"
+    r"number of|count)\b"
+)
+
+TOP_PATTERN = re.compile(r"\b(top|highest|most|worst|biggest|largest)\b")
+TOP_N_PATTERN = re.compile(
+    r"\btop (\d{1,3})\b|\b(\d{1,3}) (?:\w+ ){0,3}(?:highest|most)\b"
+)
+AVERAGE_PATTERN = re.compile(r"\b(average|mean|avg)\b")
+TDI_PATTERN = re.compile(r"\b(tdi|tolerable daily intake)\b")
+THRESHOLD_PATTERN = re.compile(
+    r"\b(?:exceed\w*|above|over|more than|at least|greater than)\s+(\d+(?:\.\d+)?)\s*(?:%|percent|pct)"
+)
+CHILD_PATTERN = re.compile(r"\b(14 ?kg|child|children|kid|kids|toddler\w*)\b")
+
+# What a routed table ranks; without one ("the most harmful chemical", "top
+# concerns about BPA") the question is conceptual and goes to the model
+OBJECT_PATTERN = re.compile(r"\b(products?|foods?|samples?|items?)\b")
+# Words allowed between "by"/"in" and the chemical, e.g. "by mean DEHP"
+SCOPE_GAP = r"(?:\w+ ){0,2}"
+
+
+@dataclass
+class RoutedAnswer:
+    intent: str
+    params: Dict
+    table: pd.DataFrame
+    title: str
+    notes: List[str] = field(default_factory=list)
+
+    def to_markdown(self) -> str:
+        lines = [f"**{self.title}**", ""]
+        if self.table.empty:
+            lines.append("No samples match.")
+        else:
+            shown = self.table.head(MAX_TABLE_ROWS)
+            lines.append(shown.to_markdown(index=False, missingval="-"))
+            if len(self.table) > len(shown):
+                lines.append("")
+                lines.append(f"_Showing {len(shown)} of {len(self.table)} rows._")
+        lines.extend(["", *[f"_{note}_" for note in self.notes]])
+        return "\n".join(lines).rstrip()
+
+
+class QueryRouter:
+    """Answers template-like questions with precompiled pandas operations.
+
+    Numeric views of every concentration and % TDI column, and the exploded
+    tags, are built once; each intent is then a vectorized filter/groupby.
+    Anything the classifier isn't sure about returns None and goes to the model.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.chemicals = aggregates.chemicals(df)
+        self.products = df[["product", "product_id"]]
+        self.concentrations = pd.DataFrame(
+            {
+                chemical: aggregates.to_numeric(
+                    df[f"{chemical}{aggregates.CONCENTRATION_SUFFIX}"]
+                )
+                for chemical in self.chemicals
+            }
+        )
+        self.tdi = {}
+        for variant in aggregates.TDI_VARIANTS:
+            columns = {
+                chemical: aggregates.to_numeric(df[f"{chemical}_percent_tdi_{variant}"])
+                for chemical in self.chemicals
+                if f"{chemical}_percent_tdi_{variant}" in df.columns
+            }
+            frame = pd.DataFrame(columns, index=df.index)
+            self.tdi[variant] = frame.loc[:, frame.notna().any()]
+
+        tags = df["tags"].fillna("").str.split(",").explode().map(normalize)
+        tags = tags[tags != ""]
+        self.tag_rows = {tag: rows.index.unique() for tag, rows in tags.groupby(tags)}
+
+        self.chemical_names = {
+            normalize(chemical): chemical for chemical in self.chemicals
+        }
+        self.chemical_pattern = self._alternation(self.chemical_names)
+        self.tag_pattern = self._alternation(self.tag_rows)
+
+    @staticmethod
+    def _alternation(names) -> re.Pattern:
+        """Whole-word match of any name, longest first."""
+        ordered = sorted(names, key=len, reverse=True)
+        return re.compile(
+            r"\b(" + "|".join(re.escape(name) for name in ordered) + r")\b"
+        )
+
+    def _mentions(self, pattern: re.Pattern, text: str) -> List[str]:
+        found = []
+        for match in pattern.finditer(text):
+            if match.group(1) not in found:
+                found.append(match.group(1))
+        return found
+
+    @staticmethod
+    def _scopes(tag: str, text: str) -> bool:
+        """Whether the question limits itself to `tag` rather than just naming it.
+
+        "in/for/among/across <tag>" or "<tag> products" scope; a tag named
+        anywhere else ("by DEHP, supplements aside") is left to the model.
+        """
+        tag = re.escape(tag)
+        return bool(
+            re.search(rf"\b(?:in|for|among|across) {SCOPE_GAP}{tag}\b", text)
+            or re.search(rf"\b{tag} {OBJECT_PATTERN.pattern}", text)
+        )
+
+    def classify(self, question: str) -> Optional[Dict]:
+        """Intent and parameters for a template-like question, or None."""
+        if len(question) > MAX_QUESTION_CHARS:
+            return None
+        text = normalize(question)
+        raw = question.lower()
+        if FALLTHROUGH_WORDS.search(text) or COUNT_PATTERN.search(text):
+            return None
+
+        chemicals = [
+            self.chemical_names[name]
+            for name in self._mentions(self.chemical_pattern, text)
+        ]
+        tags = self._mentions(self.tag_pattern, text)
+
+        if TDI_PATTERN.search(text):
+            threshold = THRESHOLD_PATTERN.search(raw)
+            if not threshold or not OBJECT_PATTERN.search(text) or len(tags) > 1:
+                return None
+            if tags and not self._scopes(tags[0], text):
+                return None
+            agency = "efsa" if "efsa" in text else "epa"
+            weight = "14" if CHILD_PATTERN.search(text) else "70"
+            return {
+                "intent": "tdi_exceedance",
+                "threshold": float(threshold.group(1)),
+                "variant": f"{weight}_kg_{agency}",
+                "chemicals": chemicals,
+                "tag": tags[0] if tags else None,
+            }
+
+        if AVERAGE_PATTERN.search(text):
+            if not chemicals or len(tags) != 1:
+                return None
+            # "average <chemical> ... in <tag>"
+            chemical = re.escape(normalize(chemicals[0]))
+            if not re.search(
+                rf"\b(?:average|mean|avg) {SCOPE_GAP}{chemical}\b", text
+            ) or not self._scopes(tags[0], text):
+                return None
+            return {"intent": "tag_average", "chemicals": chemicals, "tag": tags[0]}
+
+        if TOP_PATTERN.search(text):
+            if len(chemicals) != 1 or len(tags) > 1 or not OBJECT_PATTERN.search(text):
+                return None
+            # "top foods by DEHP", "products highest in DEHP"
+            if not re.search(
+                rf"\b(?:by|in) {SCOPE_GAP}{re.escape(normalize(chemicals[0]))}\b", text
+            ):
+                return None
+            if tags and not self._scopes(tags[0], text):
+                return None
+            count = TOP_N_PATTERN.search(text)
+            top_n = int(next(filter(None, count.groups()))) if count else DEFAULT_TOP_N
+            return {
+                "intent": "top_products",
+                "chemical": chemicals[0],
+                "top_n": max(1, min(top_n, MAX_TOP_N)),
+                "tag": tags[0] if tags else None,
+            }
+        return None
+
+    def _rows(self, tag: Optional[str]) -> pd.Index:
+        return self.df.index if tag is None else self.tag_rows[tag]
+
+    def top_products(
+        self, chemical: str, top_n: int, tag: Optional[str]
+    ) -> RoutedAnswer:
+        rows = self._rows(tag)
+        values = self.concentrations.loc[rows, chemical].dropna()
+        table = (
+            self.products.loc[values.index]
+            .assign(value=values)
+            .groupby(["product", "product_id"], sort=False)["value"]
+            .agg(["mean", "max", "count"])
+            .sort_values("mean", ascending=False)
+            .head(top_n)
+            .reset_index()
+        )
+        table.insert(0, "rank", range(1, len(table) + 1))
+        table.columns = [
+            "Rank",
+            "Product",
+            "Product ID",
+            f"Mean {chemical} (ng/g)",
+            f"Max {chemical} (ng/g)",
+            "Detected samples",
+        ]
+        scope = f" tagged `{tag.replace(' ', '_')}`" if tag else ""
+        return RoutedAnswer(
+            "top_products",
+            {"chemical": chemical, "top_n": top_n, "tag": tag},
+            table.round(2),
+            f"Top {top_n} products{scope} by mean {chemical} concentration",
+            [
+                "Means are over samples where the chemical was detected; "
+                "non-detects (below the limit of quantification) are excluded."
+            ],
+        )
+
+    def tag_average(self, chemicals: List[str], tag: str) -> RoutedAnswer:
+        rows = self._rows(tag)
+        values = self.concentrations.loc[rows, chemicals]
+        table = pd.DataFrame(
+            {
+                "Chemical": chemicals,
+                "Samples": len(rows),
+                "Detected": values.notna().sum().to_numpy(),
+                "Mean of detected (ng/g)": values.mean().to_numpy(),
+                "Median of detected (ng/g)": values.median().to_numpy(),
+                "Max (ng/g)": values.max().to_numpy(),
+            }
+        )
+        return RoutedAnswer(
+            "tag_average",
+            {"chemicals": chemicals, "tag": tag},
+            table.round(2),
+            f"Average {', '.join(chemicals)} in samples tagged `{tag.replace(' ', '_')}`",
+            [
+                f"{len(rows)} samples across "
+                f"{self.df.loc[rows, 'product'].nunique()} products; "
+                "non-detects are excluded from the averages."
+            ],
+        )
+
+    def tdi_exceedance(
+        self, threshold: float, variant: str, chemicals: List[str], tag: Optional[str]
+    ) -> RoutedAnswer:
+        frame = self.tdi.get(variant, pd.DataFrame())
+        if chemicals:
+            frame = frame[[chemical for chemical in chemicals if chemical in frame]]
+        long = frame.loc[self._rows(tag)].stack()
+        long = long[long >= threshold].rename("percent")
+        long.index.names = ["row", "chemical"]
+        long = long.reset_index()
+        table = (
+            long.join(self.products, on="row")
+            .groupby(["product", "product_id", "chemical"], sort=False)["percent"]
+            .agg(["max", "count"])
+            .sort_values("max", ascending=False)
+            .reset_index()
+        )
+        table.columns = [
+            "Product",
+            "Product ID",
+            "Chemical",
+            "Max % of TDI",
+            "Samples over threshold",
+        ]
+        weight, _, agency = variant.split("_")
+        subject = ", ".join(chemicals) if chemicals else "any chemical"
+        scope = f" tagged `{tag.replace(' ', '_')}`" if tag else ""
+        notes = [
+            f"% of the {agency.upper()} tolerable daily intake for a {weight} kg "
+            "person eating one serving."
+        ]
+        missing = [chemical for chemical in chemicals if chemical not in frame]
+        if missing:
+            notes.append(
+                f"No {agency.upper()} reference dose for {', '.join(missing)}."
+            )
+        return RoutedAnswer(
+            "tdi_exceedance",
+            {
+                "threshold": threshold,
+                "variant": variant,
+                "chemicals": chemicals,
+                "tag": tag,
+            },
+            table.round(2),
+            f"Products{scope} at or above {threshold:g}% of the "
+            f"{agency.upper()} TDI ({weight} kg) for {subject}",
+            notes,
+        )
+
+    def answer(self, question: str) -> Optional[RoutedAnswer]:
+        params = self.classify(question)
+        if params is None:
+            return None
+        intent = params.pop("intent")
+        answer = getattr(self, intent)(**params)
+        ROUTED.inc(intent=intent)
+        return answer
+
+
+def build_router(df: pd.DataFrame) -> QueryRouter:
+    start = time.perf_counter()
+    router = QueryRouter(df)
+    logger.info(
+        "Built query router (%d chemicals, %d tags) in %.1f ms",
+        len(router.chemicals),
+        len(router.tag_rows),
+        (time.perf_counter() - start) * 1000,
+    )
+    return router
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds a generation keeps running with nobody listening before it is cancelled
+CANCEL_GRACE_SECONDS = float(os.getenv("STREAM_CANCEL_GRACE_SECONDS", "5"))
+
+CANCELLED_RUNS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_cancelled_generations_total",
+        "Answer generations cancelled after every client disconnected.",
+    )
+)
+
+
+class QueryRun:
+    """SSE events of one answer generation, replayed to every subscriber."""
+
+    def __init__(self, query_id: str):
+        self.query_id = query_id
+        self.events: List[str] = []
+        self.done = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._subscribers: List[asyncio.Queue] = []
+        self._cancel_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str):
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def finish(self):
+        self.done.set()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+
+
+Generate = Callable[[], AsyncIterator[str]]
+
+
+class QueryRunner:
+    """Runs each query's generation as a task that outlives the client's request.
+
+    Streams subscribe to the run; when the last one disconnects the run is
+    cancelled after `grace_seconds`, unless a client reconnects first.
+    """
+
+    def __init__(self, grace_seconds: float = CANCEL_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        self.runs: Dict[str, QueryRun] = {}
+
+    def get(self, query_id: str) -> Optional[QueryRun]:
+        return self.runs.get(query_id)
+
+    def start(self, query_id: str, generate: Generate) -> QueryRun:
+        """Consume `generate()` in the background, unless the query is already running."""
+        run = self.get(query_id)
+        if run is not None:
+            return run
+        run = QueryRun(query_id)
+        self.runs[query_id] = run
+        run.task = asyncio.create_task(self._run(run, generate()))
+        # Also covers a client that leaves before its stream first reads
+        self._schedule_cancel(run)
+        return run
+
+    async def _run(self, run: QueryRun, events: AsyncIterator[str]):
+        try:
+            async for event in events:
+                run.publish(event)
+        except asyncio.CancelledError:
+            CANCELLED_RUNS.inc()
+            logger.info("Generation for %s cancelled", run.query_id)
+        except Exception as e:
+            logger.error("Generation for %s failed: %s", run.query_id, e)
+        finally:
+            run.finish()
+            if self.runs.get(run.query_id) is run:
+                del self.runs[run.query_id]
+
+    async def subscribe(self, run: QueryRun) -> AsyncIterator[str]:
+        """Events so far, then each new one until the run finishes or the client leaves."""
+        if run._cancel_handle is not None:
+            run._cancel_handle.cancel()
+            run._cancel_handle = None
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in run.events:
+            queue.put_nowait(event)
+        if run.done.is_set():
+            queue.put_nowait(None)
+        else:
+            run._subscribers.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            if queue in run._subscribers:
+                run._subscribers.remove(queue)
+            if not run.subscribers and not run.done.is_set():
+                self._schedule_cancel(run)
+
+    def _schedule_cancel(self, run: QueryRun):
+        if run._cancel_handle is not None:
+            run._cancel_handle.cancel()
+        logger.debug(
+            "No subscribers left for %s; cancelling in %gs",
+            run.query_id,
+            self.grace_seconds,
+        )
+        loop = asyncio.get_running_loop()
+        run._cancel_handle = loop.call_later(
+            self.grace_seconds, self._cancel_if_idle, run
+        )
+
+    def _cancel_if_idle(self, run: QueryRun):
+        run._cancel_handle = None
+        if run.subscribers or run.done.is_set() or run.task is None:
+            return
+        run.task.cancel()
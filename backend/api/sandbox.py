@@ -0,0 +1,165 @@
+import ast
+import asyncio
+import builtins
+import contextlib
+import multiprocessing
+import os
+import sys
+import traceback
+from io import StringIO
+
+import pandas as pd
+
+# Longest tool output handed back to the model
+MAX_OUTPUT_CHARS = 30000
+
+# Wall-clock budget for one run of model-written code
+PYTHON_TIMEOUT_SECONDS = float(os.getenv("PYTHON_TIMEOUT_SECONDS", "10"))
+
+# Workers are forked, so they start with the parent's loaded data and modules
+_FORK = multiprocessing.get_context("fork")
+
+FORBIDDEN_NAMES = ["eval", "exec", "open", "os", "sys", "subprocess"]
+
+SAFE_BUILTIN_NAMES = [
+    "print",
+    "len",
+    "range",
+    "str",
+    "int",
+    "float",
+    "bool",
+    "list",
+    "dict",
+    "sum",
+    "min",
+    "max",
+    "round",
+    "sorted",
+    "enumerate",
+    "zip",
+    "abs",
+    "__import__",  # Add __import__
+]
+
+
+def is_safe_code(code: str) -> bool:
+    """Basic security check for Python code"""
+    try:
+        tree = ast.parse(code)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id in FORBIDDEN_NAMES:
+                return False
+            # Just check for any dangerous imports
+            if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
+                module = node.names[0].name.split(".")[0]
+                if module in FORBIDDEN_NAMES:
+                    return False
+    except:
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def capture_output():
+    """Capture stdout and stderr"""
+    new_out, new_err = StringIO(), StringIO()
+    old_out, old_err = sys.stdout, sys.stderr
+    try:
+        sys.stdout, sys.stderr = new_out, new_err
+        yield sys.stdout, sys.stderr
+    finally:
+        sys.stdout, sys.stderr = old_out, old_err
+
+
+def run_python(query: str, df: pd.DataFrame) -> str:
+    """Run model-written code against `df`; printed output and `result` as text."""
+    if not is_safe_code(query):
+        return "Error: Query contains forbidden operations"
+
+    try:
+        # Create a copy of builtins with only safe functions
+        safe_builtins = {name: getattr(builtins, name) for name in SAFE_BUILTIN_NAMES}
+
+        # Add the globals we want available to the query
+        globals_dict = {
+            "__builtins__": safe_builtins,
+            "pd": pd,
+            "df": df,
+        }
+
+        # Capture output
+        with capture_output() as (out, err):
+            # Execute the query in a clean local namespace
+            local_dict = {}
+            exec(query, globals_dict, local_dict)
+
+            # Collect output
+            output = out.getvalue()
+            error_output = err.getvalue()
+
+            # Check for result variable
+            result_str = ""
+            if "result" in local_dict:
+                # Handle DataFrames specially
+                if isinstance(local_dict["result"], pd.DataFrame):
+                    result_str = local_dict["result"].to_string()
+                else:
+                    result_str = str(local_dict["result"])
+
+        # Combine all outputs
+        final_output = ""
+        if output:
+            final_output += f"Output:\n{output}\n"
+        if result_str:
+            final_output += f"Result variable:\n{result_str}\n"
+        if error_output:
+            final_output += f"Errors:\n{error_output}\n"
+
+        return (
+            final_output.strip()[:MAX_OUTPUT_CHARS]
+            if final_output.strip()
+            else "No output generated"
+        )
+
+    except Exception:
+        error_trace = traceback.format_exc()
+        return f"Error executing query:\n{error_trace}"
+
+
+def _run_in_worker(query: str, df: pd.DataFrame, sender):
+    sender.send(run_python(query, df))
+    sender.close()
+
+
+async def run_python_isolated(
+    query: str, df: pd.DataFrame, timeout: float = PYTHON_TIMEOUT_SECONDS
+) -> str:
+    """run_python in a forked worker process, killed on timeout or cancellation.
+
+    A process rather than a thread: capture_output swaps sys.stdout for the
+    whole process, and a thread stuck in pandas code can't be stopped. Changes
+    the code makes to `df` stay in the worker.
+    """
+    receiver, sender = _FORK.Pipe(duplex=False)
+    worker = _FORK.Process(target=_run_in_worker, args=(query, df, sender))
+    worker.start()
+    sender.close()
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(
+        receiver.fileno(), lambda: readable.done() or readable.set_result(None)
+    )
+    try:
+        await asyncio.wait_for(readable, timeout)
+        return receiver.recv()
+    except asyncio.TimeoutError:
+        return f"Error executing query:\nTimed out after {timeout:g}s"
+    except EOFError:
+        return f"Error executing query:\nWorker exited with code {worker.exitcode}"
+    finally:
+        loop.remove_reader(receiver.fileno())
+        receiver.close()
+        # The worker has nothing left to do once it has sent its result
+        worker.kill()
+        worker.join()
@@ -0,0 +1,137 @@
+import functools
+import logging
+import time
+from typing import Dict, List
+
+import pandas as pd
+
+from api import aggregates, dataset
+
+logger = logging.getLogger(__name__)
+
+# Per-chemical measurement columns, in the order they're described
+FAMILIES = [
+    ("ng_g", "concentration, ng per g of food"),
+    ("percentile_ng_g", "percentile of the ng/g concentration among all samples"),
+    ("ng_serving", "ng per serving (serving_size_g)"),
+    ("percentile_ng_serving", "percentile of the ng per serving"),
+    ("percent_tdi_14_kg_epa", "% of the EPA tolerable daily intake, 14 kg child"),
+    ("percent_tdi_70_kg_epa", "% of the EPA tolerable daily intake, 70 kg adult"),
+    ("percent_tdi_14_kg_efsa", "% of the EFSA tolerable daily intake, 14 kg child"),
+    ("percent_tdi_70_kg_efsa", "% of the EFSA tolerable daily intake, 70 kg adult"),
+]
+
+# Longest example value shown for a descriptive column
+MAX_EXAMPLE_CHARS = 40
+
+# Non-numeric codes listed per family
+MAX_CODES = 4
+
+
+def _dtype(series: pd.Series) -> str:
+    if pd.api.types.is_integer_dtype(series):
+        return "int"
+    if pd.api.types.is_float_dtype(series):
+        return "float"
+    return "text"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6g}"
+
+
+def describe_column(series: pd.Series) -> str:
+    """'name: dtype; non-null; distinct; range or example' for one column."""
+    values = series.dropna()
+    parts = [_dtype(series), f"{values.size} non-null", f"{values.nunique()} distinct"]
+    if values.size and _dtype(series) != "text":
+        parts.append(f"{_number(values.min())}..{_number(values.max())}")
+    elif values.size:
+        example = str(values.iloc[0])
+        if len(example) > MAX_EXAMPLE_CHARS:
+            example = example[:MAX_EXAMPLE_CHARS] + "..."
+        parts.append(f"e.g. {example!r}")
+    return f"- {series.name}: {'; '.join(parts)}"
+
+
+def describe_family(df: pd.DataFrame, chemicals: List[str], suffix: str) -> Dict:
+    columns = [
+        f"{chemical}_{suffix}"
+        for chemical in chemicals
+        if f"{chemical}_{suffix}" in df.columns
+    ]
+    cells = df[columns].stack() if columns else pd.Series(dtype=object)
+    numbers = pd.to_numeric(cells, errors="coerce")
+    codes = cells[numbers.isna()].astype(str).value_counts()
+    with_numbers = [
+        column[: -len(suffix) - 1]
+        for column in columns
+        if pd.to_numeric(df[column], errors="coerce").notna().any()
+    ]
+    return {
+        "columns": len(columns),
+        "cells": int(cells.size),
+        "numeric": int(numbers.notna().sum()),
+        "min": numbers.min(),
+        "max": numbers.max(),
+        "codes": list(codes.index[:MAX_CODES]),
+        "chemicals_with_numbers": with_numbers,
+        "nulls": int(df[columns].isna().sum().sum()) if columns else 0,
+    }
+
+
+def build_catalog(df: pd.DataFrame) -> str:
+    """Compact column catalog: descriptive columns, then measurement families."""
+    chemicals = aggregates.chemicals(df)
+    measurements = {
+        f"{chemical}_{suffix}" for chemical in chemicals for suffix, _ in FAMILIES
+    }
+    descriptive = [column for column in df.columns if column not in measurements]
+
+    lines = [
+        f"Column catalog for samples.tsv ({len(df)} rows, {len(df.columns)} "
+        "columns). Use these exact names.",
+        "Descriptive columns (dtype; non-null; distinct; range or example):",
+    ]
+    lines.extend(describe_column(df[column]) for column in descriptive)
+    lines.append(f"Chemicals ({len(chemicals)}): {', '.join(chemicals)}")
+    lines.append(
+        "Measurement columns are named {chemical}_{family}, e.g. DEHP_ng_g. In "
+        "the TSV they are text: a number, or a code such as '<10' or '<LOQ' "
+        "(below the limit of quantification) or 'NO RfD' (no reference dose); "
+        "convert with pd.to_numeric(df[col], errors='coerce'). In SQL they are "
+        "REAL with the codes as NULL."
+    )
+    for suffix, meaning in FAMILIES:
+        family = describe_family(df, chemicals, suffix)
+        if not family["columns"]:
+            continue
+        line = (
+            f"- *_{suffix}: {meaning}; {family['numeric']} of {family['cells']} "
+            "values numeric"
+        )
+        if family["numeric"]:
+            line += f", {_number(family['min'])}..{_number(family['max'])}"
+        if family["codes"]:
+            line += f"; codes {', '.join(family['codes'])}"
+        if family["nulls"]:
+            line += f"; {family['nulls']} empty"
+        if suffix.startswith("percent_tdi") and len(
+            family["chemicals_with_numbers"]
+        ) < len(chemicals):
+            line += f"; numbers only for {', '.join(family['chemicals_with_numbers'])}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def catalog() -> str:
+    """Catalog for the loaded dataset, built once per process."""
+    start = time.perf_counter()
+    text = build_catalog(dataset.load_samples())
+    logger.info(
+        "Built column catalog (%d chars) in %.1f ms",
+        len(text),
+        (time.perf_counter() - start) * 1000,
+    )
+    return text
@@ -0,0 +1,215 @@
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import pandas as pd
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statements are interrupted after this many seconds
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "2"))
+
+# Rows returned to the model; the rest are counted but not shown
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+
+# Distinct normalized statements whose results are kept
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "256"))
+
+# Same output cap as the Python tool
+MAX_OUTPUT_CHARS = 30000
+
+# SQLite VM instructions between timeout checks
+PROGRESS_STEPS = 10000
+
+TABLE = "samples"
+TAGS_TABLE = "sample_tags"
+
+# Measurement column families; stored as REAL with non-detects ("<10", "<LOQ") as NULL
+MEASUREMENT_PATTERN = re.compile(
+    r"_(ng_g|percentile_ng_g|ng_serving|percent_tdi_\d+_kg_(epa|efsa))$"
+)
+
+# Operations a read-only query needs; anything else is denied by the authorizer
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION}
+if hasattr(sqlite3, "SQLITE_RECURSIVE"):
+    ALLOWED_ACTIONS.add(sqlite3.SQLITE_RECURSIVE)
+
+SQL_QUERIES = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_sql_queries_total",
+        "run_sql_query statements by outcome (ok, cached, error, timeout, cancelled).",
+        labelnames=("outcome",),
+    )
+)
+
+
+class SQLError(Exception):
+    """A statement was rejected, failed or timed out."""
+
+
+def normalize_sql(statement: str) -> str:
+    """Cache key: whitespace collapsed outside string literals, no trailing ';'."""
+    parts = re.split(r"('(?:[^']|'')*')", statement.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip("; ")
+
+
+def _authorizer(action, arg1, arg2, db_name, trigger):
+    if action in ALLOWED_ACTIONS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def format_table(columns: List[str], rows: List[tuple]) -> str:
+    """Markdown table; NULL shows as empty."""
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "|" + "|".join("---" for _ in columns) + "|",
+    ]
+    for row in rows:
+        lines.append(
+            "| "
+            + " | ".join("" if value is None else f"{value}" for value in row)
+            + " |"
+        )
+    return "\n".join(lines)
+
+
+class SQLEngine:
+    """samples.tsv in an in-memory SQLite database, queried read-only.
+
+    `samples` has one row per sample with measurements as REAL. `sample_tags`
+    has one (sample_id, tag) row per tag so tag filters can use an index.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        timeout: float = SQL_TIMEOUT_SECONDS,
+        max_rows: int = SQL_MAX_ROWS,
+        cache_size: int = SQL_CACHE_SIZE,
+    ):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        # Set by the caller to stop the running statement early
+        self._cancelled: Optional[threading.Event] = None
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self._load(df)
+        self.connection.execute("PRAGMA query_only = ON")
+        self.connection.set_authorizer(_authorizer)
+        self._cached_execute = functools.lru_cache(maxsize=cache_size)(self._execute)
+
+    def _load(self, df: pd.DataFrame):
+        table = df.copy()
+        self.measurement_columns = [
+            column for column in table.columns if MEASUREMENT_PATTERN.search(column)
+        ]
+        for column in self.measurement_columns:
+            table[column] = pd.to_numeric(table[column], errors="coerce")
+        table.to_sql(TABLE, self.connection, index=False)
+
+        tags = table[["id", "tags"]].dropna()
+        tags = tags.assign(tag=tags["tags"].str.split(",")).explode("tag")
+        tags["tag"] = tags["tag"].str.strip()
+        tags[tags["tag"] != ""].rename(columns={"id": "sample_id"})[
+            ["sample_id", "tag"]
+        ].to_sql(TAGS_TABLE, self.connection, index=False)
+
+        self.connection.executescript(f"""
+            CREATE INDEX idx_samples_product ON {TABLE}(product);
+            CREATE INDEX idx_samples_product_id ON {TABLE}(product_id);
+            CREATE INDEX idx_samples_tags ON {TABLE}(tags);
+            CREATE INDEX idx_samples_id ON {TABLE}(id);
+            CREATE INDEX idx_sample_tags_tag ON {TAGS_TABLE}(tag, sample_id);
+            ANALYZE;
+            """)
+
+    def _execute(self, statement: str) -> str:
+        deadline = time.monotonic() + self.timeout
+        # A non-zero return from the progress handler interrupts the statement
+        cancelled = self._cancelled
+        self.connection.set_progress_handler(
+            lambda: int(
+                time.monotonic() > deadline
+                or (cancelled is not None and cancelled.is_set())
+            ),
+            PROGRESS_STEPS,
+        )
+        try:
+            cursor = self.connection.execute(statement)
+            if cursor.description is None:
+                return "Statement returned no rows"
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchmany(self.max_rows + 1)
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e) and cancelled is not None and cancelled.is_set():
+                raise SQLError("statement cancelled") from None
+            if "interrupted" in str(e):
+                raise SQLError(f"statement timed out after {self.timeout:g}s") from None
+            raise SQLError(str(e)) from None
+        except sqlite3.DatabaseError as e:
+            raise SQLError(str(e)) from None
+        finally:
+            self.connection.set_progress_handler(None, 0)
+
+        output = format_table(columns, rows[: self.max_rows])
+        if len(rows) > self.max_rows:
+            output += (
+                f"\n(showing the first {self.max_rows} rows; add LIMIT or "
+                "aggregate for the rest)"
+            )
+        return output[:MAX_OUTPUT_CHARS]
+
+    def query(self, statement: str, cancelled: Optional[threading.Event] = None) -> str:
+        """Run one read-only statement and return its rows as a markdown table.
+
+        Results are cached by normalized statement text; the data never
+        changes after load, so a cached result is always current. Setting
+        `cancelled` from another thread interrupts the statement.
+        """
+        key = normalize_sql(statement)
+        if not key:
+            raise SQLError("empty statement")
+        if ";" in re.sub(r"'(?:[^']|'')*'", "", key):
+            raise SQLError("only a single statement is allowed")
+
+        with self.lock:
+            hits = self._cached_execute.cache_info().hits
+            self._cancelled = cancelled
+            try:
+                result = self._cached_execute(key)
+            except SQLError as e:
+                if "timed out" in str(e):
+                    outcome = "timeout"
+                elif "cancelled" in str(e):
+                    outcome = "cancelled"
+                else:
+                    outcome = "error"
+                SQL_QUERIES.inc(outcome=outcome)
+                raise
+            finally:
+                self._cancelled = None
+            cached = self._cached_execute.cache_info().hits > hits
+        SQL_QUERIES.inc(outcome="cached" if cached else "ok")
+        return result
+
+
+def build_engine(df: pd.DataFrame) -> SQLEngine:
+    start = time.perf_counter()
+    engine = SQLEngine(df)
+    logger.info(
+        "Loaded %d samples into SQLite (%d measurement columns) in %.1f ms",
+        len(df),
+        len(engine.measurement_columns),
+        (time.perf_counter() - start) * 1000,
+    )
+    return engine
@@ -0,0 +1,309 @@
+import abc
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from api import dataset
+
+logger = logging.getLogger(__name__)
+
+# SQLite file used when QUERY_STORE=sqlite and QUERY_STORE_PATH isn't set
+DEFAULT_SQLITE_PATH = str(dataset.BACKEND_DIR / "data" / "queries.db")
+
+TABLE = "queries"
+
+# Completed rows kept in memory; 0 turns the cache off
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+
+# Columns of the queries table; JSON_COLUMNS are stored as text in SQLite
+COLUMNS = (
+    "id",
+    "conversation_id",
+    "question",
+    "status",
+    "response",
+    "error",
+    "followups",
+    "usage",
+    "created_at",
+    "completed_at",
+)
+JSON_COLUMNS = {"usage"}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT,
+    question TEXT,
+    status TEXT,
+    response TEXT,
+    error TEXT,
+    followups TEXT,
+    usage TEXT,
+    created_at TEXT,
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS {TABLE}_conversation_id ON {TABLE} (conversation_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_created_at ON {TABLE} (created_at);
+CREATE INDEX IF NOT EXISTS {TABLE}_conversation_created
+    ON {TABLE} (conversation_id, created_at);
+CREATE INDEX IF NOT EXISTS {TABLE}_conversation_created_id
+    ON {TABLE} (conversation_id, created_at, id);
+"""
+
+# Separates created_at and id in a conversation page cursor
+CURSOR_SEPARATOR = "|"
+
+
+def encode_cursor(row: Dict) -> str:
+    """Cursor for the rows before `row`: its created_at, then its id as a tie-break."""
+    return f"{row['created_at']}{CURSOR_SEPARATOR}{row['id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(created_at, id) of a cursor; a bare created_at means strictly before it."""
+    created_at, _, query_id = cursor.partition(CURSOR_SEPARATOR)
+    return created_at, query_id
+
+
+class QueryStore(abc.ABC):
+    """Reads and writes rows of the queries table.
+
+    Calls block (on the network or on disk); async code runs them in a thread.
+    """
+
+    @abc.abstractmethod
+    def get(self, query_id: str) -> Optional[Dict]:
+        """The row with this id, or None."""
+
+    @abc.abstractmethod
+    def conversation(
+        self,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        before: Optional[Tuple[str, str]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """Rows of a conversation, oldest first.
+
+        With `limit`, only the most recent `limit` rows; with `before`, only
+        rows ordered before that (created_at, id) pair (a keyset cursor; the
+        id keeps rows with the same timestamp from being skipped). `columns`
+        picks the fields returned, all by default.
+        """
+
+    @abc.abstractmethod
+    def insert(self, row: Dict):
+        """Add a new row."""
+
+    @abc.abstractmethod
+    def update(self, query_id: str, data: Dict):
+        """Set the given columns on one row."""
+
+
+class SupabaseStore(QueryStore):
+    """The queries table in Supabase, through the PostgREST client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _table(self):
+        return self.client.table(TABLE)
+
+    def get(self, query_id: str) -> Optional[Dict]:
+        result = self._table().select("*").eq("id", query_id).execute()
+        return result.data[0] if result.data else None
+
+    def conversation(
+        self,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        before: Optional[Tuple[str, str]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        request = (
+            self._table()
+            .select(",".join(columns) if columns else "*")
+            .eq("conversation_id", conversation_id)
+        )
+        if before is not None:
+            created_at, query_id = before
+            request = request.or_(
+                f'created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.lt."{query_id}")'
+            )
+        request = request.order("created_at", desc=True).order("id", desc=True)
+        if limit is not None:
+            request = request.limit(limit)
+        return list(reversed(request.execute().data))
+
+    def insert(self, row: Dict):
+        self._table().insert(row).execute()
+
+    def update(self, query_id: str, data: Dict):
+        self._table().update(data).eq("id", query_id).execute()
+
+
+class SQLiteStore(QueryStore):
+    """The queries table in a local SQLite file, in WAL mode.
+
+    One connection is shared behind a lock; reads are primary-key or
+    index lookups, so holding it is brief.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        logger.info("Query store: SQLite at %s", path)
+
+    def _row(self, row: sqlite3.Row) -> Dict:
+        data = dict(row)
+        for column in JSON_COLUMNS:
+            if data.get(column) is not None:
+                data[column] = json.loads(data[column])
+        return data
+
+    def _values(self, data: Dict) -> Dict:
+        unknown = set(data) - set(COLUMNS)
+        if unknown:
+            raise sqlite3.OperationalError(
+                f"no such column: {', '.join(sorted(unknown))}"
+            )
+        return {
+            column: (
+                json.dumps(value)
+                if column in JSON_COLUMNS and value is not None
+                else value
+            )
+            for column, value in data.items()
+        }
+
+    def _select(self, sql: str, params: tuple) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row(row) for row in rows]
+
+    def get(self, query_id: str) -> Optional[Dict]:
+        rows = self._select(f"SELECT * FROM {TABLE} WHERE id = ?", (query_id,))
+        return rows[0] if rows else None
+
+    def conversation(
+        self,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        before: Optional[Tuple[str, str]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        if columns:
+            self._values(dict.fromkeys(columns))
+        sql = f"SELECT {', '.join(columns) if columns else '*'} FROM {TABLE}"
+        sql += " WHERE conversation_id = ?"
+        params: tuple = (conversation_id,)
+        if before is not None:
+            sql += " AND (created_at, id) < (?, ?)"
+            params += tuple(before)
+        # Newest first so LIMIT keeps the most recent turns; walks the
+        # (conversation_id, created_at, id) index
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return list(reversed(self._select(sql, params)))
+
+    def insert(self, row: Dict):
+        values = self._values(row)
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO {TABLE} ({columns}) VALUES ({placeholders})",
+                tuple(values.values()),
+            )
+
+    def update(self, query_id: str, data: Dict):
+        values = self._values(data)
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"UPDATE {TABLE} SET {assignments} WHERE id = ?",
+                (*values.values(), query_id),
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedQueryStore(QueryStore):
+    """Serves completed rows from memory, in front of another store.
+
+    A completed row only changes when this process writes to it (follow-ups
+    and their usage), and every write drops the cached copy. With several
+    API processes, a row another process updates is seen after it falls
+    out of the cache.
+    """
+
+    def __init__(self, store: QueryStore, size: int = QUERY_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self.rows: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.rows.get(query_id)
+            if row is not None:
+                self.rows.move_to_end(query_id)
+        if row is None:
+            row = self.store.get(query_id)
+            if row is None or row.get("status") != "completed":
+                return row
+            with self._lock:
+                self.rows[query_id] = row
+                while len(self.rows) > self.size:
+                    self.rows.popitem(last=False)
+        # Callers may modify what they get back
+        return copy.deepcopy(row)
+
+    def conversation(self, conversation_id: str, **kwargs) -> List[Dict]:
+        return self.store.conversation(conversation_id, **kwargs)
+
+    def insert(self, row: Dict):
+        self.store.insert(row)
+
+    def update(self, query_id: str, data: Dict):
+        with self._lock:
+            self.rows.pop(query_id, None)
+        self.store.update(query_id, data)
+
+
+def open_store(kind: Optional[str] = None) -> QueryStore:
+    """The store named by QUERY_STORE: "supabase" (default) or "sqlite".
+
+    Settings are read here, after callers have loaded their .env.
+    """
+    kind = kind or os.getenv("QUERY_STORE", "supabase")
+    if kind == "sqlite":
+        store = SQLiteStore(os.getenv("QUERY_STORE_PATH", DEFAULT_SQLITE_PATH))
+    elif kind == "supabase":
+        from supabase import create_client
+
+        logger.info("Query store: Supabase")
+        store = SupabaseStore(
+            create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+        )
+    else:
+        raise ValueError(f"Unknown QUERY_STORE {kind!r}; expected supabase or sqlite")
+    cache_size = int(os.getenv("QUERY_CACHE_SIZE", QUERY_CACHE_SIZE))
+    return CachedQueryStore(store, cache_size) if cache_size > 0 else store
@@ -0,0 +1,30 @@
+import json
+from typing import Dict, List, Optional
+
+
+def parse_data_line(line: str) -> Optional[Dict]:
+    """JSON payload of an SSE `data:` line; None for other lines and [DONE].
+
+    Raises json.JSONDecodeError for a malformed payload.
+    """
+    if not line.startswith("data: "):
+        return None
+    payload = line[6:]  # Remove "data: " prefix
+    if payload.strip() == "[DONE]":
+        return None
+    return json.loads(payload)
+
+
+class ToolInputBuffer:
+    """Accumulates input_json_delta fragments of one tool_use block."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def add(self, partial_json: str) -> Optional[Dict]:
+        """Append a fragment; the parsed input once the JSON is complete, else None."""
+        self.parts.append(partial_json)
+        try:
+            return json.loads("".join(self.parts))
+        except json.JSONDecodeError:
+            return None
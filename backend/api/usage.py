@@ -0,0 +1,197 @@
+import contextvars
+import threading
+from typing import Dict, Optional
+
+from api import metrics
+
+# USD per million tokens, keyed by model
+PRICES = {
+    "claude-3-5-sonnet-20241022": {
+        "input_tokens": 3.00,
+        "output_tokens": 15.00,
+        "cache_creation_input_tokens": 3.75,
+        "cache_read_input_tokens": 0.30,
+    },
+    "claude-3-haiku-20240307": {
+        "input_tokens": 0.25,
+        "output_tokens": 1.25,
+        "cache_creation_input_tokens": 0.30,
+        "cache_read_input_tokens": 0.03,
+    },
+    "voyage-3-large": {"input_tokens": 0.18},
+}
+
+TOKEN_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+# Rough characters-per-token ratio used to size prompt sections without a tokenizer
+CHARS_PER_TOKEN = 4
+
+TOKENS = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_tokens_total",
+        "Tokens billed by upstream providers, by endpoint, stage and kind.",
+        labelnames=("endpoint", "stage", "kind"),
+    )
+)
+COST = metrics.REGISTRY.register(
+    metrics.Counter(
+        "plasticlist_cost_usd_total",
+        "Estimated upstream spend in USD, by endpoint and stage.",
+        labelnames=("endpoint", "stage"),
+    )
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, shared by billing estimates and rate-limit admission."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def cost_usd(model: str, usage: Dict[str, int]) -> float:
+    prices = PRICES.get(model, {})
+    return sum(
+        usage.get(field, 0) * price / 1_000_000 for field, price in prices.items()
+    )
+
+
+def stage_totals(stages: Dict[str, Dict]) -> Dict:
+    """Token counts and cost summed over stages."""
+    totals = {field: 0 for field in TOKEN_FIELDS}
+    cost = 0.0
+    for entry in stages.values():
+        for field in TOKEN_FIELDS:
+            totals[field] += entry.get(field, 0)
+        cost += entry.get("cost_usd", 0.0)
+    totals["cost_usd"] = round(cost, 6)
+    return totals
+
+
+def with_stage(stored: Optional[Dict], stage: str, entry: Dict) -> Dict:
+    """Stored query usage with one more stage, and totals to match."""
+    stored = stored or {"stages": {}, "sections": {}}
+    stored.setdefault("stages", {})[stage] = entry
+    stored["totals"] = stage_totals(stored["stages"])
+    return stored
+
+
+class UsageLedger:
+    """Token usage of one query, broken down by stage and by prompt section."""
+
+    def __init__(self, query_id: str, endpoint: str):
+        self.query_id = query_id
+        self.endpoint = endpoint
+        self.stages: Dict[str, Dict] = {}
+        self.sections: Dict[str, int] = {}
+
+    def add(self, stage: str, model: str, usage: Dict[str, int]):
+        """Add provider-reported usage; counts for the same stage accumulate."""
+        entry = self.stages.setdefault(
+            stage, {"model": model, **{field: 0 for field in TOKEN_FIELDS}}
+        )
+        for field in TOKEN_FIELDS:
+            entry[field] += usage.get(field) or 0
+        entry["cost_usd"] = round(cost_usd(model, entry), 6)
+
+    def set_section(self, section: str, text: str):
+        """Record the estimated token size of a prompt section."""
+        self.sections[section] = estimate_tokens(text)
+
+    def totals(self) -> Dict:
+        return stage_totals(self.stages)
+
+    def to_dict(self) -> Dict:
+        return {
+            "stages": self.stages,
+            "sections": self.sections,
+            "totals": self.totals(),
+        }
+
+
+class UsageRollup:
+    """In-memory aggregate of ledgers, per endpoint and stage and per prompt section."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[tuple, Dict] = {}
+        self._sections: Dict[tuple, Dict] = {}
+
+    def add(self, ledger: UsageLedger, latency_ms: float = None):
+        with self._lock:
+            for stage, entry in ledger.stages.items():
+                key = (ledger.endpoint, stage)
+                rollup = self._stages.setdefault(
+                    key,
+                    {
+                        "calls": 0,
+                        "cost_usd": 0.0,
+                        **{field: 0 for field in TOKEN_FIELDS},
+                    },
+                )
+                rollup["calls"] += 1
+                rollup["cost_usd"] += entry["cost_usd"]
+                for field in TOKEN_FIELDS:
+                    rollup[field] += entry[field]
+                    TOKENS.inc(
+                        entry[field], endpoint=ledger.endpoint, stage=stage, kind=field
+                    )
+                COST.inc(entry["cost_usd"], endpoint=ledger.endpoint, stage=stage)
+
+            for section, tokens in ledger.sections.items():
+                key = (ledger.endpoint, section)
+                rollup = self._sections.setdefault(
+                    key, {"requests": 0, "tokens": 0, "latency_ms": 0.0}
+                )
+                rollup["requests"] += 1
+                rollup["tokens"] += tokens
+                if latency_ms is not None:
+                    rollup["latency_ms"] += latency_ms
+
+    def snapshot(self) -> Dict:
+        endpoints: Dict[str, Dict] = {}
+        with self._lock:
+            for (endpoint, stage), rollup in self._stages.items():
+                stages = endpoints.setdefault(endpoint, {"stages": {}, "sections": {}})
+                stages["stages"][stage] = {
+                    **rollup,
+                    "cost_usd": round(rollup["cost_usd"], 6),
+                }
+            for (endpoint, section), rollup in self._sections.items():
+                sections = endpoints.setdefault(
+                    endpoint, {"stages": {}, "sections": {}}
+                )
+                requests = rollup["requests"]
+                sections["sections"][section] = {
+                    "requests": requests,
+                    "avg_tokens": round(rollup["tokens"] / requests, 1),
+                    "avg_request_latency_ms": round(rollup["latency_ms"] / requests, 1),
+                }
+        return endpoints
+
+
+ROLLUP = UsageRollup()
+
+_current_ledger: contextvars.ContextVar[Optional[UsageLedger]] = contextvars.ContextVar(
+    "current_ledger", default=None
+)
+
+
+def start_ledger(query_id: str, endpoint: str) -> UsageLedger:
+    ledger = UsageLedger(query_id, endpoint)
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def current_ledger() -> Optional[UsageLedger]:
+    return _current_ledger.get()
+
+
+def record(stage: str, model: str, usage: Optional[Dict[str, int]]):
+    """Add usage to the ledger of the current request, if there is one."""
+    ledger = _current_ledger.get()
+    if ledger is not None and usage:
+        ledger.add(stage, model, usage)
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from api import dataset
+from api.lexical import GENERAL_CHUNKS_PATH
+
+logger = logging.getLogger(__name__)
+
+# Written by utils/simple_tsv_processor.py; not checked in
+TSV_VECTORS_PATH = dataset.BACKEND_DIR / "utils" / "tsv_embeddings.txt"
+
+# Representations load_index can search: full float32, or quantized codes
+# rescored against full-precision vectors
+QUANTIZATIONS = ("none", "int8", "binary")
+# Flat scans every vector; ivf probes the nearest k-means lists (api/ivf.py)
+INDEX_KINDS = ("flat", "ivf")
+# Candidates scored in full precision per requested result
+RESCORE_FACTORS = {"int8": 4, "binary": 10}
+# Rows scored per step, bounding the temporaries of a quantized scan
+SCAN_CHUNK_ROWS = 2048
+
+# Set bits in each 16-bit value, for Hamming distances over packed codes
+_POPCOUNT = np.array([bin(value).count("1") for value in range(2**16)], dtype=np.uint8)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class ExactIndex:
+    """Brute-force cosine search over vectors held in memory.
+
+    `query` takes Pinecone's keyword arguments and returns its dict response
+    shape, so it can stand in for an index client.
+    """
+
+    def __init__(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        self.ids = ids
+        self.vectors = normalize(vectors)
+        self.metadata = metadata
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the vectors, the bulk of the index."""
+        return self.vectors.nbytes
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        **kwargs,
+    ) -> Dict:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.vectors @ (query / norm if norm else query)
+        top_k = min(top_k, len(self.ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k] if top_k else []
+        top = sorted(top, key=lambda i: -scores[i])
+        return {
+            "matches": [
+                {
+                    "id": self.ids[i],
+                    "score": float(scores[i]),
+                    "metadata": self.metadata[i] if include_metadata else None,
+                }
+                for i in top
+            ]
+        }
+
+
+class QuantizedIndex:
+    """Cosine search over int8 or binary codes, with exact rescoring.
+
+    Only the codes are held in memory. The quantized scan picks
+    `rescore_factor` candidates per result; their float32 rows are then read
+    from a memory-mapped file and scored exactly, so the ranking that comes
+    back is in full precision. Same query interface as ExactIndex.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        codes: np.ndarray,
+        full: np.ndarray,
+        metadata: List[Dict],
+        kind: str,
+        scales: Optional[np.ndarray] = None,
+        rescore_factor: Optional[int] = None,
+    ):
+        if kind not in RESCORE_FACTORS:
+            raise ValueError(f"unknown quantization {kind!r}")
+        self.ids = ids
+        self.codes = codes
+        self.full = full
+        self.metadata = metadata
+        self.kind = kind
+        self.scales = scales
+        self.rescore_factor = rescore_factor or RESCORE_FACTORS[kind]
+
+    @classmethod
+    def open(cls, path, kind: str, rescore_factor: Optional[int] = None):
+        """Index over the sidecar files write_quantized left next to `path`."""
+        with open(sidecar_path(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        scales = None
+        if kind == "int8":
+            codes = np.load(sidecar_path(path, "int8.npy"))
+            scales = np.load(sidecar_path(path, "int8_scales.npy"))
+        else:
+            codes = np.load(sidecar_path(path, "bin.npy"))
+        return cls(
+            meta["ids"],
+            codes,
+            np.load(sidecar_path(path, "f32.npy"), mmap_mode="r"),
+            meta["metadata"],
+            kind,
+            scales=scales,
+            rescore_factor=rescore_factor,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the codes; the full-precision vectors stay on disk."""
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Higher is closer: dot products for int8, negated Hamming distance for binary."""
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        if self.kind == "int8":
+            scaled = query * self.scales
+        else:
+            query_bits = quantize_binary(query[np.newaxis])[0].view(np.uint16)
+        for start in range(0, len(self.ids), SCAN_CHUNK_ROWS):
+            chunk = self.codes[start : start + SCAN_CHUNK_ROWS]
+            if self.kind == "int8":
+                scores[start : start + len(chunk)] = chunk.astype(np.float32) @ scaled
+            else:
+                scores[start : start + len(chunk)] = -_POPCOUNT[
+                    chunk.view(np.uint16) ^ query_bits
+                ].sum(axis=1, dtype=np.int32)
+        return scores
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        **kwargs,
+    ) -> Dict:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        top_k = min(top_k, len(self.ids))
+        if not top_k:
+            return {"matches": []}
+        approximate = self._approximate_scores(query)
+        count = min(top_k * self.rescore_factor, len(self.ids))
+        # Sorted, so the memory-mapped rows are read front to back
+        candidates = np.sort(np.argpartition(-approximate, count - 1)[:count])
+        scores = self.full[candidates] @ query
+        top = np.argsort(-scores)[:top_k]
+        return {
+            "matches": [
+                {
+                    "id": self.ids[candidates[i]],
+                    "score": float(scores[i]),
+                    "metadata": (
+                        self.metadata[candidates[i]] if include_metadata else None
+                    ),
+                }
+                for i in top
+            ]
+        }
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-dimension int8 codes and the scales that undo them."""
+    scales = np.abs(vectors).max(axis=0) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """One sign bit per dimension, packed into an even number of bytes."""
+    codes = np.packbits(vectors > 0, axis=1)
+    if codes.shape[1] % 2:
+        # Scanned as 16-bit words
+        codes = np.pad(codes, ((0, 0), (0, 1)))
+    return codes
+
+
+def sidecar_path(path, suffix: str) -> Path:
+    """A file stored next to a vector file, e.g. embeddings.int8.npy."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{suffix}")
+
+
+SIDECARS = ("f32.npy", "int8.npy", "int8_scales.npy", "bin.npy", "meta.json")
+
+
+def write_quantized(path, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+    """Write the files QuantizedIndex searches next to the vector file at `path`.
+
+    The metadata file is written last, so its presence marks a complete set.
+    """
+    vectors = normalize(np.asarray(vectors, dtype=np.float32))
+    codes, scales = quantize_int8(vectors)
+    np.save(sidecar_path(path, "f32.npy"), vectors)
+    np.save(sidecar_path(path, "int8.npy"), codes)
+    np.save(sidecar_path(path, "int8_scales.npy"), scales)
+    np.save(sidecar_path(path, "bin.npy"), quantize_binary(vectors))
+    with open(sidecar_path(path, "meta.json"), "w") as f:
+        json.dump({"ids": list(ids), "metadata": list(metadata)}, f)
+
+
+def quantized_current(path) -> bool:
+    """Whether every sidecar exists and is at least as new as the vector file."""
+    stored = os.path.getmtime(path)
+    return all(
+        sidecar_path(path, suffix).exists()
+        and os.path.getmtime(sidecar_path(path, suffix)) >= stored
+        for suffix in SIDECARS
+    )
+
+
+def split_records(records: List[Dict]) -> Tuple[List[str], np.ndarray, List[Dict]]:
+    """Ids, float32 vectors and metadata from (id, values, metadata) records."""
+    return (
+        [record["id"] for record in records],
+        np.array([record["values"] for record in records], dtype=np.float32),
+        [record["metadata"] for record in records],
+    )
+
+
+def read_vectors(path) -> Tuple[List[str], np.ndarray, List[Dict]]:
+    """Ids, float32 vectors and metadata from a stored vector file."""
+    with open(path, "r") as f:
+        return split_records(json.load(f))
+
+
+def load_index(
+    path=GENERAL_CHUNKS_PATH, quantization: Optional[str] = None, kind=None
+) -> Optional[Union[ExactIndex, QuantizedIndex, "IVFIndex"]]:
+    """Index over a stored vector file (id, values, metadata), or None if missing.
+
+    `kind` defaults to LOCAL_INDEX: "flat" scans every vector, "ivf" opens
+    the index utils/build_ivf_index.py wrote (flat when there is none).
+    `quantization` defaults to LOCAL_INDEX_QUANTIZATION ("none", "int8" or
+    "binary") and applies to flat search. Both are read here so a .env
+    loaded by the caller applies. Quantized sidecars missing or older than
+    the vector file are written first.
+    """
+    kind = kind or os.getenv("LOCAL_INDEX", "flat")
+    quantization = quantization or os.getenv("LOCAL_INDEX_QUANTIZATION", "none")
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"unknown index kind {kind!r}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"unknown quantization {quantization!r}")
+    if not os.path.exists(path):
+        logger.warning("No stored vectors at %s", path)
+        return None
+    if kind == "ivf":
+        # Imported here: the IVF module builds on this one
+        from api import ivf
+
+        index = ivf.load_ivf(path)
+        if index is not None:
+            return index
+        logger.warning("No IVF index next to %s; searching it flat", path)
+    start = time.perf_counter()
+    if quantization == "none":
+        index = ExactIndex(*read_vectors(path))
+    else:
+        if not quantized_current(path):
+            logger.info("Writing quantized vectors next to %s", path)
+            write_quantized(path, *read_vectors(path))
+        index = QuantizedIndex.open(path, quantization)
+    logger.info(
+        "Loaded %d local vectors (%s) from %s in %.1f ms",
+        len(index),
+        quantization,
+        path,
+        (time.perf_counter() - start) * 1000,
+    )
+    return index
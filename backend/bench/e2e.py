@@ -0,0 +1,311 @@
+"""End-to-end load benchmark against local stand-ins for every upstream.
+
+Starts the fakes from bench/fake_upstreams.py, runs the API in a uvicorn
+subprocess pointed at them, and drives POST /api/query/initial followed by
+GET /api/query/{id}/stream at a fixed concurrency. Reports time to first
+token, total latency percentiles, throughput, per-stage means and the API's
+event-loop lag. Nothing leaves the machine. With --store sqlite, query rows
+go to a temporary SQLite file instead of the fake Supabase.
+
+    python bench/e2e.py --requests 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+from bench import report
+from bench.fake_upstreams import add_upstream_arguments, upstreams_from_args
+
+# Questions that go through retrieval and the model (none match the fast-path router)
+DEFAULT_QUESTIONS = [
+    "What did PlasticList find about plastic chemicals in food?",
+    "How were the samples collected and shipped to the lab?",
+    "Tell me about phthalates in dairy products",
+    "What is the difference between the EPA and EFSA limits?",
+    "Are there bisphenols in canned food?",
+    "Which chemicals were most commonly detected overall?",
+]
+
+
+@dataclass
+class Result:
+    ok: bool
+    ttft: Optional[float] = None
+    total: float = 0.0
+    chunks: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class Run:
+    results: List[Result] = field(default_factory=list)
+    wall: float = 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_healthy(session: aiohttp.ClientSession, base: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base}/api/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"API at {base} did not become healthy in {timeout:g}s")
+
+
+async def one_query(session: aiohttp.ClientSession, base: str, question: str) -> Result:
+    """Create a query and read its stream; times are from the create request."""
+    start = time.perf_counter()
+    try:
+        async with session.post(
+            f"{base}/api/query/initial", json={"question": question}
+        ) as response:
+            response.raise_for_status()
+            query_id = (await response.json())["id"]
+
+        result = Result(ok=False)
+        async with session.get(f"{base}/api/query/{query_id}/stream") as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if not line.startswith(b"data: "):
+                    continue
+                event = json.loads(line[6:])
+                if "content" in event:
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - start
+                    result.chunks += 1
+                elif "error" in event:
+                    result.error = str(event["error"])[:200]
+                    break
+                elif event.get("end"):
+                    result.ok = True
+                    break
+        result.total = time.perf_counter() - start
+        if not result.ok and result.error is None:
+            result.error = "stream ended without an end event"
+        return result
+    except Exception as e:
+        return Result(ok=False, total=time.perf_counter() - start, error=repr(e))
+
+
+async def drive(
+    session: aiohttp.ClientSession,
+    base: str,
+    questions: List[str],
+    requests: int,
+    concurrency: int,
+) -> Run:
+    run = Run()
+    counter = iter(range(requests))
+
+    async def worker():
+        for index in counter:
+            question = questions[index % len(questions)]
+            run.results.append(await one_query(session, base, question))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    run.wall = time.perf_counter() - start
+    return run
+
+
+async def scrape(session: aiohttp.ClientSession, base: str) -> Dict:
+    async with session.get(f"{base}/metrics") as response:
+        return report.parse_metrics(await response.text())
+
+
+def summarize(run: Run, metrics_delta: Dict, args) -> Dict:
+    ok = [result for result in run.results if result.ok]
+    ttfts = [result.ttft for result in ok if result.ttft is not None]
+    totals = [result.total for result in ok]
+    lag = report.histogram(metrics_delta, "plasticlist_event_loop_lag_seconds")
+    batches = report.histogram(metrics_delta, "plasticlist_embedding_batch_size")
+    stages = {
+        stage: report.histogram(
+            metrics_delta, "plasticlist_stage_duration_seconds", stage=stage
+        )
+        for stage in report.label_values(
+            metrics_delta, "plasticlist_stage_duration_seconds_count", "stage"
+        )
+    }
+    errors: Dict[str, int] = {}
+    for result in run.results:
+        if not result.ok:
+            errors[result.error] = errors.get(result.error, 0) + 1
+
+    def ms(value: float) -> Optional[float]:
+        return None if value != value else round(value * 1000, 1)
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "tool_fraction": args.tool_fraction,
+            "store": args.store,
+            "ttft_ms": args.ttft_ms,
+            "embedding_ms": args.embedding_ms,
+        },
+        "completed": len(ok),
+        "failed": len(run.results) - len(ok),
+        "errors": errors,
+        "wall_s": round(run.wall, 3),
+        "throughput_rps": round(len(ok) / run.wall, 2) if run.wall else 0.0,
+        "ttft_ms": {f"p{q}": ms(report.percentile(ttfts, q)) for q in (50, 90, 95, 99)},
+        "latency_ms": {
+            f"p{q}": ms(report.percentile(totals, q)) for q in (50, 90, 95, 99)
+        },
+        "event_loop_lag_ms": {
+            "samples": int(lag["count"]),
+            "mean": ms(lag["sum"] / lag["count"]) if lag["count"] else None,
+            "p99_bucket": ms(report.histogram_quantile(lag, 0.99)),
+        },
+        "embedding_calls": {
+            "calls": int(batches["count"]),
+            "mean_batch": (
+                round(batches["sum"] / batches["count"], 2)
+                if batches["count"]
+                else None
+            ),
+        },
+        "stage_mean_ms": {
+            stage: ms(series["sum"] / series["count"])
+            for stage, series in stages.items()
+            if series["count"]
+        },
+    }
+
+
+def print_summary(summary: Dict):
+    rows = [
+        ("requests", f"{summary['completed']} ok, {summary['failed']} failed"),
+        ("wall time", f"{summary['wall_s']} s"),
+        ("throughput", f"{summary['throughput_rps']} req/s"),
+    ]
+    for name in ("ttft_ms", "latency_ms"):
+        rows.append((name, "  ".join(f"{q}={v}" for q, v in summary[name].items())))
+    lag = summary["event_loop_lag_ms"]
+    rows.append(
+        (
+            "event loop lag",
+            f"mean={lag['mean']} ms  p99<={lag['p99_bucket']} ms  "
+            f"({lag['samples']} samples)",
+        )
+    )
+    calls = summary["embedding_calls"]
+    rows.append(
+        (
+            "embedding calls",
+            f"{calls['calls']} (mean batch {calls['mean_batch']})",
+        )
+    )
+    for stage, mean in sorted(summary["stage_mean_ms"].items()):
+        rows.append((f"  {stage}", f"{mean} ms"))
+    for error, count in summary["errors"].items():
+        rows.append(("error", f"{count}x {error}"))
+    print(report.format_rows(rows))
+
+
+async def main(args):
+    upstreams = upstreams_from_args(args)
+    await upstreams.start()
+    port = args.api_port or free_port()
+    base = f"http://127.0.0.1:{port}"
+    store_dir = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        **upstreams.env(),
+        "LOG_LEVEL": args.log_level,
+        "EVENT_LOOP_LAG_INTERVAL": str(args.lag_interval),
+        "QUERY_STORE": args.store,
+        "QUERY_STORE_PATH": os.path.join(store_dir.name, "queries.db"),
+    }
+    api = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "api.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+            await wait_healthy(session, base, args.startup_timeout)
+            if args.warmup:
+                await drive(session, base, questions, args.warmup, args.concurrency)
+            before = await scrape(session, base)
+            run = await drive(session, base, questions, args.requests, args.concurrency)
+            after = await scrape(session, base)
+    finally:
+        api.terminate()
+        api.wait(timeout=10)
+        await upstreams.stop()
+        store_dir.cleanup()
+
+    summary = summarize(run, report.diff_metrics(before, after), args)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Wrote {args.json}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--questions", help="File with one question per line")
+    parser.add_argument("--api-port", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--lag-interval", type=float, default=0.05)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Also write the summary to this file")
+    parser.add_argument(
+        "--store",
+        default="supabase",
+        choices=("supabase", "sqlite"),
+        help="Where the API keeps query rows",
+    )
+    add_upstream_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,429 @@
+"""Micro-benchmarks for the CPU-only hot paths, checked against stored baselines.
+
+Each case times one pure function on fixed inputs built from the checked-in
+data, so runs are repeatable and need no network. The fastest repeat is
+compared with bench/baselines.json (the median is reported too, but is far
+noisier on a shared machine); a case slower than its baseline by more than
+the threshold is a regression and the run exits non-zero. A fixed reference
+workload is timed next to every case and ratios are divided by its own
+slowdown, so a busy or throttled machine doesn't read as a regression.
+That correction is rough under bursty load, so a case that looks regressed
+is timed again (--confirm times) and fails only if every attempt did.
+
+    python bench/micro.py                   # compare with the stored baselines
+    python bench/micro.py -k sse -k history # only cases whose name matches
+    python bench/micro.py --update          # record new baselines
+
+Baselines are only meaningful on the machine that recorded them; re-record
+after moving to different hardware.
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+from api import context as context_assembly
+from api import dataset, lexical, lookup, prompts, sandbox, streaming
+from bench import report
+
+BASELINES_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+# Slowdown over the baseline minimum tolerated before a case counts as regressed
+DEFAULT_THRESHOLD = 0.25
+# Extra attempts a case gets before a regression is reported
+DEFAULT_CONFIRM = 2
+
+# Setup functions by case name; each builds its inputs and returns the timed callable
+CASES: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+# Tool code shaped like what the model writes, plus the rejected kinds
+SAFE_CODE_SNIPPETS = [
+    "result = df['product'].nunique()",
+    "df['DEHP_ng_g'] = pd.to_numeric(df['DEHP_ng_g'], errors='coerce')\n"
+    "result = df.nlargest(10, 'DEHP_ng_g')[['product', 'DEHP_ng_g']]",
+    "milk = df[df['tags'].str.contains('milk', case=False, na=False)]\n"
+    "cols = [c for c in df.columns if c.endswith('_ng_g')]\n"
+    "for col in cols:\n"
+    "    milk[col] = pd.to_numeric(milk[col], errors='coerce')\n"
+    "summary = milk[cols].mean().sort_values(ascending=False)\n"
+    "print(summary.head(5))\n"
+    "result = summary.to_frame('mean_ng_g')",
+    "import numpy as np\n"
+    "values = pd.to_numeric(df['BPA_percent_tdi_70_kg_efsa'], errors='coerce')\n"
+    "result = {'over_100': int((values > 100).sum()), 'median': float(np.nanmedian(values))}",
+    "import os\nresult = os.listdir('.')",
+    "result = open('/etc/passwd').read()",
+    "result = df[df['product'] ==",
+]
+
+
+def stream_lines(text_deltas: int = 200, json_fragments: int = 40) -> List[bytes]:
+    """Raw lines of a Messages API stream: a text block, then a tool_use block."""
+    events = [
+        {
+            "type": "message_start",
+            "message": {"usage": {"input_tokens": 2100, "output_tokens": 1}},
+        },
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text"}},
+    ]
+    events += [
+        {
+            "type": "content_block_delta",
+            "index": 0,
+            "delta": {"type": "text_delta", "text": f"word{i} and more "},
+        }
+        for i in range(text_deltas)
+    ]
+    events.append({"type": "content_block_stop", "index": 0})
+    events.append(
+        {
+            "type": "content_block_start",
+            "index": 1,
+            "content_block": {"type": "tool_use", "id": "toolu_1", "name": "q"},
+        }
+    )
+    tool_input = json.dumps({"query": SAFE_CODE_SNIPPETS[2]})
+    step = -(-len(tool_input) // json_fragments)
+    events += [
+        {
+            "type": "content_block_delta",
+            "index": 1,
+            "delta": {
+                "type": "input_json_delta",
+                "partial_json": tool_input[start : start + step],
+            },
+        }
+        for start in range(0, len(tool_input), step)
+    ]
+    events.append(
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "tool_use"},
+            "usage": {"output_tokens": 300},
+        }
+    )
+    lines = []
+    for event in events:
+        lines.append(f"event: {event['type']}\n".encode())
+        lines.append(f"data: {json.dumps(event)}\n".encode())
+        lines.append(b"\n")
+    return lines
+
+
+def pinecone_matches(passages: List[context_assembly.Passage], top_score: float):
+    """Passages as Pinecone query matches, with descending scores."""
+    return [
+        {
+            "id": passage.id,
+            "score": top_score - 0.02 * rank,
+            "metadata": {
+                "text": passage.text,
+                "source": passage.source,
+                "chunk_index": passage.chunk_index,
+                "start_index": passage.start_index,
+            },
+        }
+        for rank, passage in enumerate(passages)
+    ]
+
+
+def conversation_rows(turns: int, answer_chars: int = 2000) -> List[Dict]:
+    rng = random.Random(0)
+    rows = [
+        {
+            "id": f"q{turn}",
+            "created_at": f"2025-01-01T00:{turn // 60:02d}:{turn % 60:02d}",
+            "question": f"Follow-up question number {turn} about phthalates?",
+            "response": ("Answer text. " * (answer_chars // 13))[:answer_chars],
+        }
+        for turn in range(turns)
+    ]
+    # Rows come back from the database in no particular order
+    rng.shuffle(rows)
+    return rows
+
+
+@case("format_row_text")
+def bench_format_row_text():
+    df = dataset.load_samples()
+    # What TSVProcessor.format_row_text does per row while building embeddings
+    return lambda: [dataset.format_row_text(row) for _, row in df.iterrows()]
+
+
+@case("format_rows")
+def bench_format_rows():
+    df = dataset.load_samples()
+    return lambda: dataset.format_rows(df)
+
+
+@case("is_safe_code")
+def bench_is_safe_code():
+    return lambda: [sandbox.is_safe_code(code) for code in SAFE_CODE_SNIPPETS]
+
+
+@case("sse_parse")
+def bench_sse_parse():
+    lines = stream_lines()
+
+    def run():
+        text = ""
+        buffer = None
+        tool_input = None
+        for chunk in lines:
+            data = streaming.parse_data_line(chunk.decode("utf-8"))
+            if data is None:
+                continue
+            if data.get("type") == "content_block_start":
+                if data["content_block"].get("type") == "tool_use":
+                    buffer = streaming.ToolInputBuffer()
+            elif data.get("type") == "content_block_delta":
+                delta = data["delta"]
+                if delta.get("type") == "text_delta":
+                    text += delta["text"]
+                elif delta.get("type") == "input_json_delta":
+                    tool_input = buffer.add(delta["partial_json"]) or tool_input
+        return text, tool_input
+
+    return run
+
+
+@case("context_vector")
+def bench_context_vector():
+    general = lexical.general_passages()[: context_assembly.GENERAL_CANDIDATES]
+    tsv = lexical.tsv_passages()[: context_assembly.TSV_CANDIDATES]
+    general_matches = pinecone_matches(general, 0.62)
+    tsv_matches = pinecone_matches(tsv, 0.58)
+    return lambda: context_assembly.assemble_context(general_matches, tsv_matches)
+
+
+@case("context_hybrid")
+def bench_context_hybrid():
+    general = lexical.general_passages()
+    tsv = lexical.tsv_passages()
+    general_matches = pinecone_matches(
+        general[: context_assembly.GENERAL_CANDIDATES], 0.62
+    )
+    tsv_matches = pinecone_matches(tsv[: context_assembly.TSV_CANDIDATES], 0.58)
+    lexical_passages = general[-3:] + tsv[-2:]
+    return lambda: context_assembly.assemble_context(
+        general_matches, tsv_matches, lexical_passages=lexical_passages
+    )
+
+
+@case("direct_hit_records")
+def bench_direct_hit_records():
+    df = dataset.load_samples()
+    positions = list(range(0, len(df), len(df) // lookup.DIRECT_HIT_MAX_ROWS))
+    positions = positions[: lookup.DIRECT_HIT_MAX_ROWS]
+    return lambda: lookup.format_matches(df, positions)
+
+
+@case("history_50_turns")
+def bench_history_50_turns():
+    rows = conversation_rows(50)
+    return lambda: prompts.conversation_history(rows, "q49")
+
+
+@case("history_500_turns")
+def bench_history_500_turns():
+    rows = conversation_rows(500)
+    return lambda: prompts.conversation_history(rows, "q499")
+
+
+@case("load_samples")
+def bench_load_samples():
+    # The uncached loader; the server pays this once per process
+    return lambda: dataset.load_samples.__wrapped__(str(dataset.SAMPLES_PATH))
+
+
+def reference_workload():
+    """Fixed mix of parsing, string and dict work; a yardstick for machine speed."""
+    payload = json.dumps({"rows": [{"id": i, "text": f"row {i}"} for i in range(50)]})
+    rows = json.loads(payload)["rows"]
+    return " | ".join(sorted(row["text"] for row in rows if row["id"] % 3))
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> Dict:
+    """Per-call seconds: loops sized to take at least `min_time`, `repeat` times."""
+    timer = timeit.Timer(fn)
+    loops = 1
+    while True:
+        elapsed = timer.timeit(loops)
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    times = [elapsed / loops] + [timer.timeit(loops) / loops for _ in range(repeat - 1)]
+    return {
+        "median_us": round(statistics.median(times) * 1e6, 2),
+        "min_us": round(min(times) * 1e6, 2),
+        "loops": loops,
+    }
+
+
+def compare(
+    result: Dict, baseline: Optional[Dict], threshold: float, speed: float = 1.0
+) -> Dict:
+    """Ratio of the fastest repeat to the baseline's, and what that means.
+
+    `speed` is how much slower the reference workload ran than when the
+    baselines were recorded; the ratio is corrected by it.
+    """
+    if not baseline:
+        return {"ratio": None, "status": "new"}
+    ratio = result["min_us"] / baseline["min_us"] / speed
+    if ratio > 1 + threshold:
+        status = "REGRESSED"
+    elif ratio < 1 - threshold:
+        status = "faster"
+    else:
+        status = "ok"
+    return {"ratio": round(ratio, 3), "status": status}
+
+
+def confirmed(attempt: Callable[[], Dict], retries: int) -> Dict:
+    """The best of up to 1 + `retries` attempts, stopping at the first that passes."""
+    result = attempt()
+    result["attempts"] = 1
+    for attempts in range(2, retries + 2):
+        if result["status"] != "REGRESSED":
+            break
+        retry = attempt()
+        if retry["ratio"] < result["ratio"]:
+            result = retry
+        result["attempts"] = attempts
+    return result
+
+
+def machine() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def load_baselines(path: Path) -> Dict:
+    if not path.exists():
+        return {"machine": None, "cases": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def selected(patterns: List[str]) -> List[str]:
+    if not patterns:
+        return list(CASES)
+    return [name for name in CASES if any(pattern in name for pattern in patterns)]
+
+
+def format_us(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if value >= 1000:
+        return f"{value / 1000:.2f} ms"
+    return f"{value:.1f} us"
+
+
+def main(args) -> int:
+    baselines = load_baselines(args.baselines)
+    if baselines.get("machine") and baselines["machine"] != machine():
+        print(f"Note: baselines were recorded on {baselines['machine']}")
+
+    results = {}
+    for name in selected(args.filter):
+        fn = CASES[name]()
+        baseline = baselines["cases"].get(name)
+
+        def attempt() -> Dict:
+            reference = measure(reference_workload, args.repeat, args.min_time)
+            result = measure(fn, args.repeat, args.min_time)
+            result["reference_us"] = reference["min_us"]
+            result["speed"] = 1.0
+            if baseline and baseline.get("reference_us"):
+                result["speed"] = reference["min_us"] / baseline["reference_us"]
+            result.update(compare(result, baseline, args.threshold, result["speed"]))
+            return result
+
+        result = confirmed(attempt, 0 if args.update else args.confirm)
+        results[name] = result
+        ratio = f"x{result['ratio']:.2f}" if result["ratio"] is not None else ""
+        speed = result["speed"]
+        print(
+            f"{name:<20} {format_us(result['min_us']):>10} "
+            f"(median {format_us(result['median_us'])}, {result['loops']} loops)  "
+            f"baseline {format_us((baseline or {}).get('min_us')):>10} "
+            f"{ratio:>6} {result['status']}"
+            + (f"  (machine x{speed:.2f})" if abs(speed - 1) > 0.1 else "")
+            + (f"  ({result['attempts']} attempts)" if result["attempts"] > 1 else "")
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"machine": machine(), "cases": results}, f, indent=2)
+
+    if args.update:
+        for name, result in results.items():
+            baselines["cases"][name] = {
+                "median_us": result["median_us"],
+                "min_us": result["min_us"],
+                "reference_us": result["reference_us"],
+            }
+        baselines["machine"] = machine()
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Updated {len(results)} baselines in {args.baselines}")
+        return 0
+
+    regressed = [
+        name for name, result in results.items() if result["status"] == "REGRESSED"
+    ]
+    if regressed:
+        print(
+            report.format_rows(
+                [
+                    ("regressed", ", ".join(regressed)),
+                    ("threshold", f"{args.threshold:.0%}"),
+                ]
+            )
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-k", "--filter", action="append", default=[], help="Substring of case names"
+    )
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument(
+        "--min-time", type=float, default=0.1, help="Seconds per timed repeat"
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument(
+        "--confirm",
+        type=int,
+        default=DEFAULT_CONFIRM,
+        help="Times to re-run a case that looks regressed before reporting it",
+    )
+    parser.add_argument("--baselines", type=Path, default=BASELINES_PATH)
+    parser.add_argument("--update", action="store_true", help="Record new baselines")
+    parser.add_argument("--json", help="Also write the results to this file")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,78 @@
+import math
+import re
+from typing import Dict, List, Sequence, Tuple
+
+SAMPLE_PATTERN = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$")
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]; NaN for no values."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Prometheus text exposition -> {(name, sorted labels): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line.strip())
+        if not match or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        key = tuple(sorted(LABEL_PATTERN.findall(labels or "")))
+        samples[(name, key)] = float(value)
+    return samples
+
+
+def diff_metrics(before: Dict, after: Dict) -> Dict:
+    """Per-sample increase between two scrapes (counters and histograms only grow)."""
+    return {key: value - before.get(key, 0.0) for key, value in after.items()}
+
+
+def histogram(samples: Dict, name: str, **labels) -> Dict:
+    """Buckets, sum and count of one histogram series from parsed samples."""
+    wanted = set(labels.items())
+    buckets: List[Tuple[float, float]] = []
+    total = count = 0.0
+    for (sample, key), value in samples.items():
+        key_labels = dict(key)
+        le = key_labels.pop("le", None)
+        if set(key_labels.items()) != wanted:
+            continue
+        if sample == f"{name}_bucket" and le is not None:
+            buckets.append((float(le), value))
+        elif sample == f"{name}_sum":
+            total = value
+        elif sample == f"{name}_count":
+            count = value
+    return {"buckets": sorted(buckets), "sum": total, "count": count}
+
+
+def histogram_quantile(series: Dict, q: float) -> float:
+    """Upper bound of the bucket holding the q-quantile (q in [0, 1])."""
+    if not series["count"]:
+        return float("nan")
+    target = q * series["count"]
+    for bound, cumulative in series["buckets"]:
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def label_values(samples: Dict, name: str, label: str) -> List[str]:
+    return sorted(
+        {
+            dict(key)[label]
+            for sample, key in samples
+            if sample == name and label in dict(key)
+        }
+    )
+
+
+def format_rows(rows: List[Tuple[str, str]]) -> str:
+    width = max(len(name) for name, _ in rows)
+    return "\n".join(f"{name:<{width}}  {value}" for name, value in rows)
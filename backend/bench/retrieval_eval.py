@@ -0,0 +1,477 @@
+"""Offline retrieval evaluation: recall@k, MRR, latency and memory per index backend.
+
+Builds every backend in BACKENDS over the stored vectors (utils/embeddings.txt,
+plus utils/tsv_embeddings.txt when present) and runs a labelled question set
+against each. Query vectors come from a cache file, so nothing leaves the
+machine; --embed fills in missing ones from Voyage first.
+
+Questions are JSON Lines: {"question": ..., "relevant": [ids], "corpus":
+"general" | "tsv"}. Without --questions, known-item queries are made by
+moving each stored vector along the directions the stored vectors differ
+in, each relevant only to the vector it came from. --pad-to adds seeded
+distractors drawn from the same spread, so they compete with real items at
+realistic similarity as the corpus grows. Approximate backends also report
+their top-k overlap with exact search, which is the fairer comparison on
+synthetic queries.
+
+bench/retrieval_questions.jsonl is a hand-labelled set over the general
+corpus. Its query vectors are not checked in; run it once with --embed
+(needs VOYAGE_API_KEY and network) to cache them.
+
+A Pinecone baseline is scored from a recording (--pinecone-results), made
+once with network access by --record-pinecone; its latency is as recorded.
+
+    python bench/retrieval_eval.py
+    python bench/retrieval_eval.py --pad-to 100000 -k 1 10
+    python bench/retrieval_eval.py --questions bench/retrieval_questions.jsonl --embed
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+from api import ivf, vector_index
+from api.lexical import GENERAL_CHUNKS_PATH
+from bench import report
+
+CORPORA = {
+    "general": GENERAL_CHUNKS_PATH,
+    "tsv": vector_index.TSV_VECTORS_PATH,
+}
+
+# Pinecone index per corpus, as in api/main.py
+PINECONE_INDEXES = {"general": "plasticlist2", "tsv": "plasticlist3"}
+
+# Hand-labelled questions over the general corpus
+LABELLED_QUESTIONS = BACKEND_DIR / "bench" / "retrieval_questions.jsonl"
+
+# Share of a distractor's spread that is isotropic rather than along the corpus
+DISTRACTOR_RESIDUAL = 0.25
+
+
+def quantized_backend(kind: str) -> Callable:
+    """Builder writing sidecars to a temporary directory, as the store writer does."""
+
+    def build(ids, vectors, metadata):
+        directory = tempfile.mkdtemp(prefix="retrieval_eval_")
+        atexit.register(shutil.rmtree, directory, True)
+        path = Path(directory) / "vectors.txt"
+        vector_index.write_quantized(path, ids, vectors, metadata)
+        return vector_index.QuantizedIndex.open(path, kind)
+
+    return build
+
+
+def ivf_backend(ids, vectors, metadata):
+    """IVF index saved to a temporary directory and reopened memory-mapped."""
+    directory = tempfile.mkdtemp(prefix="retrieval_eval_")
+    atexit.register(shutil.rmtree, directory, True)
+    path = Path(directory) / "vectors.txt"
+    path.touch()
+    ivf.IVFIndex.build(ids, vectors, metadata).save(path)
+    return ivf.IVFIndex.open(path)
+
+
+# Backend name -> builder over (ids, vectors, metadata); the exact one is the reference
+BACKENDS: Dict[str, Callable] = {
+    "exact": vector_index.ExactIndex,
+    "int8": quantized_backend("int8"),
+    "binary": quantized_backend("binary"),
+    "ivf": ivf_backend,
+}
+
+
+@dataclass
+class Corpus:
+    name: str
+    ids: List[str]
+    vectors: np.ndarray
+    metadata: List[Dict]
+
+
+@dataclass
+class Question:
+    text: str
+    relevant: List[str]
+    corpus: str
+    vector: Optional[np.ndarray] = None
+
+
+def load_corpora(names: Sequence[str]) -> Dict[str, Corpus]:
+    corpora = {}
+    for name in names:
+        path = CORPORA[name]
+        if not os.path.exists(path):
+            print(f"Skipping {name}: no stored vectors at {path}", file=sys.stderr)
+            continue
+        corpora[name] = Corpus(name, *vector_index.read_vectors(path))
+    return corpora
+
+
+def stored(corpus: Corpus):
+    """Ids and normalized vectors of the corpus's own items, without any padding."""
+    rows = [
+        i
+        for i, item_id in enumerate(corpus.ids)
+        if not item_id.startswith("distractor_")
+    ]
+    vectors = np.asarray(corpus.vectors[rows], dtype=np.float32)
+    return [corpus.ids[i] for i in rows], vector_index.normalize(vectors)
+
+
+def deviations(vectors: np.ndarray, count: int, rng) -> np.ndarray:
+    """Random offsets shaped like the stored vectors' spread about their mean.
+
+    Real embeddings share a large common direction (pairwise cosine ~0.6-0.9),
+    so offsets drawn from the whole space would be near-orthogonal to every
+    item. These mix the stored vectors' own deviations, with
+    DISTRACTOR_RESIDUAL of the variance spread over every dimension so they
+    don't stay in the few dimensions the corpus spans.
+    """
+    centered = vectors - vectors.mean(axis=0)
+    weights = rng.standard_normal((count, len(vectors)), dtype=np.float32)
+    spread = weights @ centered / np.sqrt(max(len(vectors) - 1, 1))
+    scale = np.sqrt((centered**2).sum() / max(len(vectors) - 1, 1) / vectors.shape[1])
+    residual = rng.standard_normal((count, vectors.shape[1]), dtype=np.float32)
+    return (
+        np.sqrt(1 - DISTRACTOR_RESIDUAL) * spread
+        + np.sqrt(DISTRACTOR_RESIDUAL) * scale * residual
+    )
+
+
+def pad_corpus(corpus: Corpus, size: int, seed: int = 0) -> Corpus:
+    """The corpus plus distractors drawn like its own vectors, up to `size` vectors."""
+    extra = size - len(corpus.ids)
+    if extra <= 0:
+        return corpus
+    rng = np.random.default_rng(seed)
+    _, vectors = stored(corpus)
+    distractors = vector_index.normalize(
+        vectors.mean(axis=0) + deviations(vectors, extra, rng)
+    )
+    return Corpus(
+        corpus.name,
+        corpus.ids + [f"distractor_{i}" for i in range(extra)],
+        np.vstack([corpus.vectors, distractors]),
+        corpus.metadata + [{} for _ in range(extra)],
+    )
+
+
+def known_item_questions(
+    corpus: Corpus, noise: float = 1.0, seed: int = 0
+) -> List[Question]:
+    """One query per stored vector, moved `noise` typical deviations from it."""
+    rng = np.random.default_rng(seed)
+    ids, vectors = stored(corpus)
+    queries = vectors + noise * deviations(vectors, len(vectors), rng)
+    return [
+        Question(f"known-item:{item_id}", [item_id], corpus.name, query)
+        for item_id, query in zip(ids, queries)
+    ]
+
+
+def load_questions(path: str, query_vectors: Dict[str, List[float]]) -> List[Question]:
+    questions = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            vector = query_vectors.get(entry["question"])
+            questions.append(
+                Question(
+                    entry["question"],
+                    [str(item) for item in entry["relevant"]],
+                    entry.get("corpus", "general"),
+                    None if vector is None else np.asarray(vector, dtype=np.float32),
+                )
+            )
+    return questions
+
+
+def embed_missing(questions: List[Question], cache_path: str):
+    """Fill in query vectors from Voyage and save them to the cache (needs network)."""
+    import requests
+    from dotenv import load_dotenv
+
+    from api import ratelimit
+
+    load_dotenv()
+    missing = [question for question in questions if question.vector is None]
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    limiter = ratelimit.limiter("voyage")
+    for offset in range(0, len(missing), 64):
+        batch = missing[offset : offset + 64]
+        texts = [question.text for question in batch]
+        limiter.acquire_sync(
+            sum(ratelimit.estimate_tokens(text) for text in texts), max_wait=120
+        )
+        response = requests.post(
+            os.getenv("VOYAGE_API_URL", "https://api.voyageai.com/v1/embeddings"),
+            headers={"Authorization": f"Bearer {os.getenv('VOYAGE_API_KEY')}"},
+            json={"model": "voyage-3-large", "input": texts},
+            timeout=60,
+        )
+        response.raise_for_status()
+        items = sorted(response.json()["data"], key=lambda item: item["index"])
+        for question, item in zip(batch, items):
+            question.vector = np.asarray(item["embedding"], dtype=np.float32)
+            cache[question.text] = item["embedding"]
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+    print(f"Embedded {len(missing)} questions into {cache_path}", file=sys.stderr)
+
+
+def recall_at_k(ranked: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(ranked: Sequence[str], relevant: Sequence[str]) -> float:
+    for rank, item_id in enumerate(ranked, start=1):
+        if item_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def mean(values: Sequence[float]) -> float:
+    return round(float(np.mean(values)), 4) if len(values) else float("nan")
+
+
+def score(
+    rankings: List[List[str]],
+    questions: List[Question],
+    ks: Sequence[int],
+    latencies_ms: List[float],
+) -> Dict:
+    pairs = list(zip(rankings, questions))
+    result = {
+        f"recall@{k}": mean([recall_at_k(r, q.relevant, k) for r, q in pairs])
+        for k in ks
+    }
+    result["mrr"] = mean([reciprocal_rank(r, q.relevant) for r, q in pairs])
+    for q in (50, 95, 99):
+        result[f"p{q}_ms"] = round(report.percentile(latencies_ms, q), 3)
+    return result
+
+
+def overlap(rankings: List[List[str]], reference: List[List[str]], k: int) -> float:
+    """Mean share of the reference top-k that a backend also returns in its top-k."""
+    return mean(
+        [
+            len(set(ranked[:k]) & set(expected[:k])) / len(expected[:k])
+            for ranked, expected in zip(rankings, reference)
+            if expected
+        ]
+    )
+
+
+def run_backend(index, questions: List[Question], top_k: int):
+    rankings = []
+    latencies_ms = []
+    for question in questions:
+        start = time.perf_counter()
+        result = index.query(vector=question.vector, top_k=top_k)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        rankings.append([match["id"] for match in result["matches"]])
+    return rankings, latencies_ms
+
+
+def evaluate_corpus(
+    corpus: Corpus,
+    questions: List[Question],
+    ks: Sequence[int],
+    backends: Sequence[str],
+) -> Dict[str, Dict]:
+    top_k = max(ks)
+    results = {}
+    reference = None
+    for name in ["exact", *[backend for backend in backends if backend != "exact"]]:
+        start = time.perf_counter()
+        index = BACKENDS[name](corpus.ids, corpus.vectors, corpus.metadata)
+        build_s = time.perf_counter() - start
+        rankings, latencies_ms = run_backend(index, questions, top_k)
+        results[name] = {
+            **score(rankings, questions, ks, latencies_ms),
+            "memory_mb": round(index.nbytes / 2**20, 3),
+            "build_s": round(build_s, 3),
+        }
+        if reference is None:
+            reference = rankings
+        else:
+            results[name][f"overlap@{top_k}"] = overlap(rankings, reference, top_k)
+    return results
+
+
+def evaluate_recorded(
+    recorded: Dict, questions: List[Question], ks: Sequence[int]
+) -> Optional[Dict]:
+    """Score recorded Pinecone results for the questions it has answers for."""
+    answered = [question for question in questions if question.text in recorded]
+    if not answered:
+        return None
+    rankings = [recorded[question.text]["ids"] for question in answered]
+    latencies_ms = [recorded[question.text]["latency_ms"] for question in answered]
+    result = score(rankings, answered, ks, latencies_ms)
+    result["questions"] = len(answered)
+    return result
+
+
+def record_pinecone(questions: List[Question], path: str, top_k: int):
+    """Query the live Pinecone indexes and save ranked ids and latency (needs network)."""
+    from dotenv import load_dotenv
+    from pinecone import Pinecone
+
+    load_dotenv()
+    client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    recorded: Dict[str, Dict] = {}
+    for corpus, index_name in PINECONE_INDEXES.items():
+        index = client.Index(index_name)
+        recorded[corpus] = {}
+        for question in questions:
+            if question.corpus != corpus or question.vector is None:
+                continue
+            start = time.perf_counter()
+            result = index.query(
+                vector=question.vector.tolist(), top_k=top_k, namespace="default"
+            )
+            recorded[corpus][question.text] = {
+                "ids": [match["id"] for match in result["matches"]],
+                "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+            }
+    with open(path, "w") as f:
+        json.dump(recorded, f, indent=2)
+    print(f"Recorded Pinecone results for {len(questions)} questions to {path}")
+
+
+def print_results(results: Dict[str, Dict[str, Dict]]):
+    for corpus, backends in results.items():
+        rows = []
+        for name, metrics in backends.items():
+            rows.append(
+                (
+                    f"{corpus}/{name}",
+                    "  ".join(f"{key}={value}" for key, value in metrics.items()),
+                )
+            )
+        print(report.format_rows(rows))
+
+
+def main(args):
+    corpora = load_corpora(args.corpus)
+    if args.pad_to:
+        corpora = {
+            name: pad_corpus(corpus, args.pad_to, args.seed)
+            for name, corpus in corpora.items()
+        }
+
+    if args.questions:
+        query_vectors = {}
+        if os.path.exists(args.query_vectors):
+            with open(args.query_vectors) as f:
+                query_vectors = json.load(f)
+        questions = load_questions(args.questions, query_vectors)
+        if args.embed:
+            embed_missing(questions, args.query_vectors)
+        missing = sum(question.vector is None for question in questions)
+        if missing:
+            sys.exit(
+                f"{missing} questions have no cached vector in {args.query_vectors}; "
+                "run once with --embed"
+            )
+    else:
+        questions = [
+            question
+            for corpus in corpora.values()
+            for question in known_item_questions(corpus, args.noise, args.seed)[
+                : args.max_questions
+            ]
+        ]
+
+    if args.record_pinecone:
+        record_pinecone(questions, args.record_pinecone, max(args.k))
+        return
+
+    recorded = {}
+    if args.pinecone_results:
+        with open(args.pinecone_results) as f:
+            recorded = json.load(f)
+
+    results = {}
+    for name, corpus in corpora.items():
+        corpus_questions = [
+            question for question in questions if question.corpus == name
+        ]
+        if not corpus_questions:
+            continue
+        print(
+            f"{name}: {len(corpus.ids)} vectors, {len(corpus_questions)} questions",
+            file=sys.stderr,
+        )
+        results[name] = evaluate_corpus(corpus, corpus_questions, args.k, args.backend)
+        pinecone = evaluate_recorded(recorded.get(name, {}), corpus_questions, args.k)
+        if pinecone is not None:
+            results[name]["pinecone (recorded)"] = pinecone
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=sorted(CORPORA),
+        help="Corpus to evaluate (repeatable; default: every stored one)",
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=sorted(BACKENDS),
+        help="Backend to compare with exact search (repeatable; default: all)",
+    )
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument(
+        "--questions",
+        help=f"Labelled questions, JSON Lines (e.g. bench/{LABELLED_QUESTIONS.name})",
+    )
+    parser.add_argument(
+        "--query-vectors",
+        default=str(BACKEND_DIR / "bench" / "query_vectors.json"),
+        help="Cache of question -> embedding",
+    )
+    parser.add_argument(
+        "--embed", action="store_true", help="Embed uncached questions via Voyage"
+    )
+    parser.add_argument("--pinecone-results", help="Recorded Pinecone results to score")
+    parser.add_argument(
+        "--record-pinecone", help="Query Pinecone and write its results here"
+    )
+    parser.add_argument("--pad-to", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--max-questions", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    args.corpus = args.corpus or sorted(CORPORA)
+    args.backend = args.backend or sorted(BACKENDS)
+    main(args)
@@ -0,0 +1,58 @@
+import json
+
+import pandas as pd
+
+from api import aggregates
+
+
+def samples():
+    return pd.DataFrame(
+        {
+            "product": ["Green Tea", "Green Tea", "Nuggets", "Milk"],
+            "product_id": [79, 79, 40, 12],
+            "tags": ["tea,beverages", "tea,beverages", "fast_food", "dairy,beverages"],
+            "DEHP_ng_g": ["<10", "20", "230", "40"],
+            "DEHP_percentile_ng_g": ["<LOQ", "31", "91", "50"],
+            "DEHP_percent_tdi_70_kg_epa": ["<LOQ", "0.5", "12", "1.5"],
+            "DINP_ng_g": ["<LOQ", "<LOQ", "<LOQ", "<LOQ"],
+            "DINP_percent_tdi_70_kg_epa": ["NO RfD"] * 4,
+        }
+    )
+
+
+def test_chemical_summary_skips_non_detects():
+    df = samples()
+    assert aggregates.chemicals(df) == ["DEHP", "DINP"]
+    summary = aggregates.chemical_summary(df)
+    assert summary["DEHP"] == {
+        "samples": 4,
+        "detected": 3,
+        "min_ng_g": 20.0,
+        "median_ng_g": 40.0,
+        "max_ng_g": 230.0,
+    }
+    assert summary["DINP"]["detected"] == 0
+    assert summary["DINP"]["median_ng_g"] is None
+
+
+def test_top_products_tags_and_tdi():
+    df = samples()
+    top = aggregates.top_products(df, top_n=2)["DEHP"]
+    assert [entry["product"] for entry in top] == ["Nuggets", "Milk"]
+    assert aggregates.top_products(df)["DINP"] == []
+
+    tags = aggregates.tag_counts(df)
+    assert list(tags)[0] == "beverages"
+    assert tags["beverages"] == {"samples": 3, "products": 2}
+
+    tdi = aggregates.tdi_exceedances(df)
+    assert tdi["DEHP"]["70_kg_epa"] == {"1": 2, "10": 1, "50": 0, "100": 0}
+    assert "DINP" not in tdi
+
+
+def test_compute_stats_is_json_ready():
+    stats = aggregates.compute_stats(samples(), "abc")
+    assert stats["version"] == "abc"
+    assert stats["samples"] == 4 and stats["products"] == 3
+    # Same data, same bytes: the payload is the validator across processes
+    assert json.dumps(stats) == json.dumps(aggregates.compute_stats(samples(), "abc"))
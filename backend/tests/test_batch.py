@@ -0,0 +1,110 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from api import batch
+
+
+def test_parse_items_assigns_ids_and_rejects_bad_batches():
+    items = batch.parse_items(
+        [{"question": " What is BPA? "}, {"id": 7, "question": "PFAS?"}]
+    )
+    assert items == [
+        batch.BatchItem("0", "What is BPA?"),
+        batch.BatchItem("7", "PFAS?"),
+    ]
+    for entries in ([], [{"question": ""}], [{"id": "a", "question": "x"}] * 2):
+        with pytest.raises(ValueError):
+            batch.parse_items(entries)
+
+
+def test_run_batch_caps_generation_and_reports_each_item():
+    active = 0
+    peak = 0
+    retrieved = []
+
+    async def retrieve(item):
+        retrieved.append(item.question)
+        return f"context for {item.question}"
+
+    async def generate(item, context):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        # Later items finish first
+        await asyncio.sleep(0.01 * (5 - int(item.id)))
+        active -= 1
+        if item.id == "3":
+            raise RuntimeError("model overloaded")
+        return {"status": "ok", "answer": context.upper()}
+
+    async def run():
+        items = [batch.BatchItem(str(i), f"q{i}") for i in range(5)]
+        return [
+            result
+            async for result in batch.run_batch(
+                items, retrieve, generate, concurrency=2
+            )
+        ]
+
+    results = asyncio.run(run())
+    assert peak == 2
+    assert sorted(retrieved) == ["q0", "q1", "q2", "q3", "q4"]
+    by_id = {result["id"]: result for result in results}
+    assert by_id["0"]["answer"] == "CONTEXT FOR Q0"
+    assert by_id["3"] == {
+        "id": "3",
+        "question": "q3",
+        "status": "error",
+        "error": "model overloaded",
+        "elapsed_ms": by_id["3"]["elapsed_ms"],
+    }
+    # Yielded as they finish, not in input order
+    assert [result["id"] for result in results][:2] == ["1", "0"]
+
+
+def test_closing_the_stream_cancels_running_items():
+    cancelled = []
+
+    async def retrieve(item):
+        return None
+
+    async def generate(item, context):
+        if item.id == "0":
+            return {"status": "ok"}
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item.id)
+            raise
+
+    async def run():
+        items = [batch.BatchItem(str(i), "q") for i in range(3)]
+        results = batch.run_batch(items, retrieve, generate, concurrency=3)
+        first = await results.__anext__()
+        await results.aclose()
+        return first
+
+    assert asyncio.run(run())["id"] == "0"
+    assert sorted(cancelled) == ["1", "2"]
+
+
+def test_preparation_and_generation_share_the_item_context():
+    # A ledger started while preparing must still be current while answering
+    current = contextvars.ContextVar("current", default=None)
+
+    async def retrieve(item):
+        current.set(f"ledger {item.id}")
+        return None
+
+    async def generate(item, prepared):
+        await asyncio.sleep(0)
+        return {"status": "ok", "ledger": current.get()}
+
+    async def run():
+        items = [batch.BatchItem(str(i), "q") for i in range(4)]
+        return [result async for result in batch.run_batch(items, retrieve, generate)]
+
+    for result in asyncio.run(run()):
+        assert result["ledger"] == f"ledger {result['id']}"
@@ -0,0 +1,73 @@
+from api import prompts, sandbox, streaming
+from bench import micro
+
+
+def test_every_case_runs_and_has_a_baseline():
+    baselines = micro.load_baselines(micro.BASELINES_PATH)
+    for name, setup in micro.CASES.items():
+        setup()()
+        assert name in baselines["cases"]
+
+
+def test_compare_corrects_for_machine_speed():
+    baseline = {"min_us": 100.0}
+    assert micro.compare({"min_us": 110.0}, baseline, 0.25)["status"] == "ok"
+    assert micro.compare({"min_us": 130.0}, baseline, 0.25)["status"] == "REGRESSED"
+    assert micro.compare({"min_us": 70.0}, baseline, 0.25)["status"] == "faster"
+    # Twice as slow on a machine running at half speed is no regression
+    assert micro.compare({"min_us": 200.0}, baseline, 0.25, speed=2.0)["ratio"] == 1
+    assert micro.compare({"min_us": 1.0}, None, 0.25)["status"] == "new"
+
+
+def test_sse_lines_and_tool_input_fragments():
+    text = ""
+    tool_input = None
+    buffer = streaming.ToolInputBuffer()
+    for line in micro.stream_lines(text_deltas=3, json_fragments=7):
+        data = streaming.parse_data_line(line.decode())
+        if data is None or data["type"] != "content_block_delta":
+            continue
+        if data["delta"]["type"] == "text_delta":
+            text += data["delta"]["text"]
+        else:
+            assert tool_input is None
+            tool_input = buffer.add(data["delta"]["partial_json"])
+
+    assert text == "word0 and more word1 and more word2 and more "
+    assert tool_input == {"query": micro.SAFE_CODE_SNIPPETS[2]}
+    assert streaming.parse_data_line("data: [DONE]\n") is None
+    assert streaming.parse_data_line("event: ping\n") is None
+
+
+def test_safe_code_snippets():
+    verdicts = [sandbox.is_safe_code(code) for code in micro.SAFE_CODE_SNIPPETS]
+    assert verdicts == [True, True, True, True, False, False, False]
+
+
+def test_conversation_history_is_chronological_without_current_query():
+    rows = micro.conversation_rows(3, answer_chars=20)
+    rows.append(
+        {"id": "q3", "created_at": "2025-02-01", "question": "x", "response": ""}
+    )
+    history = prompts.conversation_history(rows, "q1")
+    questions = [block.split("\n")[0] for block in history.split("\n\n")]
+    assert questions == [
+        "Q: Follow-up question number 0 about phthalates?",
+        "Q: Follow-up question number 2 about phthalates?",
+    ]
+
+
+def test_a_regression_must_repeat_to_count():
+    def attempts(*ratios):
+        results = iter(
+            {"ratio": ratio, "status": "REGRESSED" if ratio > 1.25 else "ok"}
+            for ratio in ratios
+        )
+        return lambda: next(results)
+
+    noisy = micro.confirmed(attempts(1.34, 1.02), retries=2)
+    assert noisy["status"] == "ok" and noisy["attempts"] == 2
+    real = micro.confirmed(attempts(1.5, 1.6, 1.4), retries=2)
+    assert real["status"] == "REGRESSED"
+    assert real["ratio"] == 1.4 and real["attempts"] == 3
+    assert micro.confirmed(attempts(1.02), retries=2)["attempts"] == 1
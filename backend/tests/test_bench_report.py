@@ -0,0 +1,42 @@
+from bench import report
+
+SCRAPE = """# HELP plasticlist_stage_duration_seconds Duration of named request lifecycle stages.
+# TYPE plasticlist_stage_duration_seconds histogram
+plasticlist_stage_duration_seconds_bucket{stage="embedding",le="0.1"} 3
+plasticlist_stage_duration_seconds_bucket{stage="embedding",le="0.5"} 4
+plasticlist_stage_duration_seconds_bucket{stage="embedding",le="+Inf"} 4
+plasticlist_stage_duration_seconds_sum{stage="embedding"} 0.6
+plasticlist_stage_duration_seconds_count{stage="embedding"} 4
+plasticlist_queries_total{status="completed"} 4.0
+"""
+
+
+def test_percentile_is_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+    assert report.percentile(values, 50) == 3
+    assert report.percentile(values, 99) == 5
+    assert report.percentile(values, 0) == 1
+    assert report.percentile([], 50) != report.percentile([], 50)
+
+
+def test_histograms_from_scrapes():
+    after = report.parse_metrics(SCRAPE)
+    before = report.parse_metrics(SCRAPE.replace("} 4", "} 2").replace("} 3", "} 1"))
+    assert after[("plasticlist_queries_total", (("status", "completed"),))] == 4.0
+
+    series = report.histogram(
+        report.diff_metrics(before, after),
+        "plasticlist_stage_duration_seconds",
+        stage="embedding",
+    )
+    assert series["count"] == 2
+    assert report.histogram_quantile(series, 1.0) == 0.1
+
+    totals = report.histogram(
+        after, "plasticlist_stage_duration_seconds", stage="embedding"
+    )
+    assert report.histogram_quantile(totals, 0.5) == 0.1
+    assert report.histogram_quantile(totals, 1.0) == 0.5
+    assert report.label_values(
+        after, "plasticlist_stage_duration_seconds_count", "stage"
+    ) == ["embedding"]
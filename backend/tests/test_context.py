@@ -0,0 +1,47 @@
+from api import context
+
+
+def make_match(id, score, text, **metadata):
+    return {"id": id, "score": score, "metadata": {"text": text, **metadata}}
+
+
+def test_adjacent_chunk_overlap_is_kept_once():
+    first = "alpha beta gamma delta"
+    second = "gamma delta epsilon zeta"
+    matches = [
+        make_match("a_0", 0.9, first, source="a.txt", chunk_index=0, start_index=0),
+        make_match("a_1", 0.8, second, source="a.txt", chunk_index=1, start_index=11),
+    ]
+
+    selected = context.select_passages(
+        context.passages_from_matches(matches, "general"), token_budget=1000
+    )
+    assert [p.text for p in selected] == [first, " epsilon zeta"]
+
+
+def test_low_score_tail_and_budget_are_applied():
+    matches = [
+        make_match("row_1", 0.70, "x" * 400),
+        make_match("row_2", 0.65, "y" * 400),
+        make_match("row_3", 0.60, "z" * 40),
+        make_match("row_4", 0.30, "tail"),
+    ]
+
+    selected = context.select_passages(
+        context.passages_from_matches(matches, "tsv"),
+        token_budget=120,
+        min_score=0.2,
+        score_margin=0.2,
+    )
+    assert [p.id for p in selected] == ["row_1", "row_3"]
+
+
+def test_format_keeps_prompt_layout():
+    rendered = context.assemble_context(
+        [make_match("team_chunk_0", 0.9, "team", source="team.txt", chunk_index=0)],
+        [make_match("row_7", 0.8, "product: Milk")],
+    )
+    assert rendered == (
+        "General Knowledge:\nContent from general knowledge (team_chunk_0):\nteam"
+        "\n\nTSV Data:\nTSV Entry 1:\nproduct: Milk"
+    )
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from api import embeddings, ratelimit
+
+
+class FakeVoyage:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.priorities = []
+        self.fail = fail
+
+    async def __call__(self, texts, priority):
+        self.calls.append(list(texts))
+        self.priorities.append(priority)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError("voyage down")
+        return [[float(len(text))] for text in texts], 10 * len(texts)
+
+
+def test_concurrent_texts_share_one_call_and_duplicates_coalesce():
+    voyage = FakeVoyage()
+    batcher = embeddings.EmbeddingBatcher(voyage, window=0.005, max_items=32)
+
+    async def run():
+        texts = ["bpa", "phthalates in milk", "bpa", "pfas"]
+        return await asyncio.gather(*(batcher.embed(text) for text in texts))
+
+    results = asyncio.run(run())
+    assert voyage.calls == [["bpa", "phthalates in milk", "pfas"]]
+    assert [vector for vector, _ in results] == [[3.0], [18.0], [3.0], [4.0]]
+    # 30 tokens split by text size; the coalesced "bpa" is billed once
+    assert [tokens for _, tokens in results] == [4, 22, 0, 4]
+    assert sum(tokens for _, tokens in results) == 30
+
+
+def test_full_batches_go_out_without_waiting():
+    voyage = FakeVoyage()
+    batcher = embeddings.EmbeddingBatcher(voyage, window=10, max_items=2)
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.embed(f"text {i}") for i in range(4))), 1
+        )
+
+    assert len(asyncio.run(run())) == 4
+    assert voyage.calls == [["text 0", "text 1"], ["text 2", "text 3"]]
+
+
+def test_failure_reaches_every_waiter_and_cancelling_one_spares_the_rest():
+    async def failing():
+        batcher = embeddings.EmbeddingBatcher(FakeVoyage(fail=True), window=0.001)
+        results = await asyncio.gather(
+            batcher.embed("a"), batcher.embed("b"), return_exceptions=True
+        )
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+    async def cancelling():
+        batcher = embeddings.EmbeddingBatcher(FakeVoyage(), window=0.001)
+        leaving = asyncio.ensure_future(batcher.embed("same"))
+        staying = asyncio.ensure_future(batcher.embed("same"))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        assert await staying == ([4.0], 10)
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+
+    asyncio.run(failing())
+    asyncio.run(cancelling())
+
+
+def test_batches_are_admitted_at_their_most_urgent_priority():
+    voyage = FakeVoyage()
+    batcher = embeddings.EmbeddingBatcher(voyage, window=0.005, max_items=32)
+
+    async def run():
+        await asyncio.gather(
+            batcher.embed("bpa", ratelimit.BATCH),
+            batcher.embed("pfas", ratelimit.BATCH),
+        )
+        await asyncio.gather(
+            batcher.embed("bpa in milk", ratelimit.BATCH),
+            batcher.embed("dehp in tea"),
+        )
+
+    asyncio.run(run())
+    assert voyage.priorities == [ratelimit.BATCH, ratelimit.INTERACTIVE]
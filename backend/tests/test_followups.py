@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from api import followups
+
+
+def test_stream_sees_text_so_far_then_deltas():
+    async def scenario():
+        registry = followups.FollowupRegistry()
+        release = asyncio.Event()
+
+        async def generate(job):
+            job.publish("FOLLOWUP1: a\n")
+            await release.wait()
+            job.publish("FOLLOWUP2: b\n")
+
+        job = registry.start("q1", generate)
+        assert registry.start("q1", generate) is job
+        await asyncio.sleep(0)
+
+        async def collect():
+            return [delta async for delta in job.stream()]
+
+        reader = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+        release.set()
+        assert await job.wait() == "FOLLOWUP1: a\nFOLLOWUP2: b\n"
+        assert await reader == ["FOLLOWUP1: a\n", "FOLLOWUP2: b\n"]
+        assert registry.get("q1") is job
+
+    asyncio.run(scenario())
+
+
+def test_failed_jobs_are_not_cached():
+    async def scenario():
+        registry = followups.FollowupRegistry()
+
+        async def generate(job):
+            raise RuntimeError("overloaded")
+
+        job = registry.start("q1", generate)
+        with pytest.raises(RuntimeError):
+            await job.wait()
+        await asyncio.sleep(0)
+        assert registry.get("q1") is None
+
+    asyncio.run(scenario())
+
+
+def test_finished_jobs_are_evicted_beyond_cache_size():
+    async def scenario():
+        registry = followups.FollowupRegistry(cache_size=2)
+
+        async def generate(job):
+            job.publish("done")
+
+        for query_id in ("a", "b", "c"):
+            await registry.start(query_id, generate).wait()
+            await asyncio.sleep(0)
+        assert list(registry.jobs) == ["b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_jobs_finish_with_an_error():
+    async def scenario():
+        registry = followups.FollowupRegistry()
+
+        async def generate(job):
+            job.publish("FOLLOWUP1: a\n")
+            await asyncio.Event().wait()
+
+        job = registry.start("q1", generate)
+        await asyncio.sleep(0)
+        registry._tasks["q1"].cancel()
+        with pytest.raises(RuntimeError, match="cancelled"):
+            await asyncio.wait_for(job.wait(), 1)
+        assert registry.get("q1") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+import gzip
+import json
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from api import http_cache, storage
+
+BIG = {"rows": ["phthalates in milk"] * 200}
+
+
+def make_app():
+    def answer(request: Request):
+        return http_cache.cached_response(
+            request,
+            json.dumps(BIG).encode(),
+            "application/json",
+            http_cache.REVALIDATE_CACHE_CONTROL,
+            http_cache.last_modified(["2025-01-01T12:00:00.5", None]),
+        )
+
+    def events(request: Request):
+        return StreamingResponse(
+            iter(["data: {}\n\n"] * 300), media_type="text/event-stream"
+        )
+
+    def small(request: Request):
+        return JSONResponse({"ok": True})
+
+    app = Starlette(
+        routes=[
+            Route("/answer", answer),
+            Route("/events", events),
+            Route("/small", small),
+        ]
+    )
+    app.add_middleware(http_cache.GZipJSONMiddleware)
+    return TestClient(app)
+
+
+def test_validators_turn_repeat_requests_into_304s():
+    client = make_app()
+    first = client.get("/answer")
+    assert first.status_code == 200
+    assert first.headers["last-modified"] == "Wed, 01 Jan 2025 12:00:00 GMT"
+    tag = first.headers["etag"]
+    assert tag.startswith('W/"')
+
+    again = client.get("/answer", headers={"If-None-Match": f'"other", {tag}'})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == tag
+
+    since = client.get(
+        "/answer", headers={"If-Modified-Since": first.headers["last-modified"]}
+    )
+    assert since.status_code == 304
+    changed = client.get("/answer", headers={"If-None-Match": 'W/"other"'})
+    assert changed.status_code == 200
+
+
+def test_gzip_applies_to_large_json_only():
+    client = make_app()
+    response = client.get("/answer", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json() == BIG
+
+    stream = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in stream.headers
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+    raw = client.get("/answer", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert len(gzip.compress(raw.content)) < len(raw.content)
+
+
+def test_completed_rows_are_cached_until_written(tmp_path):
+    backing = storage.SQLiteStore(str(tmp_path / "queries.db"))
+    store = storage.CachedQueryStore(backing, size=2)
+    store.insert({"id": "q1", "status": "processing"})
+    store.get("q1")
+    assert store.rows == {}
+
+    store.update("q1", {"status": "completed", "response": "Yes."})
+    assert store.get("q1")["response"] == "Yes."
+    assert "q1" in store.rows
+    # Served from memory, and callers can't change the cached copy
+    backing.conn.execute("UPDATE queries SET response = 'stale' WHERE id = 'q1'")
+    store.get("q1")["response"] = "edited"
+    assert store.get("q1")["response"] == "Yes."
+
+    store.update("q1", {"followups": "FOLLOWUP1: more?"})
+    assert store.get("q1")["followups"] == "FOLLOWUP1: more?"
+    assert store.get("q1")["response"] == "stale"
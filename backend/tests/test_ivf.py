@@ -0,0 +1,104 @@
+import json
+
+import numpy as np
+
+from api import ivf, vector_index
+from bench import retrieval_eval
+
+
+def clustered(size=3000, dims=32, clusters=20, seed=5):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dims))
+    vectors = centres[rng.integers(clusters, size=size)] + 0.3 * rng.standard_normal(
+        (size, dims)
+    )
+    return [f"v{i}" for i in range(size)], vectors.astype(np.float32), rng
+
+
+def top_ids(index, query, **kwargs):
+    return [match["id"] for match in index.query(query, top_k=10, **kwargs)["matches"]]
+
+
+def test_ivf_matches_exact_search_when_probing_enough_lists():
+    ids, vectors, rng = clustered()
+    exact = vector_index.ExactIndex(ids, vectors, [{} for _ in ids])
+    index = ivf.IVFIndex.build(ids, vectors, [{"i": i} for i in ids], nprobe=8)
+    assert index.nlist == ivf.default_nlist(len(ids))
+    assert np.diff(index.offsets).sum() == len(ids)
+
+    hits = 0
+    for row in rng.choice(len(ids), 30, replace=False):
+        query = vectors[row] + 0.1 * rng.standard_normal(vectors.shape[1])
+        expected = top_ids(exact, query)
+        hits += len(set(expected) & set(top_ids(index, query)))
+        # Probing every list is exact search
+        assert top_ids(index, query, nprobe=index.nlist) == expected
+    assert hits / 300 >= 0.9
+    match = index.query(vectors[0], top_k=1, include_metadata=True)["matches"][0]
+    assert match["id"] == "v0" and match["metadata"] == {"i": "v0"}
+
+
+def test_inserts_are_searchable_saved_and_compacted(tmp_path):
+    ids, vectors, rng = clustered()
+    path = tmp_path / "embeddings.txt"
+    path.touch()
+    metadata = [{"text": f"chunk {i}"} for i in ids]
+    index = ivf.IVFIndex.build(ids[:2000], vectors[:2000], metadata[:2000])
+    index.save(path)
+
+    reopened = ivf.load_ivf(path)
+    # Only the centroids, offsets and delta are read into memory
+    assert isinstance(reopened.vectors, np.memmap)
+    assert isinstance(reopened.ids, np.memmap)
+    assert isinstance(reopened.metadata, ivf.MappedRecords)
+    assert reopened.nbytes == (
+        reopened.centroids.nbytes + reopened.offsets.nbytes + reopened.delta.nbytes
+    )
+    match = reopened.query(vectors[5], top_k=1, include_metadata=True)["matches"][0]
+    assert match == {"id": "v5", "score": match["score"], "metadata": metadata[5]}
+    reopened.insert(ids[2000:2100], vectors[2000:2100], metadata[2000:2100])
+    assert top_ids(reopened, vectors[2050])[0] == "v2050"
+    # A small delta is saved beside the lists, which stay as they are
+    reopened.save()
+    reopened = ivf.load_ivf(path)
+    assert len(reopened) == 2100 and len(reopened.delta_ids) == 100
+    assert top_ids(reopened, vectors[2050])[0] == "v2050"
+
+    # Past the compaction threshold the delta is merged into the lists
+    reopened.insert(ids[2100:], vectors[2100:], metadata[2100:])
+    reopened.save()
+    reopened = ivf.load_ivf(path)
+    assert len(reopened) == 3000 and not reopened.delta_ids
+    assert np.array_equal(reopened.centroids, index.centroids)
+    assert top_ids(reopened, vectors[2900])[0] == "v2900"
+    match = reopened.query(vectors[2900], top_k=1, include_metadata=True)
+    assert match["matches"][0]["metadata"] == metadata[2900]
+
+
+def test_load_index_opens_ivf_when_asked(tmp_path):
+    ids, vectors, _ = clustered(size=200)
+    path = tmp_path / "embeddings.txt"
+    path.write_text(
+        json.dumps(
+            [
+                {"id": i, "values": v.tolist(), "metadata": {}}
+                for i, v in zip(ids, vectors)
+            ]
+        )
+    )
+    assert isinstance(
+        vector_index.load_index(path, kind="ivf"), vector_index.ExactIndex
+    )
+    ivf.IVFIndex.build(ids, vectors, [{}] * len(ids)).save(path)
+    assert isinstance(vector_index.load_index(path, kind="ivf"), ivf.IVFIndex)
+    assert ivf.ivf_current(path)
+
+
+def test_default_probes_keep_recall_on_the_padded_corpus():
+    # The checked-in chunks padded with distractors shaped like them, as
+    # bench/retrieval_eval.py --pad-to does
+    corpus = retrieval_eval.load_corpora(["general"])["general"]
+    corpus = retrieval_eval.pad_corpus(corpus, 10000)
+    questions = retrieval_eval.known_item_questions(corpus)
+    results = retrieval_eval.evaluate_corpus(corpus, questions, [10], ["ivf"])
+    assert results["ivf"]["overlap@10"] >= 0.95
@@ -0,0 +1,38 @@
+from api import context, lexical
+from api.context import Passage
+
+
+def row(id, text):
+    return Passage(id=id, text=text, score=0.0, kind="tsv")
+
+
+def test_tokenize_keeps_codes_whole_and_split():
+    tokens = lexical.tokenize("DEHP in lot L-2024.07 of the milk")
+    assert tokens == ["dehp", "lot", "l-2024.07", "l", "2024", "07", "milk"]
+
+
+def test_bm25_ranks_exact_product_match_first():
+    index = lexical.BM25Index(
+        [
+            row("row_1", "product: Organic Whole Milk | tags: dairy"),
+            row("row_2", "product: Oat Milk | tags: dairy,plant"),
+            row("row_3", "product: Ito En Oi Ocha Green Tea | tags: tea"),
+        ]
+    )
+    results = index.search("DEHP levels in Oi Ocha tea", top_k=2)
+    assert [p.id for p in results] == ["row_3"]
+    assert results[0].score > 0
+
+
+def test_fusion_promotes_rows_found_by_both_rankers():
+    vector = [
+        Passage("row_1", "a", 0.8, "tsv"),
+        Passage("row_2", "b", 0.7, "tsv"),
+    ]
+    lexical_hits = [
+        Passage("row_2", "b", 12.0, "tsv"),
+        Passage("row_9", "c", 3.0, "tsv"),
+    ]
+
+    fused = context.fuse(vector, lexical_hits)
+    assert [p.id for p in fused] == ["row_2", "row_1", "row_9"]
@@ -0,0 +1,79 @@
+import pandas as pd
+
+from api import lookup
+
+
+def samples():
+    return pd.DataFrame(
+        {
+            "product": [
+                "Ito En Oi Ocha Unsweetened Green Tea",
+                "Ito En Oi Ocha Unsweetened Green Tea",
+                "Burger King Chicken Nuggets",
+                "Chick-fil-A Nuggets",
+            ],
+            "product_id": [79, 79, 40, 41],
+            "tags": ["tea,beverages", "tea,beverages", "fast_food", "fast_food"],
+            "blinded_name": ["Green tea", "Green tea", "Nuggets", "Nuggets"],
+            "lot_no": ["4:49", "4:50", "L 075 2235261", "DDC207"],
+            "serving_size_g": [370, 370, 90, 90],
+            "DEHP_ng_g": ["<10", "17", "230", "<10"],
+            "DEHP_percentile_ng_g": ["<LOQ", "31", "91", "<LOQ"],
+            "DEHP_percent_tdi_70_kg_epa": ["<LOQ", "0.1", "1.4", "<LOQ"],
+        }
+    )
+
+
+def test_product_prefix_wins_over_generic_names():
+    entity_lookup = lookup.EntityLookup(samples())
+    assert entity_lookup.match("DEHP in ito en oi ocha?") == [0, 1]
+
+
+def test_fuzzy_ids_lots_and_tags():
+    entity_lookup = lookup.EntityLookup(samples())
+    assert entity_lookup.match("burger king chiken nugets") == [2]
+    assert entity_lookup.match("tell me about product 41") == [3]
+    assert entity_lookup.match("which sample has lot 2235261?") == [2]
+    assert entity_lookup.match("average DEHP in fast food") == [2, 3]
+    assert entity_lookup.match("Who are the core team members?") == []
+
+
+def test_record_separates_detected_and_below_loq():
+    record = lookup.format_record(samples().iloc[1])
+    assert record == (
+        "product: Ito En Oi Ocha Unsweetened Green Tea | product_id: 79 | "
+        "tags: tea,beverages | lot_no: 4:50 | serving_size_g: 370 | "
+        "ng/g: DEHP=17 | % EPA TDI (70 kg): DEHP=0.1%"
+    )
+
+
+def test_tags_outrank_blinded_names():
+    df = samples()
+    df.loc[2, "blinded_name"] = "tea"
+    entity_lookup = lookup.EntityLookup(df)
+    # "tea" is one row's blinded name but two rows' tag
+    assert entity_lookup.match("what levels in tea") == [0, 1]
+
+
+def test_generic_words_are_not_direct_hits():
+    df = samples()
+    df["blinded_name"] = ["Tea", "Bottled water", "Chicken", "Water"]
+    entity_lookup = lookup.EntityLookup(df)
+    for question in [
+        "what levels in tea",
+        "What is the methodology for measuring phthalates in water?",
+        "Is bottled water safe?",
+        "how much DEHP is in chicken",
+    ]:
+        assert entity_lookup.match(question) != []
+        assert entity_lookup.match(question, broad=False) == []
+    assert entity_lookup.match("DEHP in ito en oi ocha?", broad=False) == [0, 1]
+    assert entity_lookup.match("lot 2235261", broad=False) == [2]
+
+
+def test_fuzzy_pass_skips_long_questions():
+    entity_lookup = lookup.EntityLookup(samples())
+    padding = " ".join(["tell me more"] * lookup.FUZZY_MAX_WORDS)
+    question = "burgr king chicken nuggets"
+    assert entity_lookup.match(question, broad=False) == [2]
+    assert entity_lookup.match(f"{question} {padding}", broad=False) == []
@@ -0,0 +1,26 @@
+from api import metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "test", labelnames=("stage",))
+    histogram.observe(0.004, stage="a")
+    histogram.observe(0.3, stage="a")
+    histogram.observe(500, stage="a")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="a",le="0.005"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="0.5"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+
+def test_spans_attach_to_current_request():
+    timer = metrics.start_request("query-1")
+    with metrics.span("embedding"):
+        pass
+    metrics.record("anthropic_ttft", 0.25)
+
+    summary = timer.summary()
+    assert "embedding" in summary
+    assert summary["anthropic_ttft"] == 250.0
+    assert "plasticlist_stage_duration_seconds_count" in metrics.REGISTRY.render()
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from api import ratelimit, usage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = ratelimit.TokenBucket(60, clock)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now = 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    # Larger than the bucket: waits for a full bucket rather than forever
+    assert bucket.wait_time(1000) == pytest.approx(59.5)
+
+
+def test_request_and_token_buckets_and_pause():
+    clock = FakeClock()
+    limiter = ratelimit.ProviderLimiter("voyage", 2, 100, clock=clock)
+    assert limiter.try_acquire(60) == 0
+    assert limiter.try_acquire(60) == pytest.approx(20 * 60 / 100)
+    assert limiter.try_acquire(10) == 0
+    assert limiter.try_acquire(10) == pytest.approx(30)
+
+    clock.now = 60
+    error = limiter.throttled("7")
+    assert isinstance(error, ratelimit.RateLimitExceeded)
+    assert limiter.try_acquire(1) == pytest.approx(7)
+    clock.now = 67
+    assert limiter.try_acquire(1) == 0
+
+
+def test_interactive_callers_go_before_batch():
+    async def scenario():
+        # Ten requests a second, with the burst already spent
+        limiter = ratelimit.ProviderLimiter("anthropic", 600, 0, max_wait=5)
+        limiter.requests.level = 0
+        order = []
+
+        async def call(name, priority):
+            await limiter.acquire(priority=priority)
+            order.append(name)
+
+        batch = asyncio.create_task(call("batch", ratelimit.BATCH))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(call("interactive", ratelimit.INTERACTIVE))
+        await asyncio.gather(batch, interactive)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "batch"]
+
+
+def test_callers_are_shed_when_queue_is_full_or_wait_too_long():
+    async def scenario():
+        limiter = ratelimit.ProviderLimiter("anthropic", 1, 0, max_wait=1)
+        await limiter.acquire()
+        # The next slot is a minute away: shed at once instead of after max_wait
+        with pytest.raises(ratelimit.RateLimitExceeded, match="next slot"):
+            await asyncio.wait_for(limiter.acquire(), 0.5)
+
+        limiter = ratelimit.ProviderLimiter("anthropic", 600, 0, max_queue=1)
+        limiter.requests.level = 0
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(ratelimit.RateLimitExceeded, match="1 calls waiting"):
+            await limiter.acquire()
+        await waiting
+        assert limiter.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_admission_sizes_calls_like_billing():
+    assert ratelimit.estimate_tokens is usage.estimate_tokens
+    assert ratelimit.estimate_tokens("abcde") == 2
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api import resilience, vector_index
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return resilience.CircuitBreaker(
+        "test", window=4, min_calls=4, failure_rate=0.5, cooldown=10, clock=clock
+    )
+
+
+def test_breaker_opens_then_closes_after_successful_trial():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok, 0.01)
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_on_slow_trial_and_counts_slow_calls():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(True, 5.0)
+    assert breaker.state == breaker.OPEN
+
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record(True, 5.0)
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+
+
+def test_hedge_answers_when_primary_is_slow():
+    calls = []
+
+    def query(**kwargs):
+        calls.append(kwargs)
+        # The first call hangs; the hedge returns at once
+        if len(calls) == 1:
+            time.sleep(0.5)
+        return {"matches": [len(calls)]}
+
+    index = resilience.ResilientIndex("hedge_test", query, timeout=2)
+    index.hedge_delay = lambda: 0.02
+
+    async def run():
+        start = time.perf_counter()
+        result = await index.query("q", top_k=1)
+        return result, time.perf_counter() - start
+
+    result, seconds = asyncio.run(run())
+    assert result == {"matches": [2]}
+    assert seconds < 0.4
+
+
+def test_failures_fall_back_to_cache_then_local_index():
+    healthy = True
+
+    def query(**kwargs):
+        if not healthy:
+            raise ConnectionError("down")
+        return {"matches": ["remote"]}
+
+    fallback_threads = []
+
+    def fallback(**kwargs):
+        fallback_threads.append(threading.get_ident())
+        return {"matches": ["local"]}
+
+    index = resilience.ResilientIndex("fallback_test", query, fallback=fallback)
+    index.hedge_delay = lambda: None
+
+    async def run():
+        nonlocal healthy
+        assert await index.query("cached", top_k=1) == {"matches": ["remote"]}
+        healthy = False
+        assert await index.query("cached", top_k=1) == {"matches": ["remote"]}
+        assert await index.query("new", top_k=1) == {"matches": ["local"]}
+        # Run off the event loop's thread
+        assert fallback_threads and threading.get_ident() not in fallback_threads
+
+    asyncio.run(run())
+
+    index.fallback = None
+    with pytest.raises(ConnectionError):
+        asyncio.run(index.query("new", top_k=1))
+
+
+def test_hung_calls_are_bounded_and_leave_the_fallback_its_threads():
+    release = threading.Event()
+
+    def query(**kwargs):
+        release.wait()
+        return {"matches": ["remote"]}
+
+    fallback_threads = []
+
+    def fallback(**kwargs):
+        fallback_threads.append(threading.current_thread().name)
+        return {"matches": ["local"]}
+
+    index = resilience.ResilientIndex(
+        "hung_test",
+        query,
+        fallback=fallback,
+        timeout=0.1,
+        breaker=resilience.CircuitBreaker("hung_test", min_calls=100),
+        max_threads=2,
+    )
+    index.hedge_delay = lambda: 0.02
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(index.query(f"q{i}", top_k=1) for i in range(6))
+        )
+        return results, time.perf_counter() - start
+
+    try:
+        results, seconds = asyncio.run(run())
+        assert results == [{"matches": ["local"]}] * 6
+        assert seconds < 1
+        assert len(index.executor._threads) == 2
+        assert not any(name.startswith("hung_test") for name in fallback_threads)
+    finally:
+        release.set()
+        index.executor.shutdown()
+
+
+def test_exact_index_orders_by_cosine_similarity():
+    vectors = np.array([[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]])
+    metadata = [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+    index = vector_index.ExactIndex(["a", "b", "c"], vectors, metadata)
+
+    result = index.query(vector=[0.0, 2.0], top_k=2, include_metadata=True)
+    assert [match["id"] for match in result["matches"]] == ["c", "b"]
+    assert result["matches"][0]["score"] == pytest.approx(1.0)
+    assert result["matches"][1]["metadata"] == {"text": "b"}
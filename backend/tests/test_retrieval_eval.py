@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pytest
+
+from bench import retrieval_eval
+
+
+def small_corpus(size=50, dims=16):
+    rng = np.random.default_rng(1)
+    return retrieval_eval.Corpus(
+        "general",
+        [f"chunk_{i}" for i in range(size)],
+        rng.standard_normal((size, dims)).astype(np.float32),
+        [{} for _ in range(size)],
+    )
+
+
+def test_rank_metrics():
+    ranked = ["a", "b", "c", "d"]
+    assert retrieval_eval.recall_at_k(ranked, ["c", "z"], 2) == 0
+    assert retrieval_eval.recall_at_k(ranked, ["c", "z"], 3) == 0.5
+    assert retrieval_eval.reciprocal_rank(ranked, ["c", "z"]) == pytest.approx(1 / 3)
+    assert retrieval_eval.reciprocal_rank(ranked, ["z"]) == 0
+    assert retrieval_eval.overlap([["a", "x"]], [["a", "b"]], 2) == 0.5
+
+
+def test_exact_search_finds_known_items_among_distractors():
+    corpus = retrieval_eval.pad_corpus(small_corpus(), 500)
+    assert len(corpus.ids) == 500
+    questions = retrieval_eval.known_item_questions(corpus, noise=0.3)
+    assert len(questions) == 50
+
+    results = retrieval_eval.evaluate_corpus(corpus, questions, [1, 5], ["exact"])
+    assert results["exact"]["recall@1"] == 1.0
+    assert results["exact"]["mrr"] == 1.0
+    assert results["exact"]["memory_mb"] == pytest.approx(
+        500 * 16 * 4 / 2**20, abs=0.001
+    )
+
+
+def test_distractors_are_as_similar_to_the_corpus_as_its_own_vectors():
+    # Stored embeddings share a common direction, like real ones
+    rng = np.random.default_rng(2)
+    corpus = small_corpus(size=40, dims=64)
+    corpus.vectors = 3 * rng.standard_normal(64).astype(np.float32) + corpus.vectors
+    ids, vectors = retrieval_eval.stored(corpus)
+    own = (vectors @ vectors.T)[np.triu_indices(40, 1)]
+
+    padded = retrieval_eval.pad_corpus(corpus, 1040)
+    assert retrieval_eval.stored(padded)[0] == ids
+    distractors = padded.vectors[40:]
+    assert np.allclose(np.linalg.norm(distractors, axis=1), 1, atol=1e-5)
+    similarity = distractors @ vectors.T
+    assert np.median(similarity) == pytest.approx(np.median(own), abs=0.05)
+
+
+def test_labelled_questions_use_cached_vectors_and_score_recordings(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text(
+        json.dumps({"question": "BPA in cans?", "relevant": ["a", "b"]})
+        + "\n"
+        + json.dumps({"question": "Uncached?", "relevant": ["c"], "corpus": "tsv"})
+        + "\n"
+    )
+    questions = retrieval_eval.load_questions(str(path), {"BPA in cans?": [1.0, 0.0]})
+    assert questions[0].vector.tolist() == [1.0, 0.0]
+    assert questions[1].vector is None
+    assert questions[1].corpus == "tsv"
+
+    recorded = {"BPA in cans?": {"ids": ["x", "b", "a"], "latency_ms": 40.0}}
+    result = retrieval_eval.evaluate_recorded(recorded, questions, [1, 3])
+    assert result["questions"] == 1
+    assert result["recall@1"] == 0
+    assert result["recall@3"] == 1
+    assert result["mrr"] == 0.5
+    assert result["p50_ms"] == 40.0
@@ -0,0 +1,122 @@
+import pandas as pd
+import pytest
+
+from api import router
+
+
+def samples():
+    return pd.DataFrame(
+        {
+            "product": [
+                "Green Tea",
+                "Green Tea",
+                "Nuggets",
+                "Burger",
+                "Milk",
+                "Vitamins",
+            ],
+            "product_id": [79, 79, 40, 41, 12, 7],
+            "tags": [
+                "tea,beverages",
+                "tea,beverages",
+                "fast_food",
+                "fast_food",
+                "dairy,beverages",
+                "supplements,baby_food,plastic",
+            ],
+            "DEHP_ng_g": ["<10", "20", "230", "90", "40", "<LOQ"],
+            "DEHP_percent_tdi_70_kg_epa": ["<LOQ", "0.5", "12", "4", "1.5", "<LOQ"],
+            "DEHP_percent_tdi_14_kg_epa": ["<LOQ", "2.5", "60", "20", "7.5", "<LOQ"],
+            "BPA_ng_g": ["<LOQ", "3", "<LOQ", "8", "<LOQ", "<LOQ"],
+            "BPA_percent_tdi_70_kg_epa": ["<LOQ", "0.1", "<LOQ", "0.4", "<LOQ", "<LOQ"],
+        }
+    )
+
+
+def test_classify_intents():
+    query_router = router.QueryRouter(samples())
+    assert query_router.classify("top 3 foods by DEHP") == {
+        "intent": "top_products",
+        "chemical": "DEHP",
+        "top_n": 3,
+        "tag": None,
+    }
+    assert query_router.classify("average BPA in fast food")["tag"] == "fast food"
+    params = query_router.classify("Which products exceed 10% of the EPA TDI for kids?")
+    assert params["variant"] == "14_kg_epa" and params["threshold"] == 10.0
+
+
+def test_unrecognized_questions_fall_through():
+    query_router = router.QueryRouter(samples())
+    assert query_router.answer("Who runs PlasticList?") is None
+    assert query_router.answer("why is DEHP highest in fast food?") is None
+    assert query_router.answer("top products by DEHP and BPA") is None
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Is DEHP the most harmful chemical?",
+        "How is DEHP most commonly ingested?",
+        "Which DEHP sources matter most?",
+        "what are the top concerns about BPA",
+        "What does it mean to exceed 100% of the TDI?",
+        "is the average DEHP exposure from tea a concern",
+    ],
+)
+def test_conceptual_questions_go_to_the_model(question):
+    assert router.QueryRouter(samples()).classify(question) is None
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "top 3 foods by DEHP excluding supplements",
+        "top 5 products by DEHP that are not in plastic packaging",
+        "top 10 products by BPA other than milk",
+        "top 3 foods by DEHP without baby food",
+        "top 3 foods by DEHP besides tea",
+        "which products exceed 10% of the TDI for DEHP except baby food",
+        "top 3 foods by DEHP, supplements too",
+        "which products exceed 10% of the TDI, dairy included",
+        "how many products exceed 10% of the TDI for DEHP",
+        "what share of foods exceed 1% of the EPA TDI",
+    ],
+)
+def test_negated_unscoped_and_count_questions_go_to_the_model(question):
+    assert router.QueryRouter(samples()).classify(question) is None
+
+
+def test_routing_needs_a_ranked_object_and_scope():
+    query_router = router.QueryRouter(samples())
+    assert (
+        query_router.classify("which products are highest in BPA")["chemical"] == "BPA"
+    )
+    assert query_router.classify("top 2 fast food items by DEHP")["tag"] == "fast food"
+    assert (
+        query_router.classify("what is the average DEHP level in tea")["tag"] == "tea"
+    )
+    assert query_router.classify("top 3 products by DEHP in baby food")["tag"] == (
+        "baby food"
+    )
+    params = query_router.classify("which products exceed 1% of the TDI among dairy")
+    assert params["tag"] == "dairy"
+
+
+def test_answers():
+    query_router = router.QueryRouter(samples())
+    top = query_router.answer("top 2 products by DEHP").table
+    assert top["Product"].tolist() == ["Nuggets", "Burger"]
+
+    average = query_router.answer("average DEHP in beverages").table
+    assert average["Detected"].tolist() == [2]
+    assert average["Mean of detected (ng/g)"].tolist() == [30.0]
+
+    exceed = query_router.answer("which products exceed 1% of the EPA TDI?").table
+    assert exceed["Product"].tolist() == ["Nuggets", "Burger", "Milk"]
+
+
+def test_markdown_rendering():
+    pytest.importorskip("tabulate")
+    answer = router.QueryRouter(samples()).answer("top 2 products by DEHP")
+    assert "| Nuggets" in answer.to_markdown()
@@ -0,0 +1,83 @@
+import asyncio
+
+from api import runner
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+def test_subscribers_get_replayed_and_live_events():
+    async def scenario():
+        query_runner = runner.QueryRunner(grace_seconds=10)
+        release = asyncio.Event()
+        starts = []
+
+        async def generate():
+            starts.append(1)
+            yield "a"
+            await release.wait()
+            yield "b"
+
+        run = query_runner.start("q1", generate)
+        assert query_runner.start("q1", generate) is run
+        await asyncio.sleep(0.01)
+
+        late = asyncio.create_task(collect(query_runner.subscribe(run)))
+        await asyncio.sleep(0)
+        release.set()
+        assert await late == ["a", "b"]
+        assert starts == [1]
+        assert query_runner.get("q1") is None
+        assert await collect(query_runner.subscribe(run)) == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_run_is_cancelled_after_grace_without_subscribers():
+    async def scenario():
+        query_runner = runner.QueryRunner(grace_seconds=0.05)
+        outcome = []
+
+        async def generate():
+            yield "a"
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                outcome.append("cancelled")
+                raise
+            yield "never"
+
+        run = query_runner.start("q1", generate)
+        stream = query_runner.subscribe(run)
+        assert await stream.__anext__() == "a"
+
+        # Leaving and coming back within the grace period keeps the run alive
+        await stream.aclose()
+        await asyncio.sleep(0.02)
+        stream = query_runner.subscribe(run)
+        assert await stream.__anext__() == "a"
+        await asyncio.sleep(0.1)
+        assert not run.done.is_set()
+
+        await stream.aclose()
+        await asyncio.wait_for(run.done.wait(), 1)
+        assert outcome == ["cancelled"]
+        assert query_runner.get("q1") is None
+
+    asyncio.run(scenario())
+
+
+def test_run_nobody_subscribed_to_is_cancelled():
+    async def scenario():
+        query_runner = runner.QueryRunner(grace_seconds=0.01)
+
+        async def generate():
+            await asyncio.sleep(10)
+            yield "never"
+
+        run = query_runner.start("q1", generate)
+        await asyncio.wait_for(run.done.wait(), 1)
+        assert run.events == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from api import sandbox
+
+
+def frame():
+    return pd.DataFrame({"product": ["Milk", "Tea"], "DEHP_ng_g": [40.0, 20.0]})
+
+
+def test_isolated_run_returns_output_and_leaves_df_alone():
+    df = frame()
+    code = "df['DEHP_ng_g'] = 0\nprint(len(df))\nresult = df['DEHP_ng_g'].sum()"
+    output = asyncio.run(sandbox.run_python_isolated(code, df))
+    assert output == "Output:\n2\n\nResult variable:\n0"
+    assert df["DEHP_ng_g"].tolist() == [40.0, 20.0]
+    assert asyncio.run(sandbox.run_python_isolated("import os", df)).startswith(
+        "Error: Query contains forbidden operations"
+    )
+
+
+def test_slow_code_times_out_without_blocking_the_loop():
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        start = time.perf_counter()
+        output = await sandbox.run_python_isolated(
+            "while True:\n    pass", frame(), timeout=0.5
+        )
+        ticker.cancel()
+        return output, time.perf_counter() - start, ticks
+
+    output, elapsed, ticks = asyncio.run(scenario())
+    assert output == "Error executing query:\nTimed out after 0.5s"
+    assert elapsed < 2
+    assert ticks > 10
+
+
+def test_cancelling_the_caller_kills_the_worker():
+    async def scenario():
+        task = asyncio.create_task(
+            sandbox.run_python_isolated("while True:\n    pass", frame(), timeout=30)
+        )
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert not sandbox._FORK.active_children()
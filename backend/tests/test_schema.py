@@ -0,0 +1,31 @@
+import pandas as pd
+
+from api import schema
+
+
+def samples():
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "product": ["Green Tea", "Green Tea", "Nuggets"],
+            "serving_size_g": [370, 370, 90],
+            "DEHP_ng_g": ["<10", "20", "230"],
+            "DEHP_percent_tdi_70_kg_epa": ["<LOQ", "0.5", "12"],
+            "DINP_ng_g": ["<LOQ", "<LOQ", "<LOQ"],
+            "DINP_percent_tdi_70_kg_epa": ["NO RfD", "NO RfD", "NO RfD"],
+        }
+    )
+
+
+def test_catalog_groups_columns_by_family():
+    catalog = schema.build_catalog(samples())
+    lines = catalog.splitlines()
+    assert "- serving_size_g: int; 3 non-null; 2 distinct; 90..370" in lines
+    assert "- product: text; 3 non-null; 2 distinct; e.g. 'Green Tea'" in lines
+    assert "Chemicals (2): DEHP, DINP" in lines
+    assert not any(line.startswith("- DEHP_ng_g") for line in lines)
+
+    ng_g = next(line for line in lines if line.startswith("- *_ng_g:"))
+    assert "2 of 6 values numeric, 20..230; codes <LOQ, <10" in ng_g
+    tdi = next(line for line in lines if line.startswith("- *_percent_tdi_70_kg_epa"))
+    assert tdi.endswith("numbers only for DEHP")
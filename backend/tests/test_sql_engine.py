@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from api import sql_engine
+
+
+def samples():
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "product": ["Green Tea", "Green Tea", "Nuggets"],
+            "product_id": [79, 79, 40],
+            "tags": ["tea,beverages", "tea,beverages", "fast_food"],
+            "DEHP_ng_g": ["<10", "20", "230"],
+            "DEHP_percent_tdi_70_kg_epa": ["<LOQ", "0.5", "12"],
+        }
+    )
+
+
+def test_measurements_are_numeric_and_tags_joinable():
+    engine = sql_engine.SQLEngine(samples())
+    assert engine.query("SELECT COUNT(DEHP_ng_g), MAX(DEHP_ng_g) FROM samples") == (
+        "| COUNT(DEHP_ng_g) | MAX(DEHP_ng_g) |\n|---|---|\n| 2 | 230.0 |"
+    )
+    result = engine.query(
+        "SELECT DISTINCT s.product FROM samples s "
+        "JOIN sample_tags t ON t.sample_id = s.id WHERE t.tag = 'fast_food'"
+    )
+    assert result.splitlines()[2] == "| Nuggets |"
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "DELETE FROM samples",
+        "PRAGMA query_only = OFF",
+        "ATTACH 'other.db' AS other",
+        "SELECT 1; SELECT 2",
+        "SELECT * FROM missing",
+    ],
+)
+def test_rejected_statements(statement):
+    with pytest.raises(sql_engine.SQLError):
+        sql_engine.SQLEngine(samples()).query(statement)
+
+
+def test_row_limit_timeout_and_cache():
+    engine = sql_engine.SQLEngine(samples(), timeout=0.05, max_rows=2)
+    assert "showing the first 2 rows" in engine.query("SELECT id FROM samples")
+    with pytest.raises(sql_engine.SQLError, match="timed out"):
+        engine.query(
+            "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) "
+            "SELECT COUNT(*) FROM n"
+        )
+    engine.query("SELECT  product FROM samples;")
+    engine.query("SELECT product\nFROM samples")
+    assert engine._cached_execute.cache_info().hits == 1
+    assert sql_engine.normalize_sql("SELECT  'a  b' ;") == "SELECT 'a  b'"
+
+
+def test_cancel_interrupts_a_running_statement():
+    engine = sql_engine.SQLEngine(samples(), timeout=30)
+    cancelled = threading.Event()
+    threading.Timer(0.05, cancelled.set).start()
+    start = time.monotonic()
+    with pytest.raises(sql_engine.SQLError, match="cancelled"):
+        engine.query(
+            "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) "
+            "SELECT COUNT(*) FROM n",
+            cancelled,
+        )
+    assert time.monotonic() - start < 5
+    assert "Green Tea" in engine.query("SELECT product FROM samples")
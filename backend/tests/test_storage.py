@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from api import storage
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "queries.db"))
+    store.insert(
+        {
+            "id": "q1",
+            "conversation_id": "c1",
+            "question": "Any phthalates in milk?",
+            "status": "processing",
+            "created_at": "2025-01-01T00:00:00",
+        }
+    )
+    store.insert({"id": "q2", "conversation_id": "c2", "question": "Other"})
+    store.update(
+        "q1",
+        {"status": "completed", "response": "Yes.", "usage": {"stages": {"a": 1}}},
+    )
+
+    row = store.get("q1")
+    assert row["status"] == "completed"
+    assert row["response"] == "Yes."
+    assert row["usage"] == {"stages": {"a": 1}}
+    assert store.get("missing") is None
+    assert [row["id"] for row in store.conversation("c1")] == ["q1"]
+
+    mode = store.conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+    store.close()
+
+
+def test_sqlite_store_rejects_unknown_columns(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "queries.db"))
+    store.insert({"id": "q1"})
+    # Same failure a database without the column gives, which callers handle
+    with pytest.raises(sqlite3.OperationalError):
+        store.update("q1", {"status": "done", "'; DROP TABLE queries; --": 1})
+    assert store.get("q1")["status"] is None
+
+
+def test_open_store_reads_config(tmp_path, monkeypatch):
+    monkeypatch.setenv("QUERY_STORE_PATH", str(tmp_path / "store.db"))
+    store = storage.open_store("sqlite")
+    assert isinstance(store.store, storage.SQLiteStore)
+    assert store.store.path == str(tmp_path / "store.db")
+    with pytest.raises(ValueError):
+        storage.open_store("mongo")
+
+
+def test_stores_must_implement_every_method():
+    class ReadOnlyStore(storage.QueryStore):
+        def get(self, query_id):
+            return None
+
+    with pytest.raises(TypeError, match="conversation"):
+        ReadOnlyStore()
+
+
+def test_conversation_pages_most_recent_turns_first(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "queries.db"))
+    for turn in range(5):
+        store.insert(
+            {
+                "id": f"q{turn}",
+                "conversation_id": "c1",
+                "question": f"Question {turn}",
+                "response": "x" * 1000,
+                # Inserted out of order; reads sort by created_at
+                "created_at": f"2025-01-01T00:00:0{4 - turn}",
+            }
+        )
+
+    page = store.conversation("c1", limit=2, columns=["id", "created_at"])
+    assert page == [
+        {"id": "q1", "created_at": "2025-01-01T00:00:03"},
+        {"id": "q0", "created_at": "2025-01-01T00:00:04"},
+    ]
+    older = store.conversation(
+        "c1", limit=2, before=storage.decode_cursor(storage.encode_cursor(page[0]))
+    )
+    assert [row["id"] for row in older] == ["q3", "q2"]
+    assert older[0]["response"] == "x" * 1000
+    assert [row["id"] for row in store.conversation("c1")] == [
+        "q4",
+        "q3",
+        "q2",
+        "q1",
+        "q0",
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        store.conversation("c1", columns=["id", "password"])
+
+
+def test_conversation_cursor_keeps_turns_with_the_same_timestamp(tmp_path):
+    store = storage.SQLiteStore(str(tmp_path / "queries.db"))
+    for turn in range(5):
+        store.insert(
+            {
+                "id": f"q{turn}",
+                "conversation_id": "c1",
+                "question": f"Question {turn}",
+                "created_at": "2025-01-01T00:00:00",
+            }
+        )
+
+    seen, before = [], None
+    while True:
+        page = store.conversation("c1", limit=2, before=before, columns=["id"])
+        if not page:
+            break
+        seen = [row["id"] for row in page] + seen
+        before = ("2025-01-01T00:00:00", page[0]["id"])
+    assert seen == ["q0", "q1", "q2", "q3", "q4"]
+    # A bare created_at cursor still means strictly before it
+    assert storage.decode_cursor("2025-01-01T00:00:00") == ("2025-01-01T00:00:00", "")
+    assert store.conversation("c1", before=("2025-01-01T00:00:00", "")) == []
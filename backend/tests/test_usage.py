@@ -0,0 +1,54 @@
+from api import usage
+
+
+def test_ledger_accumulates_stages_and_cost():
+    ledger = usage.UsageLedger("query-1", "/api/query/{query_id}/stream")
+    ledger.add(
+        "generation",
+        "claude-3-5-sonnet-20241022",
+        {"input_tokens": 1000, "cache_read_input_tokens": 2000},
+    )
+    ledger.add("generation", "claude-3-5-sonnet-20241022", {"output_tokens": 500})
+    ledger.set_section("history", "x" * 400)
+
+    stage = ledger.stages["generation"]
+    assert stage["input_tokens"] == 1000
+    assert stage["output_tokens"] == 500
+    assert stage["cost_usd"] == round((1000 * 3 + 500 * 15 + 2000 * 0.3) / 1e6, 6)
+    assert ledger.sections["history"] == 100
+
+
+def test_rollup_groups_by_endpoint_and_stage():
+    rollup = usage.UsageRollup()
+    for _ in range(2):
+        ledger = usage.UsageLedger("q", "/api/query/generate-followups")
+        ledger.add("followups", "claude-3-haiku-20240307", {"input_tokens": 10})
+        ledger.set_section("answer", "abcd")
+        rollup.add(ledger, latency_ms=20.0)
+
+    snapshot = rollup.snapshot()["/api/query/generate-followups"]
+    assert snapshot["stages"]["followups"]["calls"] == 2
+    assert snapshot["stages"]["followups"]["input_tokens"] == 20
+    assert snapshot["sections"]["answer"]["avg_tokens"] == 1
+    assert snapshot["sections"]["answer"]["avg_request_latency_ms"] == 20.0
+
+
+def test_added_stage_updates_stored_totals():
+    answer = usage.UsageLedger("query-1", "/api/query/{query_id}/stream")
+    answer.add("generation", "claude-3-5-sonnet-20241022", {"input_tokens": 1000})
+    followups = usage.UsageLedger("query-1", "/api/query/generate-followups")
+    followups.add("followups", "claude-3-haiku-20240307", {"output_tokens": 400})
+
+    stored = usage.with_stage(
+        answer.to_dict(), "followups", followups.stages["followups"]
+    )
+    assert set(stored["stages"]) == {"generation", "followups"}
+    assert stored["totals"]["input_tokens"] == 1000
+    assert stored["totals"]["output_tokens"] == 400
+    assert stored["totals"]["cost_usd"] == round(0.003 + 0.0005, 6)
+    assert (
+        usage.with_stage(None, "followups", {"output_tokens": 1})["totals"][
+            "output_tokens"
+        ]
+        == 1
+    )
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from api import vector_index
+
+
+def random_store(tmp_path, size=2000, dims=64):
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((size, dims)).astype(np.float32)
+    ids = [f"chunk_{i}" for i in range(size)]
+    path = tmp_path / "embeddings.txt"
+    path.write_text("[]")
+    vector_index.write_quantized(path, ids, vectors, [{"n": i} for i in ids])
+    return path, ids, vectors, rng
+
+
+@pytest.mark.parametrize("kind", ["int8", "binary"])
+def test_quantized_search_matches_exact_top_k(tmp_path, kind):
+    path, ids, vectors, rng = random_store(tmp_path)
+    exact = vector_index.ExactIndex(ids, vectors, [{} for _ in ids])
+    index = vector_index.QuantizedIndex.open(path, kind)
+    for row in rng.choice(len(ids), 20, replace=False):
+        query = vectors[row] + 0.3 * rng.standard_normal(vectors.shape[1])
+        expected = exact.query(query, top_k=10)["matches"]
+        found = index.query(query, top_k=10, include_metadata=True)["matches"]
+        assert found[0]["id"] == ids[row]
+        assert found[0]["metadata"] == {"n": ids[row]}
+        # Rescored in full precision, so shared hits carry exact scores
+        exact_scores = {match["id"]: match["score"] for match in expected}
+        for match in found:
+            if match["id"] in exact_scores:
+                assert match["score"] == pytest.approx(exact_scores[match["id"]])
+
+
+def test_quantized_index_memory_and_lazy_full_precision(tmp_path):
+    path, ids, vectors, _ = random_store(tmp_path)
+    int8 = vector_index.QuantizedIndex.open(path, "int8")
+    binary = vector_index.QuantizedIndex.open(path, "binary")
+    assert isinstance(int8.full, np.memmap)
+    assert int8.nbytes * 3.9 < vectors.nbytes
+    assert binary.nbytes * 32 == vectors.nbytes
+
+
+def test_load_index_writes_missing_or_stale_sidecars(tmp_path, monkeypatch):
+    path = tmp_path / "embeddings.txt"
+    records = [
+        {"id": f"c{i}", "values": [float(i), 1.0, -1.0], "metadata": {}}
+        for i in range(5)
+    ]
+    path.write_text(json.dumps(records))
+    monkeypatch.setenv("LOCAL_INDEX_QUANTIZATION", "int8")
+    index = vector_index.load_index(path)
+    assert isinstance(index, vector_index.QuantizedIndex) and len(index) == 5
+    assert vector_index.quantized_current(path)
+
+    meta = vector_index.sidecar_path(path, "meta.json")
+    earlier = os.path.getmtime(path) - 10
+    os.utime(meta, (earlier, earlier))
+    assert not vector_index.quantized_current(path)
+    vector_index.load_index(path)
+    assert vector_index.quantized_current(path)
+
+    assert isinstance(vector_index.load_index(path, "none"), vector_index.ExactIndex)
+    with pytest.raises(ValueError):
+        vector_index.load_index(path, "pq")
@@ -0,0 +1,123 @@
+"""Run a file of questions through POST /api/batch, writing results as JSON Lines.
+
+Questions come from a text file (one per line) or a JSONL file of
+{"id", "question"} objects; plain lines get their line number as id.
+Results are appended to --output as they arrive, one line per question.
+Re-running with the same output resumes: questions that already have an
+"ok" line are skipped, and failed ones are tried again.
+
+    python utils/batch_questions.py questions.txt --output results.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List
+
+import requests
+
+# Questions per request; the API accepts up to BATCH_MAX_ITEMS (1000 by default)
+DEFAULT_CHUNK_SIZE = 200
+
+
+def load_questions(path: str) -> List[Dict]:
+    items = []
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                items.append(
+                    {"id": str(entry.get("id", number)), "question": entry["question"]}
+                )
+            else:
+                items.append({"id": str(number), "question": line})
+    return items
+
+
+def completed_ids(path: str) -> set:
+    """Ids whose latest line in an earlier output says "ok"."""
+    status = {}
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by an interrupted run
+                continue
+            status[str(result.get("id"))] = result.get("status")
+    return {item_id for item_id, value in status.items() if value == "ok"}
+
+
+def stream_batch(
+    url: str, items: List[Dict], concurrency: int, timeout: float
+) -> Iterator[Dict]:
+    response = requests.post(
+        f"{url.rstrip('/')}/api/batch",
+        json={"items": items, "concurrency": concurrency},
+        stream=True,
+        timeout=timeout,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"API returned {response.status_code}: {response.text}")
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="Text file or .jsonl of questions")
+    parser.add_argument("--output", required=True, help="JSONL results file")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Questions sent per request",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600.0, help="Seconds to wait for each result"
+    )
+    args = parser.parse_args()
+
+    items = load_questions(args.questions)
+    done = completed_ids(args.output)
+    pending = [item for item in items if item["id"] not in done]
+    print(
+        f"{len(items)} questions, {len(items) - len(pending)} already answered, "
+        f"{len(pending)} to run",
+        file=sys.stderr,
+    )
+
+    counts = {"ok": 0, "error": 0}
+    start = time.perf_counter()
+    with open(args.output, "a") as out:
+        for offset in range(0, len(pending), args.chunk_size):
+            chunk = pending[offset : offset + args.chunk_size]
+            for result in stream_batch(args.url, chunk, args.concurrency, args.timeout):
+                out.write(json.dumps(result) + "\n")
+                # Flushed per line, so an interrupted run loses only in-flight items
+                out.flush()
+                status = "ok" if result.get("status") == "ok" else "error"
+                counts[status] += 1
+                if status == "error":
+                    print(f"{result['id']}: {result.get('error')}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{counts['ok']} ok, {counts['error']} failed in {elapsed:.1f}s",
+        file=sys.stderr,
+    )
+    sys.exit(1 if counts["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Build or update the IVF index next to a stored vector file.
+
+A build trains k-means centroids over every stored vector and writes the
+inverted lists beside the store (embeddings.ivf_*.npy, embeddings.ivf.json,
+and the lists' metadata in embeddings.ivf_metadata.jsonl). --update adds
+only the records the index doesn't have yet, under the existing
+centroids. Run a full build again to drop deleted records, or
+once the corpus has grown or shifted enough that the centroids no longer
+fit it.
+
+    python utils/build_ivf_index.py
+    python utils/build_ivf_index.py utils/tsv_embeddings.txt --nlist 256
+    python utils/build_ivf_index.py --update
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Allow running as `python utils/build_ivf_index.py` from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from api import ivf, vector_index
+from api.lexical import GENERAL_CHUNKS_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def build(path, nlist, seed):
+    ids, vectors, metadata = vector_index.read_vectors(path)
+    start = time.perf_counter()
+    index = ivf.IVFIndex.build(ids, vectors, metadata, nlist=nlist, seed=seed)
+    index.save(path)
+    logger.info(
+        "Built %d lists over %d vectors in %.1fs",
+        index.nlist,
+        len(index),
+        time.perf_counter() - start,
+    )
+
+
+def update(path):
+    index = ivf.load_ivf(path)
+    if index is None:
+        raise SystemExit(f"No IVF index next to {path}; build one first")
+    ids, vectors, metadata = vector_index.read_vectors(path)
+    indexed = set(index.ids) | set(index.delta_ids)
+    new = [i for i, item_id in enumerate(ids) if item_id not in indexed]
+    if not new:
+        logger.info("Index already has all %d vectors", len(index))
+        index.save()
+        return
+    index.insert([ids[i] for i in new], vectors[new], [metadata[i] for i in new])
+    index.save()
+    logger.info("Inserted %d vectors; index now has %d", len(new), len(index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "path", nargs="?", default=str(GENERAL_CHUNKS_PATH), help="Stored vector file"
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Insert records missing from the index instead of rebuilding",
+    )
+    parser.add_argument(
+        "--nlist", type=int, help="Lists to train (default: 2 x sqrt(vectors))"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.update:
+        update(args.path)
+    else:
+        build(args.path, args.nlist, args.seed)
+
+
+if __name__ == "__main__":
+    main()
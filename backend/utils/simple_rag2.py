@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from typing import List, Dict
 import requests
@@ -14,12 +15,19 @@ from langchain_text_splitters import (
     RecursiveCharacterTextSplitter,
 )
 
+# Load environment variables from .env, before the api modules read them
+load_dotenv()
+
+# Allow running as `python utils/simple_rag2.py` from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from api import ratelimit, vector_index
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env
-load_dotenv()
+# Ingestion is batch work: it would rather wait for capacity than fail
+INGEST_MAX_WAIT_SECONDS = 120
 
 
 class SimpleRAG:
@@ -35,6 +43,8 @@ class SimpleRAG:
         self.anthropic = Anthropic()
         self.index_name = index_name
         self.voyage_url = "https://api.voyageai.com/v1/embeddings"
+        self.voyage_limiter = ratelimit.limiter("voyage")
+        self.anthropic_limiter = ratelimit.limiter("anthropic")
 
         # Initialize text splitter
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -73,12 +83,16 @@ class SimpleRAG:
         data = {"model": "voyage-3-large", "input": text}
 
         try:
-            # Add a small delay between requests to respect rate limits
-            time.sleep(0.05)
+            # Wait for room under the shared Voyage request/token limits
+            self.voyage_limiter.acquire_sync(
+                ratelimit.estimate_tokens(text), max_wait=INGEST_MAX_WAIT_SECONDS
+            )
 
             logger.debug("Sending request to Voyage AI")
             response = requests.post(self.voyage_url, headers=headers, json=data)
 
+            if response.status_code == 429:
+                raise self.voyage_limiter.throttled(response.headers.get("retry-after"))
             if response.status_code != 200:
                 logger.error(
                     f"Voyage API error: {response.status_code} - {response.text}"
@@ -183,6 +197,8 @@ class SimpleRAG:
         try:
             with open(filepath, "w") as f:
                 json.dump(vectors, f)
+            # int8/binary copies for local quantized search (LOCAL_INDEX_QUANTIZATION)
+            vector_index.write_quantized(filepath, *vector_index.split_records(vectors))
             logger.info("Vectors saved successfully")
         except Exception as e:
             logger.error(f"Error saving vectors: {e}")
@@ -282,6 +298,9 @@ class SimpleRAG:
     """
 
         # Get response from Claude
+        self.anthropic_limiter.acquire_sync(
+            ratelimit.estimate_tokens(prompt), max_wait=INGEST_MAX_WAIT_SECONDS
+        )
         response = self.anthropic.beta.messages.create(
             model="claude-3-sonnet-20240229",
             max_tokens=1000,
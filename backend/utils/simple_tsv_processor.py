@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from typing import List, Dict
 import requests
@@ -12,12 +13,20 @@ import backoff
 import logging
 import json
 
+# Load environment variables from .env, before the api modules read them
+load_dotenv()
+
+# Allow running as `python utils/simple_tsv_processor.py` from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from api import ratelimit, vector_index
+from api.dataset import IMPORTANT_COLUMNS, format_row_text
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env
-load_dotenv()
+# Ingestion is batch work: it would rather wait for capacity than fail
+INGEST_MAX_WAIT_SECONDS = 120
 
 
 class TSVProcessor:
@@ -32,30 +41,10 @@ class TSVProcessor:
         # Initialize settings
         self.index_name = index_name
         self.voyage_url = "https://api.voyageai.com/v1/embeddings"
+        self.voyage_limiter = ratelimit.limiter("voyage")
 
-        # Important columns to process
-        self.important_columns = [
-            "id",
-            "product_id",
-            "product",
-            "tags",
-            "triplicate_1_sample_id",
-            "triplicate_2_sample_id",
-            "lot_no",
-            "manufacturing_date",
-            "expiration_date",
-            "collected_on",
-            "collected_at",
-            "collection_notes",
-            "blinded_name",
-            "blinded_photo",
-            "shipped_on",
-            "shipped_in",
-            "shipment_type",
-            "arrived_at_lab_on",
-            "analysis_method_phthalates",
-            "analysis_method_bisphenols",
-        ]
+        # Important columns to process (shared with the API's lexical index)
+        self.important_columns = IMPORTANT_COLUMNS
 
         # Initialize Pinecone
         self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
@@ -111,12 +100,16 @@ class TSVProcessor:
         data = {"model": "voyage-3-large", "input": text}
 
         try:
-            # Add a small delay between requests to respect rate limits
-            time.sleep(0.01)
+            # Wait for room under the shared Voyage request/token limits
+            self.voyage_limiter.acquire_sync(
+                ratelimit.estimate_tokens(text), max_wait=INGEST_MAX_WAIT_SECONDS
+            )
 
             logger.debug("Sending request to Voyage AI")
             response = requests.post(self.voyage_url, headers=headers, json=data)
 
+            if response.status_code == 429:
+                raise self.voyage_limiter.throttled(response.headers.get("retry-after"))
             if response.status_code != 200:
                 logger.error(
                     f"Voyage API error: {response.status_code} - {response.text}"
@@ -142,21 +135,8 @@ class TSVProcessor:
 
     def format_row_text(self, row) -> str:
         """Format a row's data into a meaningful text string for embedding."""
-        text_parts = []
         logger.debug(f"Processing row with product: {row.get('product', 'N/A')}")
-
-        # Add each non-null field with its header
-        for col in self.important_columns:
-            if pd.notna(row[col]) and row[col] != "":
-                # Clean and format the value
-                value = str(row[col]).strip()
-                if value:
-                    text_parts.append(f"{col}: {value}")
-                    logger.debug(
-                        f"Added field {col}: {value[:100]}..."
-                    )  # Show first 100 chars
-
-        final_text = " | ".join(text_parts)
+        final_text = format_row_text(row)
         logger.debug(f"Final formatted text (first 200 chars): {final_text[:200]}...")
         return final_text
 
@@ -238,6 +218,8 @@ class TSVProcessor:
         try:
             with open(filepath, "w") as f:
                 json.dump(vectors, f)
+            # int8/binary copies for local quantized search (LOCAL_INDEX_QUANTIZATION)
+            vector_index.write_quantized(filepath, *vector_index.split_records(vectors))
             logger.info("Vectors saved successfully")
         except Exception as e:
             logger.error(f"Error saving vectors: {e}")
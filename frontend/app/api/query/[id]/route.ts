@@ -5,6 +5,9 @@ export const runtime = "edge";
 
 const API_URL = "https://plasticlist-production-9df0.up.railway.app";
 
+// Only the columns the conversation view renders; full rows carry much more
+const CONVERSATION_FIELDS = "id,question,response,status";
+
 export async function GET(
   request: NextRequest,
   context: { params: Promise<{ id: string }> }
@@ -22,8 +25,17 @@ export async function GET(
       });
     }
 
-    // 2. Fetch the conversation from your Python backend
-    const response = await fetch(`${API_URL}/api/query/${id}`, {
+    // 2. Fetch one page of the conversation from your Python backend: the
+    // latest turns, or those before the `before` cursor when the page
+    // asks for earlier turns
+    const params = new URLSearchParams({ fields: CONVERSATION_FIELDS });
+    for (const name of ["before", "limit"]) {
+      const value = request.nextUrl.searchParams.get(name);
+      if (value) {
+        params.set(name, value);
+      }
+    }
+    const response = await fetch(`${API_URL}/api/query/${id}?${params}`, {
       method: "GET",
     });
 
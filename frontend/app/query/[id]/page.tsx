@@ -1,6 +1,6 @@
 'use client';
 
-import { use, useEffect, useRef, useState } from 'react';
+import { use, useEffect, useLayoutEffect, useRef, useState } from 'react';
 
 import FixedFollowupForm from '../../components/FixedFollowupForm';
 import ReactMarkdown from 'react-markdown';
@@ -31,6 +31,7 @@ interface CurrentQuery extends ConversationQuery {
 interface QueryData {
   current_query: CurrentQuery;
   conversation: ConversationQuery[];
+  next_cursor: string | null;
 }
 
 interface PageParams {
@@ -56,6 +57,10 @@ export default function QueryPage({ params }: PageParams) {
   const [suggestedFollowups, setSuggestedFollowups] = useState<string[]>([]);
   const [loadingFollowups, setLoadingFollowups] = useState(false);
 
+  // Earlier turns are fetched a page at a time as the user scrolls up
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
+
   // SSE tracking
   const [isStreaming, setIsStreaming] = useState(false);
   const [activeQueryId, setActiveQueryId] = useState<string | null>(null);
@@ -117,6 +122,12 @@ export default function QueryPage({ params }: PageParams) {
 
   // 3. Scroll ref (we'll scroll to bottom on conversation change)
   const bottomRef = useRef<HTMLDivElement>(null);
+  const scrollRef = useRef<HTMLDivElement>(null);
+  // Distance from the bottom to keep while earlier turns are prepended
+  const earlierOffsetRef = useRef<number | null>(null);
+  const prependedRef = useRef(false);
+  const loadingEarlierRef = useRef(false);
+  const lastScrollTopRef = useRef(0);
 
   // 4. Fetch conversation data once on mount
   useEffect(() => {
@@ -136,8 +147,9 @@ export default function QueryPage({ params }: PageParams) {
         // setConversationId(data.current_query[0].conversation_id);
         setConversationId(data.current_query.conversation_id);
 
-        // Build an array of all queries
+        // The latest page of queries; earlier ones load on scroll
         setConversation(data.conversation);
+        setNextCursor(data.next_cursor);
 
         // If the current query is still processing, open SSE
         if (data.current_query.status === 'processing') {
@@ -154,7 +166,61 @@ export default function QueryPage({ params }: PageParams) {
     fetchConversation();
   }, [queryId]);
 
+  const loadEarlier = async () => {
+    const container = scrollRef.current;
+    if (!nextCursor || !container || loadingEarlierRef.current) return;
+
+    try {
+      loadingEarlierRef.current = true;
+      setLoadingEarlier(true);
+
+      const res = await fetch(
+        `/api/query/${queryId}?before=${encodeURIComponent(nextCursor)}`
+      );
+      if (!res.ok) {
+        throw new Error(`API returned ${res.status}`);
+      }
+
+      const data: QueryData = await res.json();
+      earlierOffsetRef.current = container.scrollHeight - container.scrollTop;
+      setConversation((prev) => {
+        const seen = new Set(prev.map((item) => item.id));
+        return [...data.conversation.filter((item) => !seen.has(item.id)), ...prev];
+      });
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Fetch error:', error);
+      setError('Failed to fetch earlier turns');
+    } finally {
+      loadingEarlierRef.current = false;
+      setLoadingEarlier(false);
+    }
+  };
+
+  // Only scrolling up near the top loads more, not the initial scroll down
+  const handleScroll = (event: React.UIEvent<HTMLDivElement>) => {
+    const { scrollTop } = event.currentTarget;
+    const scrolledUp = scrollTop < lastScrollTopRef.current;
+    lastScrollTopRef.current = scrollTop;
+    if (scrolledUp && scrollTop < 100) {
+      loadEarlier();
+    }
+  };
+
+  // Keep the turns on screen in place when earlier ones are prepended
+  useLayoutEffect(() => {
+    const container = scrollRef.current;
+    if (earlierOffsetRef.current === null || !container) return;
+    container.scrollTop = container.scrollHeight - earlierOffsetRef.current;
+    earlierOffsetRef.current = null;
+    prependedRef.current = true;
+  }, [conversation]);
+
   useEffect(() => {
+    if (prependedRef.current) {
+      prependedRef.current = false;
+      return;
+    }
     if (conversation.length > 0 && bottomRef.current && !loading) {
       bottomRef.current.scrollIntoView({
         behavior: 'smooth',
@@ -340,6 +406,8 @@ export default function QueryPage({ params }: PageParams) {
     <>
 
       <Container
+        ref={scrollRef}
+        onScroll={handleScroll}
         maxWidth="md"
         sx={{
           py: 4,
@@ -379,6 +447,19 @@ export default function QueryPage({ params }: PageParams) {
               </Box>
             )}
 
+            {/* Earlier turns */}
+            {(nextCursor || loadingEarlier) && (
+              <Box sx={{ display: 'flex', justifyContent: 'center', mb: 2 }}>
+                {loadingEarlier ? (
+                  <CircularProgress size={20} />
+                ) : (
+                  <Button size="small" onClick={loadEarlier}>
+                    Show earlier turns
+                  </Button>
+                )}
+              </Box>
+            )}
+
             {/* Render conversation */}
             {conversation.map((q) => (
               <Box